@@ -73,6 +73,12 @@ def main():
         default='',
         help="the full path of the file destination in target host")
 
+    parser.add_argument(
+        "--sensor-protocol",
+        type=int,
+        default=1,
+        help="the version of the frames sent by the sensor board")
+
     args = parser.parse_args()
 
     logconfig_kwargs = {}
@@ -154,7 +160,7 @@ def main():
     def override_button_handler(*args, **kwargs):
         cam_control.cancel_requested()
     
-    sc = SensorControl(0x27)
+    sc = SensorControl(0x27, protocol_version=args.sensor_protocol)
     sc.add_event_handler('parking_status_changed', parking_control_status_changed, sc=sc)
     sc.add_parking_data_update_callback(parking_control_update_callback)
 
@@ -3,6 +3,9 @@ import logging
 from smbus2 import SMBus
 from twisted.internet.task import LoopingCall
 
+from garage_watch.sensor_frames import (
+    EVENT_BUTTON, EVENT_DOOR_OPEN, EVENT_DOOR_CLOSED, SensorFrame, get_decoder)
+
 bus = SMBus(1)
 
 logger = logging.getLogger(__name__)
@@ -10,25 +13,34 @@ logger = logging.getLogger(__name__)
 def _periodic_check_door(instance):
     try:
         try:
-            bus_data = bus.read_i2c_block_data(instance.sensor_i2c_address, 0, 8)
+            bus_data = bus.read_i2c_block_data(
+                instance.sensor_i2c_address, 0, instance.decoder.LENGTH)
         except OSError:
             return
-        for data_byte in bus_data[0:5]:
+        frame = instance.decoder.decode_into(bus_data, instance.frame)
+
+        for code in frame.events:
             # check sensor events
-            if data_byte == 0x01:
+            if code == EVENT_DOOR_OPEN:
                 instance._send_event('door_open')
-            elif data_byte == 0x02:
+            elif code == EVENT_DOOR_CLOSED:
                 instance._send_event('door_closed')
-            elif data_byte == 0x03:
+            elif code == EVENT_BUTTON:
                 instance._send_event('cancel_requested')
 
+        # protocols reporting the door level send events on its changes
+        if frame.door_open is not None and frame.door_open != instance.door_open:
+            if instance.door_open is not None:
+                instance._send_event('door_open' if frame.door_open else 'door_closed')
+            instance.door_open = frame.door_open
+
         # check parking mode
-        parking_status = bus_data[5]
-            
+        parking_status = frame.parking_status
+
         if parking_status != 0x00 or instance.parking_status != 0x00:
             instance.parking_mode = (parking_status == 0x00)
-            instance.parking_distance[0] = bus_data[6]
-            instance.parking_distance[1] = bus_data[7]
+            instance.parking_distance[0] = frame.parking_distance[0]
+            instance.parking_distance[1] = frame.parking_distance[1]
 
             if parking_status != instance.parking_status:
                 instance._send_event('parking_status_changed', parking_status, instance.parking_status)
@@ -51,8 +63,12 @@ class SensorControl(object):
 
     event_handlers = None
     parking_event_callbacks = None
-    def __init__(self, i2c_address):
+    def __init__(self, i2c_address, protocol_version=1):
         self.sensor_i2c_address = i2c_address
+        # layout of the frames, see garage_watch.sensor_frames
+        self.decoder = get_decoder(protocol_version)
+        self.frame = SensorFrame()
+        self.door_open = None
         self.lc = None
         self.event_handlers = {k:[] for k in self.EVENTS}
         self.parking_event_callbacks = []
@@ -0,0 +1,165 @@
+"""
+Pool of preallocated buffers to capture pictures into
+
+Captures write into a leased `PooledBuffer` instead of a new growing
+`BytesIO`, and the buffer goes back to the pool when the `Frame` wrapping
+it is released by all its consumers. The size of new buffers follows the
+size of the recent captures so they rarely need to grow.
+"""
+import logging
+import threading
+
+from collections import deque
+
+from .frame_bus import Frame
+
+# logger for the script
+logger = logging.getLogger(__name__)
+
+# buffer sizes are rounded up to this amount of bytes
+SIZE_ALIGNMENT = 4096
+
+
+def _align(size):
+    return -(-int(size) // SIZE_ALIGNMENT) * SIZE_ALIGNMENT
+
+
+class PooledBuffer(object):
+    """
+    File-like object writing into a preallocated bytearray. Only
+    supports sequential writes which is what picamera does
+    """
+
+    def __init__(self, pool, size):
+        self.pool = pool
+        self.data = bytearray(size)
+        self.length = 0
+
+    def write(self, buf):
+        n = len(buf)
+        end = self.length + n
+        if end > len(self.data):
+            self.pool._grow(self, end)
+        self.data[self.length:end] = buf
+        self.length = end
+        return n
+
+    def flush(self):
+        pass
+
+
+class BufferPool(object):
+    """
+    Keeps up to `count` free buffers around. Leasing when the pool is
+    empty allocates a new buffer (a miss), buffers released when the pool
+    is full or far from the recent capture sizes are dropped
+    """
+
+    def __init__(self, count=3, initial_size=256 * 1024, history=10, headroom=1.25):
+        self.count = count
+        self.initial_size = _align(initial_size)
+        self.headroom = headroom
+        self.recent_sizes = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+        # statistics
+        self.allocations = 0
+        self.growths = 0
+        self.leases = 0
+        self.misses = 0
+        self.dropped = 0
+        self.in_use = 0
+        self.current_bytes = 0
+        self.peak_bytes = 0
+
+        self.free = [self._allocate(self.initial_size) for _ in range(count)]
+
+    def target_size(self):
+        """
+        Size for new buffers, enough for the largest recent capture
+        """
+        if not self.recent_sizes:
+            return self.initial_size
+        return _align(max(self.recent_sizes) * self.headroom)
+
+    def lease(self):
+        """
+        Get an empty buffer to capture into
+        """
+        with self._lock:
+            self.leases += 1
+            self.in_use += 1
+            if self.free:
+                buffer = self.free.pop()
+                buffer.length = 0
+                return buffer
+            self.misses += 1
+        return self._allocate(self.target_size())
+
+    def release(self, buffer):
+        """
+        Give back a buffer to the pool once its data is no longer used
+        """
+        with self._lock:
+            self.in_use -= 1
+            if buffer.length:
+                self.recent_sizes.append(buffer.length)
+
+            target = self.target_size()
+            size = len(buffer.data)
+            if len(self.free) >= self.count or size < target or size > 2 * target:
+                # dropped, buffers away from the recent capture sizes are
+                # allocated again on a later miss instead of here
+                self.current_bytes -= size
+                self.dropped += 1
+                return
+
+            buffer.length = 0
+            self.free.append(buffer)
+
+    def frame(self, buffer, **kwargs):
+        """
+        Wrap the captured data of the buffer in a `Frame` that returns
+        the buffer to the pool when released
+        """
+        return Frame(
+            buffer.data, buffer.length,
+            on_release=lambda data: self.release(buffer), **kwargs)
+
+    def stats(self):
+        return dict(
+            allocations=self.allocations,
+            growths=self.growths,
+            leases=self.leases,
+            misses=self.misses,
+            dropped=self.dropped,
+            in_use=self.in_use,
+            free=len(self.free),
+            current_bytes=self.current_bytes,
+            peak_bytes=self.peak_bytes,
+        )
+
+    def _allocate(self, size):
+        buffer = PooledBuffer(self, size)
+        with self._lock:
+            self._account(size)
+        return buffer
+
+    def _account(self, size):
+        self.allocations += 1
+        self.current_bytes += size
+        self.peak_bytes = max(self.peak_bytes, self.current_bytes)
+
+    def _grow(self, buffer, needed):
+        """
+        Called when a capture doesn't fit in the leased buffer
+        """
+        size = _align(max(needed, len(buffer.data) * 1.5))
+        data = bytearray(size)
+        data[:buffer.length] = memoryview(buffer.data)[:buffer.length]
+        with self._lock:
+            self.growths += 1
+            self.current_bytes -= len(buffer.data)
+            self._account(size)
+        buffer.data = data
+        logger.debug("Capture buffer grown to %s bytes", size)
@@ -1,14 +1,18 @@
-from io import BytesIO
 import os
 import logging
+import time
 import requests
 
 from datetime import datetime
 
 from picamera import PiCamera
-from twisted.internet import reactor
+from twisted.internet import reactor, threads
 
-from garage_watch import CameraController
+from garage_watch import CameraController, tracing
+from garage_watch.metrics import REGISTRY
+
+from .buffer_pool import BufferPool
+from .jpeg import find_exif_thumbnail
 
 from jwcrypto.jwt import JWT
 from jwcrypto.jwk import JWK
@@ -16,6 +20,11 @@ from jwcrypto.jwk import JWK
 # logger for the script
 logger = logging.getLogger(__name__)
 
+SNAPSHOT_SECONDS = REGISTRY.histogram(
+    'garage_watch_snapshot_seconds', 'Duration of the snapshot capture, save and upload', ['step'])
+SNAPSHOT_RESULTS = REGISTRY.counter(
+    'garage_watch_snapshots_total', 'Snapshots captured, saved and uploaded by result', ['step', 'result'])
+
 
 class GarageCameraController(CameraController):
     """
@@ -25,9 +34,17 @@ class GarageCameraController(CameraController):
     # create the Pi camera instance and configure it
     camera = PiCamera()
     camera.resolution = (1280, 720)
+    # framerate can't be changed while any splitter port is recording
+    # (e.g. the live stream) so it is set once here
+    camera.framerate = 5
     camera.annotate_text_size = 12
     scheduledPrepare = None
 
+    # buffers to capture the snapshots into, created with the controller
+    buffer_pool = None
+    # the Exif thumbnail must fit in a 64KB segment
+    thumbnail_quality = 60
+
     snapshot_dir = ''
     video_dir = ''
 
@@ -38,6 +55,17 @@ class GarageCameraController(CameraController):
     pushbullet_secret = None
     last_video_filename = None
 
+    # number of frames captured in memory when the door opens, 0 disables it
+    burst_count = 0
+    # frame bus where the burst frames are published
+    burst_bus = None
+    # snapshots, recording and live stream use splitter ports 0, 1 and 2
+    burst_splitter_port = 3
+
+    def __init__(self):
+        super().__init__()
+        self.buffer_pool = BufferPool()
+
     def start_recording(self):
         """
         Kick off recording with the raspberry camera, it will
@@ -54,8 +82,7 @@ class GarageCameraController(CameraController):
             # generate the filename
             filepath = os.path.join(
                 todaydir, now.strftime('%H-%M-%S.h264'))
-            
-            self.camera.framerate = 5
+
             self.camera.start_recording(filepath, quality=22)
             self.last_video_filename = filepath
 
@@ -91,57 +118,135 @@ class GarageCameraController(CameraController):
 
         def prepare_finished_callback(cls):
             if cls.state == 'prepare':
-                # notify pushbullet
-                if self.pushbullet_secret:
-                    now = datetime.now()
-                    requests.post(
-                        'https://api.pushbullet.com/v2/pushes',
-                        auth=(self.pushbullet_secret, ''),
-                        json={
-                            "type": "note",
-                            "title": "Recording of the garage started",
-                            "body": "The door opened at {}".format(
-                                now.strftime("%H:%M")
-                            )
-                    })
-
-                cls.prepare_finished()
+                with tracing.activate(cls.trace):
+                    tracing.mark('prepare_timer')
+                    # notify pushbullet
+                    if self.pushbullet_secret:
+                        now = datetime.now()
+                        with tracing.span('notification'):
+                            requests.post(
+                                'https://api.pushbullet.com/v2/pushes',
+                                auth=(self.pushbullet_secret, ''),
+                                json={
+                                    "type": "note",
+                                    "title": "Recording of the garage started",
+                                    "body": "The door opened at {}".format(
+                                        now.strftime("%H:%M")
+                                    )
+                            })
+
+                    cls.prepare_finished()
         logger.info("Waiting 10 seconds before starting recording")
         self.scheduledPrepare = reactor.callLater(10, prepare_finished_callback, self)
 
     
+    def on_enter_prepare(self):
+        """
+        Besides scheduling the recording, capture a burst of frames as
+        soon as the door opens, without waiting for the recording to start
+        """
+        super().on_enter_prepare()
+        if self.burst_count and self.burst_bus:
+            self.capture_burst(self.burst_count)
+
+    def capture_burst(self, count):
+        """
+        Capture `count` frames from the video port in a thread. Every frame
+        is published to `burst_bus` as soon as it is captured
+        """
+        def _burst_failed(failure):
+            logger.error("Error capturing burst: %s", failure.getErrorMessage())
+
+        logger.info("Capturing burst of %s frames", count)
+        d = threads.deferToThread(
+            self.camera.capture_sequence,
+            self._burst_outputs(count, self.state),
+            format='jpeg',
+            quality=82,
+            use_video_port=True,
+            splitter_port=self.burst_splitter_port)
+        d.addErrback(_burst_failed)
+        return d
+
+    def _burst_outputs(self, count, state):
+        """
+        Generator of buffers for `capture_sequence`, picamera asks for the
+        next output once the previous one is complete so that is the time
+        to hand the previous frame over to the reactor
+        """
+        for _ in range(count):
+            picture_buffer = self.buffer_pool.lease()
+            timestamp = datetime.now()
+            try:
+                yield picture_buffer
+            except GeneratorExit:
+                # capture failed, the buffer was not filled
+                self.buffer_pool.release(picture_buffer)
+                raise
+            reactor.callFromThread(
+                self._publish_burst_frame, picture_buffer, timestamp, state)
+
+    def _publish_burst_frame(self, picture_buffer, timestamp, state):
+        frame = self.buffer_pool.frame(picture_buffer, timestamp=timestamp, state=state)
+        self.burst_bus.publish(frame)
+
     def on_exit_prepare(self):
         if self.scheduledPrepare and not self.scheduledPrepare.called:
             self.scheduledPrepare.cancel()
         if self.scheduledPrepare:
             self.scheduledPrepare = None
 
-    def take_picture(self):
+    def take_picture(self, thumbnail_size=None):
+        """
+        Capture a snapshot and return it as a `Frame` to be published
+        to the consumers in the snapshot frame bus
+
+        If `thumbnail_size` is given the JPEG encoder also embeds a
+        thumbnail of that size in the Exif data, so both images come from
+        the same sensor readout. The thumbnail is available via
+        `frame.thumbnail()`
+        """
         now = datetime.now()
+        started = time.monotonic()
+        picture_buffer = self.buffer_pool.lease()
         try:
-            picture_stream = BytesIO()
             # capture the snapshot
             self.camera.annotate_text = '({}) {}'.format(
                 self.state, now.strftime('%Y-%m-%d %H:%M')
             )
             
+            capture_kwargs = {}
+            if thumbnail_size:
+                capture_kwargs['thumbnail'] = (
+                    thumbnail_size[0], thumbnail_size[1], self.thumbnail_quality)
+
             self.camera.capture(
-                picture_stream,
+                picture_buffer,
                 format='jpeg',
                 quality=82,
-                use_video_port=(True if self.state == 'record' else False))
+                # use the video port while recording or streaming to
+                # avoid switching the camera mode mid-recording
+                use_video_port=(self.state == 'record' or self.camera.recording),
+                **capture_kwargs)
             self.camera.annotate_text = ''
         except Exception :
             logger.exception("Error taking snapshot")
+            SNAPSHOT_RESULTS.labels('capture', 'error').inc()
+            self.buffer_pool.release(picture_buffer)
         else:
             logger.info("Snapshot taken")
-            picture_stream.seek(0)
-            return picture_stream
+            SNAPSHOT_SECONDS.labels('capture').observe(time.monotonic() - started)
+            SNAPSHOT_RESULTS.labels('capture', 'ok').inc()
+            # the buffer goes back to the pool when the frame is released
+            frame = self.buffer_pool.frame(picture_buffer, timestamp=now, state=self.state)
+            if thumbnail_size:
+                frame.thumbnail_range = find_exif_thumbnail(frame.view())
+            return frame
 
-    def save_picture(self, picture_stream):
+    def save_picture(self, frame):
+        started = time.monotonic()
         try:
-            picture_stream.seek(0)
-            now = datetime.now()
+            now = frame.timestamp
             # get directory for today and create if it doesn't exist
             todaydir = os.path.join(
                 now.strftime('%Y'), now.strftime('%m'), now.strftime('%d'))
@@ -149,14 +254,14 @@ class GarageCameraController(CameraController):
             filename = now.strftime('%H-%M-%S.jpg')
             
             if not os.path.exists(destdir):
-                os.makedirs(destdir)
+                os.makedirs(destdir, exist_ok=True)
 
             # generate the filename
             filepath = os.path.join(
                 destdir, filename)
             
             with open(filepath, 'wb') as f:
-                f.write(picture_stream.read())
+                f.write(frame.view())
 
             # create a simbolyc link in the directory
             symlink_path = os.path.join(self.snapshot_dir, 'latest_snapshot.jpg')
@@ -165,15 +270,15 @@ class GarageCameraController(CameraController):
             os.symlink(os.path.join(todaydir, filename), symlink_path)
         except Exception:
             logger.exception("Error saving snapshot")
+            SNAPSHOT_RESULTS.labels('save', 'error').inc()
         else:
             logger.info("Snapshot saved to disk")
-        finally:
-            picture_stream.seek(0)
+            SNAPSHOT_SECONDS.labels('save').observe(time.monotonic() - started)
+            SNAPSHOT_RESULTS.labels('save', 'ok').inc()
 
-    def upload_picture(self, picture_stream):
+    def upload_picture(self, frame):
         """
-        Upload the file on the given path to the server
-        via HTTP post
+        Upload the given frame to the server via HTTP post
 
         Uses class configuration to determine the url and key to sign
         Authorization Bearer token with JWT
@@ -186,8 +291,8 @@ class GarageCameraController(CameraController):
             with open(self.upload_auth_jwk_path, 'rb') as f:
                 self.upload_auth_jwk = JWK.from_json(f.read())
         
+        started = time.monotonic()
         try:
-            picture_stream.seek(0)
             auth_token = JWT(header={'alg': 'EdDSA', 'kid': self.upload_auth_jwk.key_id}, default_claims={'iat':None, 'exp': None})
             auth_token.validity=300
             auth_token.claims={}
@@ -196,18 +301,21 @@ class GarageCameraController(CameraController):
             auth_header = 'Bearer {}'.format(auth_token.serialize())
             response = requests.post(
                 self.upload_url, 
-                files={'file': picture_stream},
+                files={'file': ('file', frame.view())},
                 headers={
                     'Authorization': auth_header
                 }
             )
             if not response.ok:
                 logger.error("Error uploading snapshot. Status code {}".format(response.status_code))
+                SNAPSHOT_RESULTS.labels('upload', 'error').inc()
             
         except Exception as exc:
             logger.exception("Error uploading snapshot.")
+            SNAPSHOT_RESULTS.labels('upload', 'error').inc()
         else:
-            # log success
-            logger.info("Snapshot uploaded")
-        finally:
-            picture_stream.seek(0)
+            if response.ok:
+                # only successful uploads are timed
+                logger.info("Snapshot uploaded")
+                SNAPSHOT_SECONDS.labels('upload').observe(time.monotonic() - started)
+                SNAPSHOT_RESULTS.labels('upload', 'ok').inc()
@@ -6,19 +6,15 @@ from datetime import datetime
 
 from gpiozero import MotionSensor
 from adafruit_ht16k33 import segments
-import board
-import busio
-
-from twisted.internet.task import LoopingCall
 
 from garage_watch import CameraController
 
+from .i2c_bus import bus_manager
+from .loop_monitor import loop_monitor
+
 # logger for the script
 logger = logging.getLogger(__name__)
 
-# Create the I2C interface.
-i2c = busio.I2C(board.SCL, board.SDA)
-
 def _update_time(instance):
     """
     Update the clock, this should not fail as it is in a task
@@ -28,7 +24,7 @@ def _update_time(instance):
         if now != instance.last_time:
             instance.last_time = now
             instance.seven_segment.print("{:2}{:02}".format(now.hour, now.minute))
-            instance.seven_segment.show()
+            bus_manager.show_display(instance.led_i2c_address, instance.seven_segment)
     except Exception as exc:
         logger.exception(exc)
         
@@ -41,10 +37,14 @@ class ClockController(CameraController):
     # create the Pi camera instance and configure it
     def __init__(self, sensor_pin, led_i2c_address):
         self.pir_sensor = MotionSensor(sensor_pin)
-        self.seven_segment = segments.Seg7x4(
-            i2c,
-            address=led_i2c_address)
-        self.seven_segment.brightness = 0.5
+        self.led_i2c_address = led_i2c_address
+        # the display is created and written through the bus manager
+        self.seven_segment = bus_manager.build_display(
+            led_i2c_address,
+            segments.Seg7x4,
+            address=led_i2c_address,
+            auto_write=False)
+        bus_manager.configure_display(led_i2c_address, self.seven_segment, brightness=0.5)
         self.last_time = None
         self.lc = None  # LoopingCall
 
@@ -73,7 +73,7 @@ class ClockController(CameraController):
         
         if self.lc and self.lc.running:
             self.lc.stop()
-        self.lc = LoopingCall(_update_time, self)
+        self.lc = loop_monitor.looping_call(_update_time, self, name='clock_update')
         self.lc.start(5, True)  # update every 5 seconds
 
     def stop_clock(self):
@@ -86,4 +86,4 @@ class ClockController(CameraController):
 
         self.seven_segment.colon = False
         self.seven_segment.fill(0)
-        self.seven_segment.show()
+        bus_manager.show_display(self.led_i2c_address, self.seven_segment)
@@ -0,0 +1,174 @@
+"""
+Remote commands received over MQTT
+
+A command is published to `garage_watch/<device id>/command/<name>` with
+an optional JSON payload:
+
+    {"id": "<request id>", "sent": <epoch seconds>}
+
+Commands with an id already handled are not run again, only acknowledged,
+so retransmissions are harmless. Every command name is rate limited with
+a token bucket. The result is published to `.../command/<name>/result`
+with the latency from reception (and from `sent` if given) to the action.
+"""
+import json
+import logging
+import time
+
+from collections import OrderedDict
+
+from twisted.internet import reactor
+
+logger = logging.getLogger(__name__)
+
+STATUS_OK = 'ok'
+STATUS_DUPLICATE = 'duplicate'
+STATUS_RATE_LIMITED = 'rate_limited'
+STATUS_UNKNOWN = 'unknown'
+STATUS_ERROR = 'error'
+
+
+class TokenBucket(object):
+    """
+    Allows `burst` actions at once and `rate` actions per second after that
+    """
+
+    def __init__(self, rate, burst, clock=None):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock or reactor
+        self.tokens = float(burst)
+        self.updated = self.clock.seconds()
+
+    def consume(self):
+        now = self.clock.seconds()
+        self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.burst)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class CommandStats(object):
+
+    def __init__(self):
+        self.received = 0
+        self.executed = 0
+        self.duplicates = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def record_latency(self, latency):
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    def summary(self):
+        return dict(
+            received=self.received,
+            executed=self.executed,
+            duplicates=self.duplicates,
+            rate_limited=self.rate_limited,
+            errors=self.errors,
+            latency_mean=round(self.latency_total / self.executed, 4) if self.executed else 0.0,
+            latency_max=round(self.latency_max, 4),
+        )
+
+
+class CommandRouter(object):
+    """
+    Runs the functions registered for each command name, in the reactor
+    thread. `publish_fn(topic, message)` sends the results
+    """
+
+    def __init__(self, topic_prefix, publish_fn=None, rate=0.5, burst=3, history=64, clock=None):
+        self.topic_prefix = topic_prefix.rstrip('/')
+        self.publish_fn = publish_fn
+        self.rate = rate
+        self.burst = burst
+        self.history = history
+        self.clock = clock or reactor
+        self.commands = {}
+        self.buckets = {}
+        # results of the latest request ids, oldest first
+        self.handled = OrderedDict()
+        self.stats = CommandStats()
+
+    @property
+    def subscription_topic(self):
+        return self.topic_prefix + '/+'
+
+    def register(self, name, fn, *args, **kwargs):
+        self.commands[name] = (fn, args, kwargs)
+        self.buckets[name] = TokenBucket(self.rate, self.burst, self.clock)
+
+    def handle(self, topic, payload):
+        """
+        Handle a message received in a command topic, returns the status
+        """
+        received = self.clock.seconds()
+        name = topic[len(self.topic_prefix) + 1:]
+        if not topic.startswith(self.topic_prefix + '/') or '/' in name:
+            return None
+        self.stats.received += 1
+
+        try:
+            request = json.loads(payload) if payload else {}
+            if not isinstance(request, dict):
+                request = {}
+        except ValueError:
+            request = {}
+        request_id = request.get('id')
+        if isinstance(request_id, bool) or not isinstance(request_id, (str, int)):
+            # lists or objects can't be remembered, handled without an id
+            if request_id is not None:
+                logger.warning("Ignoring the invalid id of command %s", name)
+            request_id = None
+
+        if request_id is not None and request_id in self.handled:
+            self.stats.duplicates += 1
+            return self._reply(name, request_id, STATUS_DUPLICATE, previous=self.handled[request_id])
+
+        if name not in self.commands:
+            logger.warning("Unknown command %s", name)
+            return self._reply(name, request_id, STATUS_UNKNOWN)
+
+        if not self.buckets[name].consume():
+            self.stats.rate_limited += 1
+            logger.warning("Command %s rate limited", name)
+            return self._reply(name, request_id, STATUS_RATE_LIMITED)
+
+        fn, args, kwargs = self.commands[name]
+        try:
+            fn(*args, **kwargs)
+        except Exception:
+            logger.exception("Error running command %s", name)
+            self.stats.errors += 1
+            status = STATUS_ERROR
+        else:
+            status = STATUS_OK
+            self.stats.executed += 1
+
+        latency = self.clock.seconds() - received
+        # the sender clock may differ, only informative
+        sent = request.get('sent')
+        end_to_end = time.time() - sent if isinstance(sent, (int, float)) else None
+        if status == STATUS_OK:
+            self.stats.record_latency(latency)
+        logger.info("Command %s (%s) %s in %.3f s", name, request_id, status, latency,
+                    extra=dict(event='command', command=name, status=status))
+
+        if request_id is not None:
+            self.handled[request_id] = status
+            while len(self.handled) > self.history:
+                self.handled.popitem(last=False)
+        return self._reply(name, request_id, status, latency=latency, end_to_end=end_to_end)
+
+    def _reply(self, name, request_id, status, **extra):
+        if self.publish_fn is not None:
+            result = dict(id=request_id, status=status)
+            result.update((k, round(v, 4) if isinstance(v, float) else v) for k, v in extra.items() if v is not None)
+            self.publish_fn('{}/{}/result'.format(self.topic_prefix, name), json.dumps(result))
+        return status
@@ -2,6 +2,8 @@ from adafruit_ht16k33 import matrix
 
 import logging
 
+from .i2c_bus import bus_manager
+
 # logger for the script
 _logger = logging.getLogger(__name__)
 
@@ -15,6 +17,9 @@ class CustomBicolorMatrix8x8(matrix.Matrix8x8x2):
 	
 	def __init__(self, *args, **kwargs):
 		self.set_rotation(kwargs.pop('rotation', 0))
+		self.address = kwargs.get('address', 0x70)
+		# pixels are written all at once through the bus manager
+		kwargs.setdefault('auto_write', False)
 		super().__init__(*args, **kwargs)
 		
 	def rotate_matrix(self, matrix, value):
@@ -44,8 +49,12 @@ class CustomBicolorMatrix8x8(matrix.Matrix8x8x2):
 		for y, row in enumerate(m):
 			for x, val in enumerate(row):
 				self[x, y] = val
-		try:
-			self.show()
-		except:
-			_logger.exception('Error writing to display')
+		self.queue_show()
+
+	def queue_show(self):
+		"""
+		Refresh the display from the bus manager worker with the pixels
+		as they are now, errors are logged there
+		"""
+		bus_manager.show_display(self.address, self)
 
@@ -0,0 +1,193 @@
+"""
+Inputs telling whether the garage door is open
+
+The door sensor can be wired to a GPIO pin, with edges detected by
+interrupts, or to the sensor board read over I2C. Every backend sends the
+`door_open` and `door_closed` events in the reactor thread and measures
+the latency from the edge of the sensor to the event.
+"""
+import logging
+import time
+
+from collections import deque
+
+from twisted.internet import reactor
+
+from garage_watch import tracing
+
+from .loop_monitor import percentile
+
+logger = logging.getLogger(__name__)
+
+
+class EdgeLatencyStats(object):
+    """
+    Seconds from the edge of the door sensor to its event, percentiles
+    are over the latest `history` edges
+    """
+
+    def __init__(self, history=200):
+        self.edges = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latencies = deque(maxlen=history)
+
+    def record(self, latency):
+        self.edges += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.latencies.append(latency)
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        return dict(
+            edges=self.edges,
+            latency_mean=round(self.latency_total / self.edges, 4) if self.edges else 0.0,
+            latency_p50=round(percentile(latencies, 50), 4),
+            latency_p90=round(percentile(latencies, 90), 4),
+            latency_max=round(self.latency_max, 4),
+        )
+
+
+class DoorInput(object):
+    """
+    Base of the door inputs, backends call `_edge` in the reactor thread
+    when the door sensor changes
+    """
+
+    EVENTS = ['door_open', 'door_closed']
+
+    def __init__(self, clock=None):
+        self.clock = clock or reactor
+        self.event_handlers = {k:[] for k in self.EVENTS}
+        self.door_open = None
+        self.latency = EdgeLatencyStats()
+
+    def add_event_handler(self, event, fn, *args, **kwargs):
+        self.event_handlers[event].append((fn, args, kwargs))
+
+    def is_door_open(self):
+        return bool(self.door_open)
+
+    def start(self):
+        raise NotImplementedError
+
+    def stop(self):
+        pass
+
+    def _initial_state(self, door_open):
+        """
+        Start closed, like the camera controller, and send `door_open`
+        if the door is already open
+        """
+        self.door_open = False
+        if door_open:
+            self._edge(True)
+
+    def _edge(self, door_open, edge_time=None, trace=None):
+        """
+        Send the event of the new door state. `edge_time` is when the
+        sensor changed, in `clock.seconds()` time, None if unknown.
+        `trace` is the trace started at the edge, if not the current one
+        """
+        if door_open == self.door_open:
+            return
+        self.door_open = door_open
+        if edge_time is not None:
+            self.latency.record(max(self.clock.seconds() - edge_time, 0))
+        event = 'door_open' if door_open else 'door_closed'
+        with tracing.activate(trace or tracing.current()):
+            tracing.mark('door_input')
+            for fn, args, kwargs in self.event_handlers[event]:
+                try:
+                    fn(*args, **kwargs)
+                except Exception:
+                    logger.exception("Error in %s handler", event)
+
+    def _edge_from_thread(self, door_open):
+        """
+        Pass an edge detected in another thread to the reactor, tracing
+        door openings from this moment
+        """
+        trace = tracing.Trace('door_open', time.monotonic()) if door_open else None
+        reactor.callFromThread(self._edge, door_open, self.clock.seconds(), trace)
+
+
+class GPIODoorInput(DoorInput):
+    """
+    Door sensor on a GPIO pin, read with gpiozero edge callbacks. The
+    callbacks run in a gpiozero thread and are passed to the reactor
+    """
+
+    def __init__(self, pin, pressed_is_open=True, bounce_time=0.05, clock=None):
+        super().__init__(clock)
+        self.pin = pin
+        self.pressed_is_open = pressed_is_open
+        self.bounce_time = bounce_time
+        self.button = None
+
+    def start(self):
+        from gpiozero import Button
+        self.button = Button(self.pin, bounce_time=self.bounce_time)
+        self.button.when_pressed = lambda: self._gpio_edge(self.pressed_is_open)
+        self.button.when_released = lambda: self._gpio_edge(not self.pressed_is_open)
+        self._initial_state(self.button.is_pressed == self.pressed_is_open)
+
+    def stop(self):
+        if self.button is not None:
+            self.button.close()
+            self.button = None
+
+    def _gpio_edge(self, door_open):
+        # runs in the gpiozero thread, take the time before the handoff
+        self._edge_from_thread(door_open)
+
+
+class I2CDoorInput(DoorInput):
+    """
+    Door sensor read by the sensor board of a `SensorControl`, which has
+    to be started apart. The time of the edge is unknown, it happened
+    after the previous read, so the latency measured is an upper bound
+    """
+
+    def __init__(self, sensor_control, clock=None):
+        super().__init__(clock or sensor_control.clock)
+        self.sensor_control = sensor_control
+
+    def start(self):
+        self.sensor_control.subscribe('door', self._door_changed)
+        self._initial_state(self.sensor_control.is_door_open())
+
+    def stop(self):
+        self.sensor_control.unsubscribe('door', self._door_changed)
+
+    def _door_changed(self, field, value, previous):
+        # called while processing the read, before it is added to the stats
+        self._edge(value, self.sensor_control.stats.last_poll_time)
+
+
+class FakeDoorInput(DoorInput):
+    """
+    Door input driven by `set_door_open`, events go through the reactor
+    like the GPIO ones. Like gpiozero, edges within `bounce_time` seconds
+    of the previous one are ignored
+    """
+
+    def __init__(self, door_open=False, bounce_time=0.05, clock=None):
+        super().__init__(clock)
+        self.initial_door_open = door_open
+        self.bounce_time = bounce_time
+        self.last_edge_time = None
+        self.bounced = 0
+
+    def start(self):
+        self._initial_state(self.initial_door_open)
+
+    def set_door_open(self, door_open):
+        now = self.clock.seconds()
+        if self.last_edge_time is not None and now - self.last_edge_time < self.bounce_time:
+            self.bounced += 1
+            return
+        self.last_edge_time = now
+        trace = tracing.Trace('door_open') if door_open else None
+        self.clock.callLater(0, self._edge, door_open, now, trace)
@@ -0,0 +1,137 @@
+"""
+Distribution of captured pictures to several consumers (disk, upload, ...)
+
+A capture is published once as an immutable `Frame`. Every consumer gets
+the same frame and reads it through read-only `memoryview` slices, so no
+copies are made and consumers don't share a seek position, which allows
+running them in parallel. Frames are reference counted and the underlying
+buffer is handed back through `on_release` once every consumer is done.
+Every view handed out is released then too, consumers must copy whatever
+they keep past their callback.
+"""
+import logging
+import threading
+
+from datetime import datetime
+
+from twisted.internet import threads
+from twisted.internet.defer import DeferredList, maybeDeferred
+
+# logger for the script
+logger = logging.getLogger(__name__)
+
+
+class Frame(object):
+    """
+    An encoded picture in memory. Created with one reference owned by the
+    creator, consumers `retain` and `release` it while using the data
+    """
+
+    def __init__(self, data, length=None, timestamp=None, state=None, on_release=None):
+        self.length = len(data) if length is None else length
+        self.timestamp = timestamp or datetime.now()
+        # state of the camera controller when the frame was captured
+        self.state = state
+        # (start, end) of a smaller version of the picture within the data
+        self.thumbnail_range = None
+        self.refcount = 1
+        self._data = data
+        self._view = memoryview(data)[:self.length].toreadonly()
+        # views handed out, released with the frame
+        self._exports = []
+        self._on_release = on_release
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.length
+
+    def view(self, start=0, end=None):
+        """
+        Return a read-only memoryview of the frame data, optionally sliced,
+        valid until the frame is released
+        """
+        with self._lock:
+            if self._view is None:
+                raise ValueError("Frame already released")
+            view = self._view[start:end]
+            self._exports.append(view)
+        return view
+
+    def thumbnail(self):
+        """
+        Return a read-only memoryview of the thumbnail or None
+        """
+        if self.thumbnail_range is None:
+            return None
+        return self.view(*self.thumbnail_range)
+
+    def retain(self):
+        with self._lock:
+            if self.refcount <= 0:
+                raise ValueError("Frame already released")
+            self.refcount += 1
+        return self
+
+    def release(self):
+        with self._lock:
+            self.refcount -= 1
+            if self.refcount:
+                return
+            # late consumers fail instead of reading a reused buffer
+            views = self._exports + [self._view]
+            self._view = None
+            self._exports = []
+        for view in views:
+            try:
+                view.release()
+            except BufferError:
+                # still exported (e.g. to numpy), dropped when they are gone
+                pass
+        if self._on_release:
+            self._on_release(self._data)
+        self._data = None
+
+
+class FrameBus(object):
+    """
+    Publishes frames to the subscribed consumers. A consumer is a callable
+    receiving the frame, it may return a Deferred to keep the frame retained
+    until it fires. Threaded consumers are run in the reactor thread pool
+    """
+
+    def __init__(self):
+        self.consumers = []
+
+    def subscribe(self, name, fn, threaded=False):
+        self.consumers.append((name, fn, threaded))
+
+    def unsubscribe(self, name):
+        self.consumers = [c for c in self.consumers if c[0] != name]
+
+    def publish(self, frame):
+        """
+        Hand the frame to every consumer and release the publisher
+        reference. Returns a DeferredList firing when all consumers are done
+        """
+        deferreds = []
+
+        for name, fn, threaded in self.consumers:
+            frame.retain()
+            if threaded:
+                d = threads.deferToThread(fn, frame)
+            else:
+                d = maybeDeferred(fn, frame)
+            d.addErrback(self._log_failure, name)
+            d.addBoth(self._release, frame)
+            deferreds.append(d)
+
+        frame.release()
+        return DeferredList(deferreds)
+
+    def _log_failure(self, failure, name):
+        logger.error(
+            "Frame consumer %s failed: %s", name, failure.getErrorMessage())
+
+    def _release(self, result, frame):
+        frame.release()
+        return result
@@ -0,0 +1,230 @@
+"""
+Recording of the raw frames read from the sensor board
+
+Every frame is appended to a binary file as a fixed size record, so the
+files can be memory mapped as a NumPy structured array and days of frames
+are available without parsing anything. Files are rotated by size and
+named after the UTC time of their first frame, with a zero padded index
+so files sort in order, also across DST changes and within a second.
+
+Frames are only queued by `record`, a writer thread appends them to the
+file in batches, with a single flush per batch, so the reactor never
+waits for the disk.
+
+Layout of a file: a 16 bytes header (magic, format version, record size)
+followed by records of `RECORD_DTYPE`.
+"""
+import glob
+import logging
+import os
+import struct
+import threading
+import time
+
+from collections import deque
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'GWSF'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHH8x')
+
+# bytes of frame data kept per record, longer frames are truncated
+DATA_SIZE = 20
+
+RECORD = struct.Struct('<dHBB{}s'.format(DATA_SIZE))
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('address', '<u2'),
+    ('length', 'u1'),
+    ('reserved', 'u1'),
+    ('data', 'u1', (DATA_SIZE,)),
+])
+assert RECORD_DTYPE.itemsize == RECORD.size
+
+
+class FrameRecorder(object):
+    """
+    Appends the raw frames to `<prefix>-<UTC time>-<index>.bin` files in
+    `directory`. A new file is started when the current one reaches
+    `max_bytes`, the current file and the latest `backup_count` older
+    ones are kept, all of them if `backup_count` is None
+    """
+
+    # seconds `close` waits for the writer
+    CLOSE_TIMEOUT = 5
+
+    def __init__(self, directory, prefix='frames', max_bytes=16 * 1024 * 1024, backup_count=30,
+                 flush_interval=1.0):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.file = None
+        self.path = None
+        self.size = 0
+        self.records = 0
+        self.batches = 0
+        # (timestamp, packed record) waiting for the writer
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.writer = None
+
+    def record(self, address, data, timestamp=None):
+        """
+        Queue a frame for the writer, errors are logged so recording
+        never breaks polling
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        try:
+            record = RECORD.pack(timestamp, address, min(len(data), 255), 0, bytes(data[:DATA_SIZE]))
+        except Exception:
+            logger.exception("Error recording sensor frame")
+            return
+        with self.condition:
+            if self.closed:
+                return
+            self.pending.append((timestamp, record))
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._run, name='frame-recorder', daemon=True)
+                self.writer.start()
+
+    def close(self):
+        """
+        Write the frames waiting and close the file, the writer closes it
+        once done if it takes longer than the wait
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+            writer = self.writer
+        if writer is not None and writer is not threading.current_thread():
+            writer.join(self.CLOSE_TIMEOUT)
+            if writer.is_alive():
+                logger.warning("Sensor frame recorder still writing, it closes the file when done")
+
+    def stats(self):
+        return dict(
+            waiting=len(self.pending),
+            records=self.records,
+            batches=self.batches,
+        )
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if not self.pending and not self.closed:
+                    self.condition.wait(self.flush_interval)
+                batch = list(self.pending)
+                self.pending.clear()
+                closed = self.closed
+            if batch:
+                self._write(batch)
+            if closed:
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                return
+
+    def _write(self, batch):
+        try:
+            for timestamp, record in batch:
+                if self.file is None or self.size + RECORD.size > self.max_bytes:
+                    self._rotate(timestamp)
+                self.file.write(record)
+                self.size += RECORD.size
+                self.records += 1
+            self.file.flush()
+            self.batches += 1
+        except Exception:
+            logger.exception("Error recording sensor frames")
+
+    def _rotate(self, timestamp):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        name = '{}-{}'.format(self.prefix, time.strftime('%Y%m%d-%H%M%S', time.gmtime(timestamp)))
+        index = 0
+        while True:
+            # files started in the same second get the next index
+            self.path = os.path.join(self.directory, '{}-{:03d}.bin'.format(name, index))
+            if not os.path.exists(self.path):
+                break
+            index += 1
+        self.file = open(self.path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, FORMAT_VERSION, RECORD.size))
+        self.size = HEADER.size
+        logger.info("Recording sensor frames to %s", self.path)
+
+        if self.backup_count is None:
+            return
+        older = [path for path in recording_files(self.directory, self.prefix) if path != self.path]
+        for path in older[:max(len(older) - self.backup_count, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                logger.exception("Error removing old recording %s", path)
+
+
+def recording_files(directory, prefix='frames'):
+    """
+    The recording files in `directory`, oldest first
+    """
+    return sorted(glob.glob(os.path.join(directory, '{}-*.bin'.format(prefix))))
+
+
+def load_recording(path):
+    """
+    Memory map a recording file as an array of `RECORD_DTYPE`, a record
+    still being written at the end of the file is left out
+    """
+    with open(path, 'rb') as f:
+        magic, version, record_size = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != FORMAT_VERSION or record_size != RECORD_DTYPE.itemsize:
+        raise ValueError("Not a sensor frame recording: {}".format(path))
+    count = (os.path.getsize(path) - HEADER.size) // RECORD_DTYPE.itemsize
+    if not count:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER.size, shape=(count,))
+
+
+def load_recordings(directory, prefix='frames', start=None, end=None):
+    """
+    Memory map every recording in `directory`, oldest first, as a list of
+    arrays. With `start` and `end` only the frames with `start <= timestamp
+    < end` are kept, sliced from the memory maps without copying them
+    """
+    recordings = []
+    for path in recording_files(directory, prefix):
+        records = load_recording(path)
+        if start is not None or end is not None:
+            # frames are appended in time order
+            timestamps = records['timestamp']
+            first = np.searchsorted(timestamps, start, 'left') if start is not None else 0
+            last = np.searchsorted(timestamps, end, 'left') if end is not None else len(records)
+            records = records[first:last]
+        if len(records):
+            recordings.append(records)
+    return recordings
+
+
+if __name__ == '__main__':
+    import sys
+
+    recordings = load_recordings(sys.argv[1])
+    print("{} frames".format(sum(len(records) for records in recordings)))
+    if recordings:
+        print("from {} to {}".format(
+            time.ctime(recordings[0]['timestamp'][0]), time.ctime(recordings[-1]['timestamp'][-1])))
+        counts = {}
+        for records in recordings:
+            addresses, address_counts = np.unique(records['address'], return_counts=True)
+            for address, count in zip(addresses, address_counts):
+                counts[address] = counts.get(address, 0) + count
+        for address, count in sorted(counts.items()):
+            print("  {:#x}: {} frames".format(address, count))
@@ -0,0 +1,342 @@
+"""
+Single owner of the I2C bus shared by the sensor board and the displays
+
+All transactions go through one worker thread in priority order, so
+sensor reads and display refreshes never interleave on the bus and reads
+go ahead of pending display writes. Display writes with the same coalesce
+key replace each other while waiting, only the latest one is executed.
+
+The handles to the bus (smbus2 for the sensor board, busio for the
+adafruit displays) are created on first use. Displays are created on the
+worker too, and refreshed with a copy of their framebuffer taken when
+queued, so the reactor can keep drawing while the worker writes.
+
+The reactor thread never waits for the worker, it gets Deferreds
+(`submit_deferred`, `ManagedSMBus.run_deferred`). Blocking calls are for
+other threads, or for the setup before the reactor runs.
+"""
+import copy
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from concurrent import futures
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.python import threadable
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_SENSOR = 0
+PRIORITY_DISPLAY = 10
+
+
+class DeviceStats(object):
+    """
+    Transaction counters of a device on the bus, with the time waiting in
+    the queue and the time running on the bus apart
+    """
+    __slots__ = ('transactions', 'errors', 'coalesced', 'wait_total', 'wait_max',
+                 'execution_total', 'execution_max')
+
+    def __init__(self):
+        self.transactions = 0
+        self.errors = 0
+        self.coalesced = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.execution_total = 0.0
+        self.execution_max = 0.0
+
+    def record(self, wait, execution, error):
+        self.transactions += 1
+        if error:
+            self.errors += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.execution_total += execution
+        self.execution_max = max(self.execution_max, execution)
+
+    def summary(self):
+        n = self.transactions
+        return dict(
+            transactions=n,
+            errors=self.errors,
+            coalesced=self.coalesced,
+            wait_mean=round(self.wait_total / n, 4) if n else 0.0,
+            wait_max=round(self.wait_max, 4),
+            execution_mean=round(self.execution_total / n, 4) if n else 0.0,
+            execution_max=round(self.execution_max, 4),
+        )
+
+
+class _Transaction(object):
+    __slots__ = ('device', 'fn', 'args', 'kwargs', 'coalesce_key', 'future', 'submitted')
+
+    def __init__(self, device, fn, args, kwargs, coalesce_key):
+        self.device = device
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.coalesce_key = coalesce_key
+        self.future = futures.Future()
+        self.submitted = time.monotonic()
+
+
+class ManagedSMBus(object):
+    """
+    smbus2 like object running the reads through the bus manager. Its
+    methods block, the reactor thread uses `run_deferred` instead
+    """
+
+    def __init__(self, manager, priority=PRIORITY_SENSOR, timeout=5):
+        self.manager = manager
+        self.priority = priority
+        self.timeout = timeout
+
+    def read_i2c_block_data(self, address, register, length):
+        return self.manager.call(
+            address, lambda: self.manager.smbus().read_i2c_block_data(address, register, length),
+            priority=self.priority, timeout=self.timeout)
+
+    def write_byte_data(self, address, register, value):
+        return self.manager.call(
+            address, lambda: self.manager.smbus().write_byte_data(address, register, value),
+            priority=self.priority, timeout=self.timeout)
+
+    def run_deferred(self, address, fn):
+        """
+        Run `fn(smbus)` on the bus worker, with the smbus2 handle of the
+        bus, returns a Deferred with its result
+        """
+        return self.manager.submit_deferred(
+            address, lambda: fn(self.manager.smbus()), priority=self.priority)
+
+    def reset(self):
+        self.manager.reset()
+
+
+class I2CBusManager(object):
+
+    def __init__(self, busnum=1):
+        self.busnum = busnum
+        self.queue = []
+        self.pending_by_key = {}
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.devices = {}
+        self.thread = None
+        # smbus2 handle of each worker, closed when the worker exits
+        self._smbus = {}
+        self._busio = None
+
+    def smbus(self):
+        """
+        The smbus2 handle of the calling worker, opened on first use
+        """
+        me = threading.current_thread()
+        handle = self._smbus.get(me)
+        if handle is None:
+            handle = self._smbus[me] = self._open_smbus()
+        return handle
+
+    def _open_smbus(self):
+        from smbus2 import SMBus
+        return SMBus(self.busnum)
+
+    def busio(self):
+        if self._busio is None:
+            import board
+            import busio
+            self._busio = busio.I2C(board.SCL, board.SDA)
+        return self._busio
+
+    def managed_smbus(self, priority=PRIORITY_SENSOR):
+        return ManagedSMBus(self, priority)
+
+    def submit(self, device, fn, *args, priority=PRIORITY_DISPLAY, coalesce_key=None, **kwargs):
+        """
+        Queue `fn(*args, **kwargs)` to run on the bus worker, returns a
+        `concurrent.futures.Future` with its result
+        """
+        with self.condition:
+            if coalesce_key is not None and coalesce_key in self.pending_by_key:
+                # replace the waiting transaction by the new one
+                transaction = self.pending_by_key[coalesce_key]
+                transaction.fn = fn
+                transaction.args = args
+                transaction.kwargs = kwargs
+                self._device_stats(device).coalesced += 1
+                return transaction.future
+
+            transaction = _Transaction(device, fn, args, kwargs, coalesce_key)
+            if coalesce_key is not None:
+                self.pending_by_key[coalesce_key] = transaction
+            heapq.heappush(self.queue, (priority, next(self.counter), transaction))
+            self._ensure_worker()
+            # a worker abandoned by a reset may be waiting too
+            self.condition.notify_all()
+        return transaction.future
+
+    def call(self, device, fn, *args, priority=PRIORITY_SENSOR, timeout=None, **kwargs):
+        """
+        Run `fn` on the bus worker and wait for its result, not to be
+        used from the reactor thread once running
+        """
+        if reactor.running and threadable.isInIOThread():
+            raise RuntimeError("Blocking I2C transaction from the reactor thread")
+        future = self.submit(device, fn, *args, priority=priority, **kwargs)
+        try:
+            return future.result(timeout)
+        except futures.TimeoutError:
+            raise OSError("I2C transaction to {:#x} timed out".format(device))
+
+    def submit_deferred(self, device, fn, *args, **kwargs):
+        """
+        Like `submit` but returns a Deferred fired in the reactor thread.
+        Cancelling it (e.g. on timeout) cancels the transaction if it
+        didn't start yet
+        """
+        future = self.submit(device, fn, *args, **kwargs)
+        d = Deferred(lambda _: future.cancel())
+
+        def _fire():
+            # already fired if cancelled
+            if d.called or future.cancelled():
+                return
+            error = future.exception()
+            if error is not None:
+                d.errback(error)
+            else:
+                d.callback(future.result())
+
+        future.add_done_callback(lambda _: reactor.callFromThread(_fire))
+        return d
+
+    def write_display(self, device, fn, *args, **kwargs):
+        """
+        Queue a display refresh, coalesced with waiting refreshes of the
+        same display
+        """
+        return self.submit(
+            device, fn, *args, priority=PRIORITY_DISPLAY,
+            coalesce_key=(device, getattr(fn, '__name__', None)), **kwargs)
+
+    def build_display(self, device, factory, *args, timeout=10, **kwargs):
+        """
+        Create an adafruit display with `factory(i2c, *args, **kwargs)` on
+        the worker, where its initialization is written to the device.
+        Blocks until created, to be used before the reactor runs
+        """
+        return self.call(
+            device, lambda: factory(self.busio(), *args, **kwargs),
+            priority=PRIORITY_DISPLAY, timeout=timeout)
+
+    def show_display(self, device, display):
+        """
+        Queue a refresh of an HT16K33 display with a copy of its
+        framebuffer, changes made after this call are not sent half done
+        """
+        snapshot = copy.copy(display)
+        snapshot._buffer = bytearray(display._buffer)
+        return self.write_display(device, snapshot.show)
+
+    def configure_display(self, device, display, **settings):
+        """
+        Set the display attributes written to the device, like
+        `brightness` or `blink_rate`, from the worker
+        """
+        def _configure():
+            for name, value in settings.items():
+                setattr(display, name, value)
+        return self.submit(
+            device, _configure, priority=PRIORITY_DISPLAY,
+            coalesce_key=(device, 'configure') + tuple(sorted(settings)))
+
+    def reset(self):
+        """
+        Give up on a worker stuck in a transaction and start a new worker,
+        with its own bus handle, for the waiting transactions. The stuck
+        worker closes its handle if it ever returns
+        """
+        with self.condition:
+            logger.error("Resetting I2C bus %s", self.busnum)
+            self.thread = None
+            self._ensure_worker()
+
+    def stats(self):
+        with self.condition:
+            return {
+                '{:#x}'.format(device): stats.summary()
+                for device, stats in self.devices.items()
+            }
+
+    def _device_stats(self, device):
+        stats = self.devices.get(device)
+        if stats is None:
+            stats = self.devices[device] = DeviceStats()
+        return stats
+
+    def _ensure_worker(self):
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self._run, name='i2c-bus-{}'.format(self.busnum), daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        try:
+            self._work()
+        finally:
+            handle = self._smbus.pop(threading.current_thread(), None)
+            if handle is not None:
+                try:
+                    handle.close()
+                except Exception:
+                    logger.exception("Error closing the I2C bus")
+
+    def _work(self):
+        me = threading.current_thread()
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                if self.thread is not me:
+                    # replaced by a reset
+                    return
+                _, _, transaction = heapq.heappop(self.queue)
+                if transaction.coalesce_key is not None:
+                    del self.pending_by_key[transaction.coalesce_key]
+
+            if not transaction.future.set_running_or_notify_cancel():
+                continue
+
+            started = time.monotonic()
+            try:
+                result = transaction.fn(*transaction.args, **transaction.kwargs)
+            except Exception as exc:
+                error = exc
+            else:
+                error = None
+            finished = time.monotonic()
+
+            with self.condition:
+                self._device_stats(transaction.device).record(
+                    started - transaction.submitted, finished - started, error is not None)
+                abandoned = self.thread is not me
+
+            if error is not None:
+                if transaction.coalesce_key is not None:
+                    # nobody waits for display writes
+                    logger.error("Error writing to display %#x: %s", transaction.device, error)
+                transaction.future.set_exception(error)
+            else:
+                transaction.future.set_result(result)
+            if abandoned:
+                return
+
+
+# the manager of the bus where the sensor board and displays are
+bus_manager = I2CBusManager(1)
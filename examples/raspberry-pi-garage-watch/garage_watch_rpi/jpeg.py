@@ -0,0 +1,72 @@
+"""
+Helpers to inspect JPEG data in memory without decoding it
+"""
+import struct
+
+# markers
+SOI = 0xD8
+SOS = 0xDA
+APP1 = 0xE1
+
+EXIF_HEADER = b'Exif\x00\x00'
+
+# tags of IFD1 locating the thumbnail
+TAG_JPEG_OFFSET = 0x0201
+TAG_JPEG_LENGTH = 0x0202
+
+
+def _read_ifd(data, tiff_start, offset, endian):
+    """
+    Return a dict of tag -> value offset of the entries in the IFD at
+    the given offset and the offset of the next IFD
+    """
+    base = tiff_start + offset
+    count, = struct.unpack_from(endian + 'H', data, base)
+    entries = {}
+    for i in range(count):
+        entry = base + 2 + i * 12
+        tag, = struct.unpack_from(endian + 'H', data, entry)
+        entries[tag] = entry + 8
+    next_ifd, = struct.unpack_from(endian + 'I', data, base + 2 + count * 12)
+    return entries, next_ifd
+
+
+def find_exif_thumbnail(data):
+    """
+    Locate the thumbnail embedded in the Exif metadata (IFD1) of the JPEG
+    in `data`. Returns the (start, end) offsets of the thumbnail JPEG or
+    None if there isn't one
+    """
+    try:
+        if data[0] != 0xFF or data[1] != SOI:
+            return None
+
+        pos = 2
+        while pos + 4 <= len(data):
+            if data[pos] != 0xFF:
+                return None
+            marker = data[pos + 1]
+            if marker == SOS:
+                return None
+            length, = struct.unpack_from('>H', data, pos + 2)
+            segment = pos + 4
+
+            if marker == APP1 and bytes(data[segment:segment + 6]) == EXIF_HEADER:
+                tiff_start = segment + 6
+                endian = '<' if bytes(data[tiff_start:tiff_start + 2]) == b'II' else '>'
+                ifd0_offset, = struct.unpack_from(endian + 'I', data, tiff_start + 4)
+                _, ifd1_offset = _read_ifd(data, tiff_start, ifd0_offset, endian)
+                if not ifd1_offset:
+                    return None
+                entries, _ = _read_ifd(data, tiff_start, ifd1_offset, endian)
+                if TAG_JPEG_OFFSET not in entries or TAG_JPEG_LENGTH not in entries:
+                    return None
+                offset, = struct.unpack_from(endian + 'I', data, entries[TAG_JPEG_OFFSET])
+                size, = struct.unpack_from(endian + 'I', data, entries[TAG_JPEG_LENGTH])
+                start = tiff_start + offset
+                return start, start + size
+
+            pos = segment + length - 2
+    except (IndexError, struct.error):
+        pass
+    return None
@@ -0,0 +1,235 @@
+"""
+Live view of the garage camera as an MJPEG stream over HTTP
+
+The camera records MJPEG on its own splitter port, frames are throttled
+to the configured rate and handed to the reactor, where a single shared
+`bytes` object per frame is written to every connected client. Clients
+whose transport is still busy with a previous frame skip frames instead
+of buffering them.
+
+The camera port only runs while there is at least one client connected.
+If it fails to start (camera busy, port in use) it is tried again on
+every new client and on a timer while clients are waiting.
+"""
+import io
+import time
+import logging
+
+from twisted.internet import reactor
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET
+
+# logger for the script
+logger = logging.getLogger(__name__)
+
+# start of image marker of a JPEG frame
+JPEG_SOI = b'\xff\xd8'
+
+BOUNDARY = b'FRAME'
+
+
+class LiveStreamOutput(object):
+    """
+    File-like object given to picamera as the recording output. Runs
+    in the camera encoder thread, assembles the MJPEG chunks into frames
+    and hands complete frames to the reactor at most `fps` times per second
+    """
+
+    def __init__(self, frame_buffer, fps):
+        self.frame_buffer = frame_buffer
+        self.min_frame_interval = 1.0 / fps
+        self.buffer = io.BytesIO()
+        self.last_frame_time = 0
+        # whether the frame being received will be published
+        self.keep_frame = False
+
+    def write(self, buf):
+        if buf.startswith(JPEG_SOI):
+            # new frame starts, publish the one assembled so far
+            if self.keep_frame:
+                self.buffer.truncate()
+                reactor.callFromThread(self.frame_buffer.publish, self.buffer.getvalue())
+            self.buffer.seek(0)
+
+            # decide if this frame is kept or dropped by the rate limit
+            now = time.monotonic()
+            self.keep_frame = now - self.last_frame_time >= self.min_frame_interval
+            if self.keep_frame:
+                self.last_frame_time = now
+
+        if self.keep_frame:
+            self.buffer.write(buf)
+        return len(buf)
+
+    def flush(self):
+        pass
+
+
+class LiveStreamClient(object):
+    """
+    An HTTP client connected to the stream. It is registered as streaming
+    producer of the request so the transport tells it when its buffers are
+    full, in which case frames are skipped until the transport drains
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.paused = False
+        self.frames_sent = 0
+        self.frames_skipped = 0
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+    def stopProducing(self):
+        self.paused = True
+
+    def send_frame(self, frame):
+        if self.paused:
+            self.frames_skipped += 1
+            return
+        self.request.write(
+            b'--' + BOUNDARY + b'\r\n'
+            b'Content-Type: image/jpeg\r\n'
+            b'Content-Length: ' + str(len(frame)).encode('ascii') + b'\r\n\r\n')
+        # the same frame object is shared by every client
+        self.request.write(frame)
+        self.request.write(b'\r\n')
+        self.frames_sent += 1
+
+
+class LiveStreamFrameBuffer(object):
+    """
+    Holds the latest frame and fans it out to the connected clients.
+    Only used from the reactor thread
+    """
+
+    def __init__(self, on_client=None, on_last_client=None):
+        self.frame = None
+        self.sequence = 0
+        self.clients = []
+        self.on_client = on_client
+        self.on_last_client = on_last_client
+
+    def publish(self, frame):
+        self.frame = frame
+        self.sequence += 1
+        for client in self.clients:
+            client.send_frame(frame)
+
+    def add_client(self, client):
+        self.clients.append(client)
+        if self.on_client:
+            self.on_client()
+
+    def remove_client(self, client):
+        if client not in self.clients:
+            return
+        self.clients.remove(client)
+        if not self.clients and self.on_last_client:
+            self.on_last_client()
+
+
+class LiveStream(object):
+    """
+    Manages the MJPEG recording on a dedicated splitter port of the camera.
+
+    Snapshots use splitter port 0 and video recording port 1, the live
+    stream uses port 2 so none of them interfere with each other
+    """
+
+    SPLITTER_PORT = 2
+    # seconds before trying again to start a stream that failed
+    RETRY_INTERVAL = 5
+
+    def __init__(self, camera, fps=2, resolution=(640, 360), quality=50, clock=None):
+        self.camera = camera
+        self.fps = fps
+        self.resolution = resolution
+        self.quality = quality
+        self.clock = clock or reactor
+        # started for every new client, it does nothing if running
+        self.frame_buffer = LiveStreamFrameBuffer(
+            on_client=self.start, on_last_client=self.stop)
+        self.running = False
+        self.retry = None
+
+    def start(self):
+        if self.running:
+            return
+        if self.retry and self.retry.active():
+            self.retry.cancel()
+        self.retry = None
+        try:
+            self.camera.start_recording(
+                LiveStreamOutput(self.frame_buffer, self.fps),
+                format='mjpeg',
+                splitter_port=self.SPLITTER_PORT,
+                resize=self.resolution,
+                quality=self.quality)
+        except Exception:
+            logger.exception("Error starting live stream, retrying in %s s", self.RETRY_INTERVAL)
+            self.retry = self.clock.callLater(self.RETRY_INTERVAL, self._retry_start)
+        else:
+            self.running = True
+            logger.info("Live stream started")
+
+    def _retry_start(self):
+        self.retry = None
+        if self.frame_buffer.clients:
+            self.start()
+
+    def stop(self):
+        if self.retry and self.retry.active():
+            self.retry.cancel()
+        self.retry = None
+        if not self.running:
+            return
+        try:
+            self.camera.stop_recording(splitter_port=self.SPLITTER_PORT)
+        except Exception:
+            logger.exception("Error stopping live stream")
+        else:
+            logger.info("Live stream stopped")
+        finally:
+            self.running = False
+            self.frame_buffer.frame = None
+
+
+class LiveStreamResource(Resource):
+    """
+    twisted.web resource serving the live stream as multipart/x-mixed-replace
+    """
+    isLeaf = True
+
+    def __init__(self, live_stream):
+        Resource.__init__(self)
+        self.live_stream = live_stream
+
+    def render_GET(self, request):
+        request.setHeader(
+            b'Content-Type', b'multipart/x-mixed-replace; boundary=' + BOUNDARY)
+        request.setHeader(b'Cache-Control', b'no-cache, private')
+        request.setHeader(b'Pragma', b'no-cache')
+
+        frame_buffer = self.live_stream.frame_buffer
+        client = LiveStreamClient(request)
+        request.registerProducer(client, True)
+
+        def _client_gone(_):
+            frame_buffer.remove_client(client)
+            logger.info(
+                "Live stream client disconnected, %s frames sent, %s skipped",
+                client.frames_sent, client.frames_skipped)
+
+        request.notifyFinish().addBoth(_client_gone)
+        frame_buffer.add_client(client)
+
+        # send the latest frame right away if there is one
+        if frame_buffer.frame is not None:
+            client.send_frame(frame_buffer.frame)
+
+        return NOT_DONE_YET
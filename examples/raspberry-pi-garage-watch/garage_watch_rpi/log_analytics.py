@@ -0,0 +1,337 @@
+"""
+History of the door and recordings from the logs
+
+The event records of the logs (the `event` field of the JSON lines, or
+the known messages of the older text lines) are ingested into a columnar
+store: an array of timestamps and an array of event codes, saved as
+Parquet when pyarrow is installed and as NumPy arrays otherwise. A
+checkpoint keeps the offset read of each log file, by device and inode so
+rotated files are not read again, together with a hash of the first line
+to tell a new file reusing the inode. Every ingestion only parses the new
+lines. The checkpoint is saved in the same file as the events, replaced
+at once, so they always match.
+
+Queries run vectorized over the arrays:
+
+    python -m garage_watch_rpi.log_analytics ingest /var/log/garage /var/lib/garage/history
+    python -m garage_watch_rpi.log_analytics report /var/lib/garage/history
+"""
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# codes of the events kept in the store
+EVENTS = [
+    'door_open',
+    'door_closed',
+    'cancel_requested',
+    'record_prepare_start',
+    'record_prepare_cancel',
+    'prepare_finished',
+    'record_start',
+    'record_cancel',
+    'record_end',
+]
+EVENT_CODES = {event: code for code, event in enumerate(EVENTS)}
+
+# messages of the events in the logs written before the JSON lines
+LEGACY_MESSAGES = {
+    'Door openened': 'door_open',
+    'Door closed': 'door_closed',
+    'Cancel requested': 'cancel_requested',
+    'Preparing to record': 'record_prepare_start',
+    'Preparations for recording cancelled': 'record_prepare_cancel',
+    'Preparations finished': 'prepare_finished',
+    'Recording started': 'record_start',
+    'Recording cancelled': 'record_cancel',
+    'Recording finished': 'record_end',
+}
+LEGACY_LINE = re.compile(r'^\[\w+\]\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),(\d{3})\]\[[^\]]*\] (.*)$')
+
+DAY = 86400
+WEEK = 7 * DAY
+
+# key of the checkpoint in the metadata of the Parquet file
+CHECKPOINT_KEY = b'garage_watch.checkpoint'
+
+
+def parse_line(line):
+    """
+    Return (timestamp, event code) of a log line, None if it isn't an event
+    """
+    if line.startswith('{'):
+        try:
+            entry = json.loads(line)
+            return entry['ts'], EVENT_CODES[entry['event']]
+        except (ValueError, KeyError, TypeError):
+            return None
+    match = LEGACY_LINE.match(line)
+    if match is None:
+        return None
+    event = LEGACY_MESSAGES.get(match.group(3))
+    if event is None:
+        return None
+    # the text lines have local time
+    timestamp = time.mktime(time.strptime(match.group(1), '%Y-%m-%d %H:%M:%S')) + int(match.group(2)) / 1000
+    return timestamp, EVENT_CODES[event]
+
+
+class EventStore(object):
+    """
+    Timestamps and event codes, sorted by time
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.timestamps = np.zeros(0)
+        self.codes = np.zeros(0, dtype=np.uint8)
+        # "device:inode" -> dict(offset=offset read, head=hash of the first line)
+        self.checkpoint = {}
+
+    @property
+    def parquet_path(self):
+        return os.path.join(self.directory, 'events.parquet')
+
+    @property
+    def npz_path(self):
+        return os.path.join(self.directory, 'events.npz')
+
+    def load(self):
+        if pyarrow is not None and os.path.exists(self.parquet_path):
+            table = pyarrow.parquet.read_table(self.parquet_path)
+            self.timestamps = table.column('timestamp').to_numpy()
+            self.codes = table.column('event').to_numpy().astype(np.uint8)
+            self.checkpoint = json.loads(table.schema.metadata[CHECKPOINT_KEY])
+        elif os.path.exists(self.npz_path):
+            with np.load(self.npz_path) as data:
+                self.timestamps = data['timestamp']
+                self.codes = data['event']
+                self.checkpoint = json.loads(str(data['checkpoint']))
+        return self
+
+    def save(self):
+        """
+        Write the events and the checkpoint to a temporary file replacing
+        the store, a crash leaves the previous one
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        checkpoint = json.dumps(self.checkpoint)
+        if pyarrow is not None:
+            path = self.parquet_path
+            table = pyarrow.table({'timestamp': self.timestamps, 'event': self.codes})
+            table = table.replace_schema_metadata({CHECKPOINT_KEY: checkpoint})
+            pyarrow.parquet.write_table(table, path + '.tmp')
+        else:
+            path = self.npz_path
+            # given a file np.savez doesn't add its extension
+            with open(path + '.tmp', 'wb') as f:
+                np.savez(f, timestamp=self.timestamps, event=self.codes, checkpoint=np.array(checkpoint))
+        os.replace(path + '.tmp', path)
+
+    def ingest(self, log_dir, pattern='garage-camera.log*'):
+        """
+        Parse the lines added to the logs since the previous ingestion,
+        returns the number of events added
+        """
+        timestamps = []
+        codes = []
+        # files deleted since are dropped from the checkpoint
+        checkpoint = {}
+        for path in glob.glob(os.path.join(log_dir, pattern)):
+            with open(path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                key = '{}:{}'.format(stat.st_dev, stat.st_ino)
+                head = _first_line_hash(f)
+                entry = self.checkpoint.get(key)
+                offset = entry['offset'] if entry else 0
+                if stat.st_size < offset or (entry and entry['head'] != head):
+                    # a new file reusing the inode
+                    offset = 0
+                checkpoint[key] = dict(offset=offset, head=head)
+                if stat.st_size == offset:
+                    continue
+                f.seek(offset)
+                data = f.read()
+            # an incomplete last line is read next time
+            end = data.rfind(b'\n') + 1
+            for line in data[:end].decode('utf-8', 'replace').splitlines():
+                parsed = parse_line(line)
+                if parsed is not None:
+                    timestamps.append(parsed[0])
+                    codes.append(parsed[1])
+            checkpoint[key]['offset'] = offset + end
+        self.checkpoint = checkpoint
+
+        if timestamps:
+            self.timestamps = np.concatenate([self.timestamps, np.array(timestamps, dtype=float)])
+            self.codes = np.concatenate([self.codes, np.array(codes, dtype=np.uint8)])
+            order = np.argsort(self.timestamps, kind='stable')
+            self.timestamps = self.timestamps[order]
+            self.codes = self.codes[order]
+        return len(timestamps)
+
+    def times(self, event, start=None, end=None):
+        """
+        Timestamps of `event` with `start <= timestamp < end`
+        """
+        mask = self.codes == EVENT_CODES[event]
+        if start is not None:
+            mask &= self.timestamps >= start
+        if end is not None:
+            mask &= self.timestamps < end
+        return self.timestamps[mask]
+
+    def open_counts_per_day(self, start=None, end=None, utc_offset=None):
+        """
+        Door openings per local day, as (day start timestamps, counts)
+        """
+        return _count_by_period(self.times('door_open', start, end), DAY, 0, utc_offset)
+
+    def recordings_per_week(self, start=None, end=None, utc_offset=None):
+        """
+        Recordings started per week starting on Monday, as (week start
+        timestamps, counts)
+        """
+        # the epoch was a Thursday
+        return _count_by_period(self.times('record_start', start, end), WEEK, 3 * DAY, utc_offset)
+
+    def open_durations(self, start=None, end=None):
+        """
+        Seconds the door stayed open for every opening followed by a
+        closing before the next opening
+        """
+        opens = self.times('door_open', start, end)
+        closes = self.times('door_closed', start)
+        if not len(opens) or not len(closes):
+            return np.zeros(0)
+        index = np.searchsorted(closes, opens, side='right')
+        valid = index < len(closes)
+        opens, index = opens[valid], index[valid]
+        close_times = closes[index]
+        # the closing must come before the next opening
+        next_opens = np.append(opens[1:], np.inf)
+        valid = close_times < next_opens
+        return close_times[valid] - opens[valid]
+
+    def open_duration_distribution(self, bins=(0, 30, 60, 120, 300, 600, 1800, 3600, np.inf), start=None, end=None):
+        durations = self.open_durations(start, end)
+        counts, _ = np.histogram(durations, bins=bins)
+        percentiles = np.percentile(durations, [50, 90, 99]) if len(durations) else np.zeros(3)
+        return dict(
+            bins=list(bins),
+            counts=counts.tolist(),
+            p50=float(percentiles[0]),
+            p90=float(percentiles[1]),
+            p99=float(percentiles[2]),
+        )
+
+    def cancelled_prepare_rate(self, start=None, end=None):
+        """
+        Fraction of the preparations for recording that were cancelled
+        """
+        prepared = len(self.times('record_prepare_start', start, end))
+        cancelled = len(self.times('record_prepare_cancel', start, end))
+        return cancelled / prepared if prepared else 0.0
+
+
+def _first_line_hash(f):
+    """
+    Hash of the first complete line of the file, None if there is none yet
+    """
+    f.seek(0)
+    line = f.readline(4096)
+    if not line.endswith(b'\n'):
+        return None
+    return hashlib.sha1(line).hexdigest()
+
+
+def _local_offsets(timestamps):
+    """
+    UTC offset of the local time at each timestamp, changing with the
+    daylight saving time
+    """
+    # offsets only change on quarter hours, looked up once per quarter
+    quarters, index = np.unique(np.floor(np.asarray(timestamps) / 900), return_inverse=True)
+    offsets = np.array([time.localtime(quarter * 900).tm_gmtoff for quarter in quarters], dtype=float)
+    return offsets[index.reshape(-1)]
+
+
+def _count_by_period(timestamps, period, shift, utc_offset=None):
+    """
+    Count the timestamps per local period, by default in the local time
+    zone, or at the fixed `utc_offset`
+    """
+    offsets = _local_offsets(timestamps) if utc_offset is None else utc_offset
+    periods = np.floor((timestamps + offsets + shift) / period)
+    values, counts = np.unique(periods, return_counts=True)
+    starts = values * period - shift
+    if utc_offset is None:
+        # the offset at the start of the period, the first guess may be
+        # off by the change of the period
+        starts = starts - _local_offsets(starts - _local_offsets(starts))
+    else:
+        starts = starts - utc_offset
+    return starts, counts
+
+
+def _format_time(timestamp):
+    return time.strftime('%Y-%m-%d', time.localtime(timestamp))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    subparsers = parser.add_subparsers(dest='command')
+    ingest_parser = subparsers.add_parser('ingest', help="parse the new log lines into the store")
+    ingest_parser.add_argument('log_dir')
+    ingest_parser.add_argument('store_dir')
+    report_parser = subparsers.add_parser('report', help="summary of the last days")
+    report_parser.add_argument('store_dir')
+    report_parser.add_argument('--days', type=int, default=30)
+    args = parser.parse_args()
+
+    if args.command == 'ingest':
+        store = EventStore(args.store_dir).load()
+        started = time.perf_counter()
+        added = store.ingest(args.log_dir)
+        store.save()
+        print("{} events added, {} in store ({:.3f} s)".format(
+            added, len(store.timestamps), time.perf_counter() - started))
+    elif args.command == 'report':
+        store = EventStore(args.store_dir).load()
+        start = time.time() - args.days * DAY
+        started = time.perf_counter()
+        days, opens = store.open_counts_per_day(start)
+        weeks, recordings = store.recordings_per_week(start)
+        distribution = store.open_duration_distribution(start=start)
+        rate = store.cancelled_prepare_rate(start)
+        elapsed = time.perf_counter() - started
+        print("Door openings per day:")
+        for day, count in zip(days, opens):
+            print("  {} {}".format(_format_time(day), count))
+        print("Recordings per week:")
+        for week, count in zip(weeks, recordings):
+            print("  {} {}".format(_format_time(week), count))
+        print("Open duration: p50 {p50:.0f} s, p90 {p90:.0f} s, p99 {p99:.0f} s".format(**distribution))
+        print("Cancelled preparations: {:.1%}".format(rate))
+        print("({:.1f} ms)".format(elapsed * 1000))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
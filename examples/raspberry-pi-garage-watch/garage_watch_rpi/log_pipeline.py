@@ -0,0 +1,147 @@
+"""
+Logging without blocking the reactor on disk writes
+
+`AsyncBatchHandler` only queues the records, a writer thread writes
+them in batches to the stream of the target handler, formatted and
+filtered by the target, under its lock, with a single write and flush
+per batch. Under load DEBUG records are dropped first,
+then INFO, warnings and errors are always kept.
+
+`JSONFormatter` writes a JSON object per line, keeping the fields given
+with `extra`, like `event`, for later analysis.
+"""
+import json
+import logging
+import threading
+
+from collections import deque
+from logging.handlers import BaseRotatingHandler
+
+# attributes of every LogRecord, the rest come from `extra`
+_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class AsyncBatchHandler(logging.Handler):
+    """
+    Queues the records for the writer thread. Once `max_records` are
+    waiting, DEBUG records are dropped from `max_records / 2` on.
+    `target` is a `StreamHandler`, its formatter formats the records
+    """
+
+    def __init__(self, target, max_records=2000, flush_interval=1.0):
+        super().__init__()
+        self.target = target
+        self.max_records = max_records
+        self.flush_interval = flush_interval
+        self.records = deque()
+        self.condition = threading.Condition()
+        self.dropped = {}
+        self.written = 0
+        self.batches = 0
+        self.closed = False
+        self.writer = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self.writer.start()
+
+    def emit(self, record):
+        waiting = len(self.records)
+        if waiting >= self.max_records // 2 and (
+                record.levelno <= logging.DEBUG or
+                (waiting >= self.max_records and record.levelno <= logging.INFO)):
+            self.dropped[record.levelname] = self.dropped.get(record.levelname, 0) + 1
+            return
+        # the message and the traceback are rendered now, the arguments
+        # may change before the writer gets to them
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        with self.condition:
+            self.records.append(record)
+            if len(self.records) >= 64:
+                self.condition.notify()
+
+    def flush(self):
+        with self.condition:
+            self.condition.notify()
+
+    def close(self):
+        """
+        Write the remaining records and stop the writer
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if self.writer.is_alive() and self.writer is not threading.current_thread():
+            self.writer.join(5)
+        self.target.close()
+        super().close()
+
+    def stats(self):
+        return dict(
+            waiting=len(self.records),
+            written=self.written,
+            batches=self.batches,
+            dropped=dict(self.dropped),
+        )
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if not self.records and not self.closed:
+                    self.condition.wait(self.flush_interval)
+                batch = list(self.records)
+                self.records.clear()
+                closed = self.closed
+            if batch:
+                self._write(batch)
+            if closed and not self.records:
+                return
+
+    def _write(self, batch):
+        target = self.target
+        # the lock of the target is held for the whole batch, nothing else
+        # writes to its stream or rolls it over in between
+        with target.lock:
+            lines = []
+            for record in batch:
+                try:
+                    if target.filter(record):
+                        lines.append(target.format(record))
+                except Exception:
+                    self.handleError(record)
+            if not lines:
+                return
+            try:
+                if isinstance(target, BaseRotatingHandler) and target.shouldRollover(batch[0]):
+                    target.doRollover()
+                stream = getattr(target, 'stream', None)
+                if stream is None:
+                    # a file handler opened lazily
+                    stream = target.stream = target._open()
+                stream.write(target.terminator.join(lines) + target.terminator)
+                stream.flush()
+            except Exception:
+                self.handleError(batch[-1])
+                return
+        self.written += len(lines)
+        self.batches += 1
@@ -0,0 +1,157 @@
+"""
+Monitoring of the reactor loop
+
+Every subsystem shares the reactor thread, a callback taking too long
+delays all the others. A sentinel timer scheduled every `interval`
+seconds measures how late it runs (the loop lag). Periodic callbacks
+wrapped with `wrap` or created with `looping_call` are timed by name.
+
+A watchdog thread looks at the reactor thread while it is blocked: once
+the sentinel or a wrapped callback is `slow_threshold` seconds late, the
+stack of the reactor thread is logged, showing the code blocking it.
+"""
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from collections import deque
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+from garage_watch.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+REACTOR_LAG_SECONDS = REGISTRY.histogram(
+    'garage_watch_reactor_lag_seconds', 'Delay of the reactor sentinel timer',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+CALLBACK_SECONDS = REGISTRY.histogram(
+    'garage_watch_reactor_callback_seconds', 'Duration of the monitored reactor callbacks', ['name'])
+SLOW_CALLBACKS = REGISTRY.counter(
+    'garage_watch_reactor_slow_callbacks_total', 'Monitored callbacks over the slow threshold', ['name'])
+
+
+def percentile(values, q):
+    """
+    Nearest rank percentile of a sorted list, `q` between 0 and 100
+    """
+    if not values:
+        return 0.0
+    index = min(int(round(q / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+class LoopMonitor(object):
+
+    def __init__(self, interval=0.5, slow_threshold=0.25, history=1200, clock=None):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.clock = clock or reactor
+        self.lags = deque(maxlen=history)
+        self.sentinel = None
+        # monotonic deadline of the sentinel, its lag is measured against
+        # it, the reactor clock may be adjusted. Read by the watchdog
+        self.sentinel_deadline = None
+        # (name, monotonic start) of the wrapped callback running
+        self.current = None
+        self.reported = None
+        self.reactor_thread_id = None
+        self.watchdog = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        """
+        Start the sentinel and the watchdog, to be called from the reactor
+        thread
+        """
+        self.reactor_thread_id = threading.get_ident()
+        self.stopped.clear()
+        self._schedule_sentinel()
+        self.watchdog = threading.Thread(target=self._watch, name='loop-monitor', daemon=True)
+        self.watchdog.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.sentinel and self.sentinel.active():
+            self.sentinel.cancel()
+        self.sentinel = None
+
+    def wrap(self, fn, name=None):
+        """
+        Return `fn` timed as a monitored callback
+        """
+        name = name or getattr(fn, '__name__', repr(fn))
+        histogram = CALLBACK_SECONDS.labels(name)
+
+        def _monitored(*args, **kwargs):
+            started = time.monotonic()
+            previous, self.current = self.current, (name, started)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.current = previous
+                elapsed = time.monotonic() - started
+                histogram.observe(elapsed)
+                if elapsed > self.slow_threshold:
+                    SLOW_CALLBACKS.labels(name).inc()
+                    logger.warning("Reactor callback %s took %.3f s", name, elapsed)
+        return _monitored
+
+    def looping_call(self, fn, *args, name=None, **kwargs):
+        """
+        `LoopingCall` of the monitored `fn`
+        """
+        return LoopingCall(self.wrap(fn, name), *args, **kwargs)
+
+    def summary(self):
+        lags = sorted(self.lags)
+        return dict(
+            samples=len(lags),
+            p50=round(percentile(lags, 50), 4),
+            p90=round(percentile(lags, 90), 4),
+            p99=round(percentile(lags, 99), 4),
+            max=round(lags[-1], 4) if lags else 0.0,
+        )
+
+    def _schedule_sentinel(self):
+        self.sentinel_deadline = time.monotonic() + self.interval
+        self.sentinel = self.clock.callLater(self.interval, self._sentinel)
+
+    def _sentinel(self):
+        lag = max(time.monotonic() - self.sentinel_deadline, 0)
+        self.lags.append(lag)
+        REACTOR_LAG_SECONDS.observe(lag)
+        if lag > self.slow_threshold:
+            logger.warning("Reactor loop lagging %.3f s", lag)
+        if not self.stopped.is_set():
+            self._schedule_sentinel()
+
+    def _watch(self):
+        while not self.stopped.wait(self.slow_threshold / 2):
+            now = time.monotonic()
+            current = self.current
+            if current is not None and now - current[1] > self.slow_threshold:
+                self._report_blocked(current, "callback {}".format(current[0]), now - current[1])
+                continue
+            deadline = self.sentinel_deadline
+            if deadline is not None and now - deadline > self.slow_threshold:
+                self._report_blocked(deadline, "reactor loop", now - deadline)
+
+    def _report_blocked(self, key, what, elapsed):
+        # a single report for each blocking episode
+        if self.reported == key:
+            return
+        self.reported = key
+        frame = sys._current_frames().get(self.reactor_thread_id)
+        if frame is None:
+            return
+        stack = ''.join(traceback.format_stack(frame))
+        logger.warning("Reactor blocked by %s for %.3f s, stack of the reactor thread:\n%s",
+                       what, elapsed, stack)
+
+
+# monitor of the reactor of the process
+loop_monitor = LoopMonitor()
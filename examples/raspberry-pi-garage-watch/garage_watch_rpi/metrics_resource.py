@@ -0,0 +1,20 @@
+"""
+HTTP endpoint with the metrics of the process in the Prometheus text
+format, to be added to the twisted.web site
+"""
+from twisted.web.resource import Resource
+
+from garage_watch.metrics import REGISTRY
+
+
+class MetricsResource(Resource):
+
+    isLeaf = True
+
+    def __init__(self, registry=REGISTRY):
+        super().__init__()
+        self.registry = registry
+
+    def render_GET(self, request):
+        request.setHeader(b'content-type', b'text/plain; version=0.0.4; charset=utf-8')
+        return self.registry.render().encode('utf-8')
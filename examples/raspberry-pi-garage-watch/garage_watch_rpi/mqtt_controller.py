@@ -1,9 +1,10 @@
 import json
+from fnmatch import fnmatch
+from functools import partial
 from mqtt.client.factory import MQTTFactory
 
-from twisted.internet.defer       import inlineCallbacks, DeferredList
+from twisted.internet.defer       import inlineCallbacks
 from twisted.application.internet import ClientService, backoffPolicy
-from twisted.internet             import task
 from twisted.internet.endpoints   import clientFromString
 
 BROKER = "tcp:hass.local:1883"
@@ -18,20 +19,84 @@ device_config = {
 
 import logging
 
+from garage_watch.metrics import REGISTRY
+
+from .publish_queue import PublishQueue
+from .publish_window import WindowedPublisher
+from .state_publisher import StatePublisher
+
 _logger = logging.getLogger(__name__)
 
+# telemetry sensors: key, name and extra discovery settings
+SENSORS = [
+    ('CAMERA_STATE', 'Garage Camera State', {"icon": "mdi:cctv"}),
+    ('PARKING_STATUS', 'Garage Parking Status', {"icon": "mdi:car"}),
+    ('PARKING_DISTANCE', 'Garage Parking Distance', {"unit_of_measurement": "cm", "icon": "mdi:ruler"}),
+    ('LAST_SNAPSHOT', 'Garage Last Snapshot', {"device_class": "timestamp"}),
+    ('UPLOAD_BACKLOG', 'Garage Upload Backlog', {"unit_of_measurement": "frames", "icon": "mdi:upload"}),
+]
+
+
+# remote commands and their Home Assistant buttons
+COMMAND_TOPIC_PREFIX = f"garage_watch/{device_config['ids']}/command"
+BUTTONS = [
+    ('cancel', 'Garage Cancel Recording', "mdi:cancel"),
+    ('snapshot', 'Garage Take Snapshot', "mdi:camera"),
+]
+
+
+MQTT_PUBLISHED = REGISTRY.counter(
+    'garage_watch_mqtt_published_total', 'MQTT messages sent to the broker by QoS', ['qos'])
+MQTT_PUBLISHED_BY_QOS = [MQTT_PUBLISHED.labels(qos) for qos in range(3)]
+MQTT_QUEUE_DEPTH = REGISTRY.gauge('garage_watch_mqtt_queue_depth', 'MQTT messages waiting for a connection')
+MQTT_WINDOW = REGISTRY.gauge('garage_watch_mqtt_window', 'MQTT in-flight window size')
+
+
+def sensor_state_topic(key):
+    return f"homeassistant/sensor/{device_config['ids']}_{key}/state"
+
 # -----------------------
 # MQTT Publishing Service
 # -----------------------
 
 class MQTTService(ClientService):
 
-    def __init__(self, reactor):
+    # QoS of the topics matching each pattern, first match wins, QoS 0
+    # for the rest
+    TOPIC_QOS = [
+        ('homeassistant/*/config', 1),
+        ('homeassistant/binary_sensor/*/state', 1),
+        ('homeassistant/sensor/*_PARKING_DISTANCE/state', 0),
+        ('homeassistant/sensor/*/state', 1),
+        ('garage_watch/*/result', 1),
+        ('homeassistant/camera/*/image', 0),
+    ]
+
+    def __init__(self, reactor, coalesce_window=1.0, heartbeat_interval=300, max_queued=100,
+                 topic_qos=None):
         self.reactor = reactor
-        factory    = MQTTFactory(profile=MQTTFactory.PUBLISHER)
+        factory    = MQTTFactory(profile=MQTTFactory.PUBLISHER | MQTTFactory.SUBSCRIBER)
         endpoint = clientFromString(reactor, BROKER)
         ClientService.__init__(self, endpoint, factory, retryPolicy=backoffPolicy())
         self.connected = False
+        # when the last connection was lost, None before the first one
+        self.disconnected_at = None
+        # `CommandRouter` handling the messages of the command topics
+        self.command_router = None
+        self.topic_qos = topic_qos if topic_qos is not None else self.TOPIC_QOS
+        # messages published while disconnected
+        self.queue = PublishQueue(max_queued)
+        # QoS > 0 publications within the window adapted to the
+        # acknowledgement latency, retried on failures
+        self.publisher = WindowedPublisher(self._send, self.queue.put, reactor)
+        # states are only published when they change, or as heartbeat
+        self.state_publisher = StatePublisher(
+            partial(self.publish, compact=True),
+            coalesce_window=coalesce_window,
+            heartbeat_interval=heartbeat_interval,
+            clock=reactor)
+        MQTT_QUEUE_DEPTH.set_function(lambda: len(self.queue))
+        MQTT_WINDOW.set_function(lambda: self.publisher.window.size)
 
     def startService(self):
         _logger.info("starting MQTT Client Publisher Service")
@@ -47,10 +112,9 @@ class MQTTService(ClientService):
         '''
         self.protocol                 = protocol
         self.protocol.onDisconnection = self.onDisconnection
-        # We are issuing 3 publish in a row
-        # if order matters, then set window size to 1
-        # Publish requests beyond window size are enqueued
-        self.protocol.setWindowSize(3) 
+        self.protocol.onPublish       = self.onPublish
+        # the protocol never holds more than our own window
+        self.protocol.setWindowSize(self.publisher.window.maximum)
         
         try:
             yield self.protocol.connect("TwistedMQTT-pub", keepalive=60)
@@ -59,7 +123,15 @@ class MQTTService(ClientService):
         else:
             _logger.info("MQTT client connected to %s", BROKER)
             self.connected = True
+            self.publisher.connect()
             self.publish_discovery()
+            self.flush_queue()
+            if self.disconnected_at is not None:
+                # the broker may have lost the states published before,
+                # the later ones were queued and just flushed
+                self.state_publisher.resend(before=self.disconnected_at)
+            if self.command_router is not None:
+                self.subscribe_commands()
 
 
     def onDisconnection(self, reason):
@@ -69,9 +141,30 @@ class MQTTService(ClientService):
         '''
         _logger.info("Connection to mqtt broker was lost, reason=%s", reason)
         self.connected = False
+        self.disconnected_at = self.reactor.seconds()
+        # the publications waiting for the window are sent once reconnected
+        self.publisher.disconnect()
         self.whenConnected().addCallback(self.connectToBroker)
 
 
+    def subscribe_commands(self):
+        topic = self.command_router.subscription_topic
+        d = self.protocol.subscribe(topic, 1)
+        d.addCallbacks(
+            lambda _: _logger.info("Subscribed to commands in %s", topic),
+            lambda failure: _logger.error("Error subscribing to %s: %s", topic, failure.getErrorMessage()))
+
+    def onPublish(self, topic, payload, qos, dup, retain, msgId):
+        '''
+        Messages of the subscribed topics
+        '''
+        if self.command_router is not None:
+            try:
+                self.command_router.handle(topic, payload)
+            except Exception:
+                # never let a bad message break the protocol
+                _logger.exception("Error handling the message of %s", topic)
+
     def publish_discovery(self):
         self.publish(f"homeassistant/binary_sensor/{device_config['ids']}_GARAGE_DOOR_OPEN/config", json.dumps({
             "name": "Garage Door Open",
@@ -80,27 +173,94 @@ class MQTTService(ClientService):
             "state_topic": f"homeassistant/binary_sensor/{device_config['ids']}_GARAGE_DOOR_OPEN/state",
             "device": device_config,
         }), retain=True)
+        self.publish(f"homeassistant/camera/{device_config['ids']}_GARAGE_SNAPSHOT/config", json.dumps({
+            "name": "Garage Snapshot",
+            "uniq_id": device_config['ids'] + "_GARAGE_SNAPSHOT",
+            "topic": f"homeassistant/camera/{device_config['ids']}_GARAGE_SNAPSHOT/image",
+            "device": device_config,
+        }), retain=True)
+        for command, name, icon in BUTTONS:
+            self.publish(f"homeassistant/button/{device_config['ids']}_{command.upper()}/config", json.dumps({
+                "name": name,
+                "uniq_id": f"{device_config['ids']}_{command.upper()}",
+                "command_topic": f"{COMMAND_TOPIC_PREFIX}/{command}",
+                "icon": icon,
+                "device": device_config,
+            }), retain=True)
+        for key, name, extra in SENSORS:
+            self.publish(f"homeassistant/sensor/{device_config['ids']}_{key}/config", json.dumps(dict({
+                "name": name,
+                "uniq_id": f"{device_config['ids']}_{key}",
+                "state_topic": sensor_state_topic(key),
+                "device": device_config,
+            }, **extra)), retain=True)
+
+    def flush_queue(self):
+        if len(self.queue):
+            _logger.info("Publishing %s MQTT messages queued while disconnected", len(self.queue))
+        for topic, message, retain, compact in self.queue.drain():
+            self._publish(topic, message, retain, compact)
 
-    def publish(self, topic, message, retain=False):
+    def publish(self, topic, message, retain=False, compact=False):
+        """
+        Publish a message, queued if not connected. `compact` for state
+        topics where only the latest message is worth queueing
+        """
+        if not self.connected:
+            self.queue.put(topic, message, retain, compact)
+            return None
+        return self._publish(topic, message, retain, compact)
+
+    def qos_for(self, topic):
+        for pattern, qos in self.topic_qos:
+            if fnmatch(topic, pattern):
+                return qos
+        return 0
+
+    def _publish(self, topic, message, retain, compact):
         def _logFailure(failure):
             _logger.info("Failure publishing MQTT message %s", failure.getErrorMessage())
-            return failure
 
-        #def _logAll(*args):
-        #    _logger.info("MQTT publihing complete. args=%s", args)
+        qos = self.qos_for(topic)
+        if qos:
+            d = self.publisher.publish(topic, message, retain, compact, qos)
+        else:
+            d = self._send(topic, message, retain, qos)
+        d.addErrback(_logFailure)
+        return d
 
-        #_logger.info("Publishing message ")
-        d1 = self.protocol.publish(topic=topic, qos=0, message=message, retain=retain)
-        d1.addErrback(_logFailure)
-        dlist = DeferredList([d1], consumeErrors=True)
+    def _send(self, topic, message, retain, qos):
+        MQTT_PUBLISHED_BY_QOS[qos].inc()
+        return self.protocol.publish(topic=topic, qos=qos, message=message, retain=retain)
 
-        #dlist.addCallback(_logAll)
-        return dlist
+    def publish_stats_summary(self):
+        return dict(window=self.publisher.window.size, **self.publisher.stats.summary())
 
     def report_door_open(self):
         _logger.info('Reporting door open')
-        self.publish(f"homeassistant/binary_sensor/{device_config['ids']}_GARAGE_DOOR_OPEN/state", "ON")
+        self.state_publisher.publish_state(f"homeassistant/binary_sensor/{device_config['ids']}_GARAGE_DOOR_OPEN/state", "ON")
     
     def report_door_closed(self):
         _logger.info('Reporting door closed')
-        self.publish(f"homeassistant/binary_sensor/{device_config['ids']}_GARAGE_DOOR_OPEN/state", "OFF")
+        self.state_publisher.publish_state(f"homeassistant/binary_sensor/{device_config['ids']}_GARAGE_DOOR_OPEN/state", "OFF")
+
+    def report_camera_state(self, state):
+        self.state_publisher.publish_state(sensor_state_topic('CAMERA_STATE'), state)
+
+    def report_parking_status(self, status):
+        self.state_publisher.publish_state(sensor_state_topic('PARKING_STATUS'), str(status))
+
+    def report_parking_distance(self, distance):
+        self.state_publisher.publish_state(sensor_state_topic('PARKING_DISTANCE'), "{:.0f}".format(distance))
+
+    def report_last_snapshot(self, timestamp):
+        """
+        `timestamp` is a timezone aware datetime
+        """
+        self.state_publisher.publish_state(sensor_state_topic('LAST_SNAPSHOT'), timestamp.isoformat(), retain=True)
+
+    def report_upload_backlog(self, backlog):
+        self.state_publisher.publish_state(sensor_state_topic('UPLOAD_BACKLOG'), str(backlog))
+
+    def report_snapshot_thumbnail(self, image):
+        self.publish(f"homeassistant/camera/{device_config['ids']}_GARAGE_SNAPSHOT/image", image, retain=True, compact=True)
@@ -2,12 +2,9 @@ from .custom_bicolor_matrix import CustomBicolorMatrix8x8
 from .led_matrix_helpers import Icon8x8, R, G, K, Y
 from .parking_controller import ParkingController
 
-from adafruit_ht16k33 import segments
-
-import board
-import busio
+from .i2c_bus import bus_manager
 
-i2c = busio.I2C(board.SCL, board.SDA)
+from adafruit_ht16k33 import segments
 
 
 GRAPHICS = {
@@ -87,15 +84,17 @@ class LEDParkingController(ParkingController):
 		if i2c_busnum is not None:
 			display_kwargs['busnum'] = i2c_busnum
 			
-		# Create display instance on default I2C address (0x70) and bus number.
-		self.display = CustomBicolorMatrix8x8(i2c, **display_kwargs)
+		# Create display instance on default I2C address (0x70) and bus number,
+		# from the bus manager worker like the rest of transactions
+		self.display = bus_manager.build_display(
+			display_kwargs.get('address', 0x70), CustomBicolorMatrix8x8, **display_kwargs)
 
 		# Initialize the display. Must be called once before using the display.
 		self.display.fill(self.display.LED_OFF)
-		self.display.show()
+		self.display.queue_show()
 
-		self.seven_segment = segments.Seg7x4(i2c, address=0x71)
-		self.seven_segment.show()
+		self.seven_segment = bus_manager.build_display(0x71, segments.Seg7x4, address=0x71, auto_write=False)
+		self.show_segments()
 
 
 	def write_amount(self, value):
@@ -114,12 +113,16 @@ class LEDParkingController(ParkingController):
 			value2 = '-'
 			
 		self.seven_segment.print_number_str("{:2}{:2}".format(value1, value2))
-		self.seven_segment.show()
+		self.show_segments()
+
+	def show_segments(self):
+		bus_manager.show_display(0x71, self.seven_segment)
 		
 	def on_enter_hold(self):
 		self.display.clear()
 		self.seven_segment.fill(0)
-		self.display.show()
+		self.display.queue_show()
+		self.show_segments()
 		
 	def on_enter_parking_start(self):
 		self.display.set_matrix_image(self.GREEN_ARROW)
@@ -0,0 +1,295 @@
+"""
+Smoothing of the parking distances reported by the ultrasonic sensors
+
+The raw distances jitter, which makes a state derived from them flicker.
+The samples of both sensors are kept in a fixed size ring buffer and
+smoothed with vectorized median, EMA or a Kalman filter. States are
+derived with hysteresis so they only change once a boundary is clearly
+crossed.
+"""
+import logging
+
+import numpy as np
+
+from twisted.internet import reactor
+
+from .parking_controller import ParkingController
+
+logger = logging.getLogger(__name__)
+
+
+class DistanceSeries(object):
+    """
+    Ring buffer of timestamped distance samples of the two sensors
+    """
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.values = np.zeros((capacity, 2))
+        self.count = 0
+        self.index = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, distances):
+        self.times[self.index] = timestamp
+        self.values[self.index] = distances
+        self.index = (self.index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def clear(self):
+        self.count = 0
+        self.index = 0
+
+    def window(self, n=None):
+        """
+        Return (times, values) of the latest `n` samples, oldest first
+        """
+        n = self.count if n is None else min(n, self.count)
+        idx = (self.index - n + np.arange(n)) % self.capacity
+        return self.times[idx], self.values[idx]
+
+    def median(self, n=5):
+        _, values = self.window(n)
+        return np.median(values, axis=0)
+
+    def ema(self, alpha=0.3, n=16):
+        """
+        Exponential moving average over the latest `n` samples
+        """
+        _, values = self.window(n)
+        weights = (1 - alpha) ** np.arange(len(values) - 1, -1, -1)
+        return weights @ values / weights.sum()
+
+    def velocity(self, n=8):
+        """
+        Least squares slope of the latest `n` samples, in distance units
+        per second, negative when approaching
+        """
+        times, values = self.window(n)
+        if len(times) < 2:
+            return np.zeros(2)
+        dt = times - times.mean()
+        denominator = (dt * dt).sum()
+        if not denominator:
+            return np.zeros(2)
+        return dt @ (values - values.mean(axis=0)) / denominator
+
+
+class KalmanDistanceFilter(object):
+    """
+    Constant velocity Kalman filter, run for both sensors at once
+    """
+
+    def __init__(self, process_noise=50.0, measurement_noise=16.0):
+        self.q = process_noise
+        self.r = measurement_noise
+        self.reset()
+
+    def reset(self):
+        self.time = None
+        self.position = np.zeros(2)
+        self.speed = np.zeros(2)
+        # covariance terms per sensor
+        self.p00 = np.full(2, 1e3)
+        self.p01 = np.zeros(2)
+        self.p11 = np.full(2, 1e3)
+
+    def update(self, timestamp, distances):
+        z = np.asarray(distances, dtype=float)
+        if self.time is None:
+            self.time = timestamp
+            self.position = z.copy()
+            return self.position
+
+        dt = max(timestamp - self.time, 1e-3)
+        self.time = timestamp
+
+        # predict
+        self.position = self.position + dt * self.speed
+        self.p00 = self.p00 + dt * (2 * self.p01 + dt * self.p11) + self.q * dt ** 3 / 3
+        self.p01 = self.p01 + dt * self.p11 + self.q * dt ** 2 / 2
+        self.p11 = self.p11 + self.q * dt
+
+        # correct
+        s = self.p00 + self.r
+        k0 = self.p00 / s
+        k1 = self.p01 / s
+        innovation = z - self.position
+        self.position = self.position + k0 * innovation
+        self.speed = self.speed + k1 * innovation
+        self.p11 = self.p11 - k1 * self.p01
+        self.p01 = self.p01 - k0 * self.p01
+        self.p00 = self.p00 - k0 * self.p00
+        return self.position
+
+
+class HysteresisClassifier(object):
+    """
+    Maps a distance to a state. `levels` is a list of (upper_bound, state)
+    sorted by bound, the last state applies above every bound. The current
+    state is kept until the distance goes `hysteresis` beyond its range.
+
+    Unknown bounds are NaN, the distance never crosses them, the level is
+    moved across them by setting `level`
+    """
+
+    def __init__(self, levels, default, hysteresis=3):
+        self.bounds = np.array([bound for bound, _ in levels], dtype=float)
+        self.states = [state for _, state in levels] + [default]
+        self.hysteresis = hysteresis
+        self.level = None
+
+    @property
+    def state(self):
+        return None if self.level is None else self.states[self.level]
+
+    def classify(self, distance):
+        bounds = self.bounds
+        unknown = np.isnan(bounds)
+        if unknown.any():
+            if self.level is None:
+                raise ValueError("Level needed to classify with unknown bounds")
+            # out of reach from the current level
+            below = np.arange(len(bounds)) < self.level
+            bounds = np.where(unknown, np.where(below, -np.inf, np.inf), bounds)
+        level = int(np.searchsorted(bounds, distance, side='right'))
+        if self.level is not None and level != self.level:
+            low = bounds[self.level - 1] if self.level > 0 else -np.inf
+            high = bounds[self.level] if self.level < len(bounds) else np.inf
+            if low - self.hysteresis <= distance < high + self.hysteresis:
+                level = self.level
+        self.level = level
+        return self.states[level]
+
+
+class ParkingDistanceTracker(object):
+    """
+    Keeps the distance samples of `SensorControl` and tells subscribers
+    the smoothed distances, their velocity and the derived parking state.
+    Hook it with `sc.add_parking_data_update_callback(tracker.update)`
+
+    The sensor board derives its parking status from the raw distance with
+    the thresholds of its firmware, so it flickers when the distance
+    jitters around one. The thresholds are learned here from the raw
+    distances where the status changes, and the state follows the smoothed
+    distance with hysteresis around them. A threshold not seen yet is
+    crossed when the board status crosses it
+    """
+
+    # parking states by status code of the sensor board
+    STATES = ParkingController.states
+    # states the board sets by distance, from the closest
+    DISTANCE_STATES = ['parking_toofar', 'parking_inplace', 'parking_parking', 'parking_approach', 'parking_start']
+
+    def __init__(self, method='kalman', capacity=64, clock=None, hysteresis=3, learning_rate=0.2):
+        assert method in ('median', 'ema', 'kalman')
+        self.method = method
+        self.clock = clock or reactor
+        self.series = DistanceSeries(capacity)
+        self.kalman = KalmanDistanceFilter()
+        self.classifier = HysteresisClassifier(
+            [(np.nan, state) for state in self.DISTANCE_STATES[:-1]], self.DISTANCE_STATES[-1], hysteresis)
+        # weight of a new crossing in the learned thresholds
+        self.learning_rate = learning_rate
+        self.subscribers = []
+        self.state_listeners = []
+        self.state = 'hold'
+        # distance level of the previous board status
+        self.board_level = None
+        self.smoothed = np.zeros(2)
+        self.velocity = np.zeros(2)
+
+    def subscribe(self, fn):
+        """
+        `fn(smoothed, velocity, state)` is called on every sample
+        """
+        self.subscribers.append(fn)
+
+    def subscribe_state(self, fn):
+        """
+        `fn(state, previous)` is called when the parking state changes
+        """
+        self.state_listeners.append(fn)
+
+    def reset(self):
+        # the learned thresholds are kept
+        self.series.clear()
+        self.kalman.reset()
+        self.classifier.level = None
+        self.board_level = None
+
+    def update(self, sensor_control, *args, **kwargs):
+        status = sensor_control.parking_status
+        if status >= len(self.STATES):
+            return
+        if status == 0x00:
+            # parking finished, start over next time
+            self.reset()
+            self._set_state(self.STATES[status])
+            return
+
+        now = self.clock.seconds()
+        distances = sensor_control.parking_distance
+        self.series.append(now, distances)
+
+        if self.method == 'kalman':
+            self.smoothed = self.kalman.update(now, distances)
+            self.velocity = self.kalman.speed
+        else:
+            self.smoothed = self.series.median() if self.method == 'median' else self.series.ema()
+            self.velocity = self.series.velocity()
+
+        # the closest sensor decides the state
+        state = self._classify(self.STATES[status], min(distances), self.smoothed.min())
+        self._set_state(state)
+
+        for fn in self.subscribers:
+            try:
+                fn(self.smoothed, self.velocity, state)
+            except Exception:
+                logger.exception("Error in parking distance subscriber")
+
+    def thresholds(self):
+        """
+        Learned distances between the states of `DISTANCE_STATES`, NaN
+        when not seen yet
+        """
+        return self.classifier.bounds.copy()
+
+    def _classify(self, board_state, raw_distance, distance):
+        if board_state not in self.DISTANCE_STATES:
+            # leaving the parking, not decided by the distance
+            self.classifier.level = None
+            self.board_level = None
+            return board_state
+
+        board_level = self.DISTANCE_STATES.index(board_state)
+        previous, self.board_level = self.board_level, board_level
+        if previous is not None and abs(board_level - previous) == 1:
+            self._learn(min(board_level, previous), raw_distance)
+
+        level = self.classifier.level
+        if level is None or np.isnan(self.classifier.bounds[min(level, board_level):max(level, board_level)]).any():
+            self.classifier.level = board_level
+        return self.classifier.classify(distance)
+
+    def _learn(self, bound, distance):
+        known = self.classifier.bounds[bound]
+        if np.isnan(known):
+            self.classifier.bounds[bound] = distance
+        else:
+            self.classifier.bounds[bound] = known + self.learning_rate * (distance - known)
+
+    def _set_state(self, state):
+        previous = self.state
+        if state == previous:
+            return
+        self.state = state
+        for fn in self.state_listeners:
+            try:
+                fn(state, previous)
+            except Exception:
+                logger.exception("Error in parking state listener")
@@ -0,0 +1,92 @@
+"""
+Policies deciding how often the sensor board is polled, and statistics
+of the achieved polling
+"""
+from garage_watch.metrics import REGISTRY
+
+SENSOR_POLLS = REGISTRY.counter(
+    'garage_watch_sensor_polls_total', 'Reads of the sensor board by result', ['result'])
+SENSOR_POLLS_CHANGED = SENSOR_POLLS.labels('changed')
+SENSOR_POLLS_UNCHANGED = SENSOR_POLLS.labels('unchanged')
+SENSOR_POLLS_ERROR = SENSOR_POLLS.labels('error')
+SENSOR_READ_SECONDS = REGISTRY.histogram(
+    'garage_watch_sensor_read_seconds', 'Duration of the I2C reads of the sensor board',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 2.5))
+
+
+class FixedPollingPolicy(object):
+    """
+    Poll always at the same interval
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+
+    def next_interval(self, changed):
+        return self.interval
+
+
+class AdaptivePollingPolicy(object):
+    """
+    Poll at `min_interval` right after a change, keep that rate for
+    `fast_polls` polls and then back off exponentially by `backoff` up
+    to `max_interval` while nothing changes
+    """
+
+    def __init__(self, min_interval=0.25, max_interval=2, backoff=1.5, fast_polls=8):
+        assert 0 < min_interval <= max_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.fast_polls = fast_polls
+        self.interval = max_interval
+        self.idle_polls = 0
+
+    def next_interval(self, changed):
+        if changed:
+            self.idle_polls = 0
+            self.interval = self.min_interval
+        else:
+            self.idle_polls += 1
+            if self.idle_polls > self.fast_polls:
+                self.interval = min(self.interval * self.backoff, self.max_interval)
+        return self.interval
+
+
+class PollingStats(object):
+    """
+    Counts polls and the latency of detected changes. A change happened
+    at some point since the previous poll so the detection latency is
+    bounded by the time elapsed between the two polls
+    """
+
+    def __init__(self):
+        self.polls = 0
+        self.changes = 0
+        self.last_poll_time = None
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def record(self, poll_time, changed):
+        (SENSOR_POLLS_CHANGED if changed else SENSOR_POLLS_UNCHANGED).inc()
+        previous = self.last_poll_time
+        self.last_poll_time = poll_time
+        self.polls += 1
+        if not changed or previous is None:
+            return
+        latency = poll_time - previous
+        self.changes += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    @property
+    def latency_mean(self):
+        return self.latency_total / self.changes if self.changes else 0.0
+
+    def summary(self):
+        return dict(
+            polls=self.polls,
+            changes=self.changes,
+            latency_mean=round(self.latency_mean, 3),
+            latency_max=round(self.latency_max, 3),
+        )
@@ -0,0 +1,69 @@
+"""
+Bounded queue of the MQTT messages published while disconnected
+
+Messages of state topics are compacted, only the latest value of each
+topic is kept, placed where it was last published. Event messages are
+all kept in order. Once `max_messages` are waiting the oldest message is
+dropped.
+"""
+import itertools
+import logging
+
+from collections import OrderedDict
+
+from garage_watch.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+MQTT_QUEUE_DROPPED = REGISTRY.counter(
+    'garage_watch_mqtt_queue_dropped_total', 'MQTT messages dropped from the full offline queue')
+
+
+class PublishQueue(object):
+
+    def __init__(self, max_messages=100):
+        self.max_messages = max_messages
+        self.messages = OrderedDict()
+        self.counter = itertools.count()
+        self.queued = 0
+        self.compacted = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.messages)
+
+    def put(self, topic, message, retain=False, compact=False):
+        """
+        Queue a message, `compact` for topics where only the latest
+        value matters
+        """
+        if compact:
+            key = ('state', topic)
+            if self.messages.pop(key, None) is not None:
+                self.compacted += 1
+        else:
+            key = ('event', next(self.counter))
+        self.messages[key] = (topic, message, retain, compact)
+        self.queued += 1
+
+        while len(self.messages) > self.max_messages:
+            (kind, _), (topic, _, _, _) = self.messages.popitem(last=False)
+            self.dropped += 1
+            MQTT_QUEUE_DROPPED.inc()
+            logger.warning("MQTT queue full, dropping %s message of %s", kind, topic)
+
+    def drain(self):
+        """
+        Remove and yield the messages in order
+        """
+        while self.messages:
+            _, message = self.messages.popitem(last=False)
+            yield message
+
+    def stats(self):
+        return dict(
+            depth=len(self.messages),
+            queued=self.queued,
+            compacted=self.compacted,
+            dropped=self.dropped,
+        )
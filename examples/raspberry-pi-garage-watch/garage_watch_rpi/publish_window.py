@@ -0,0 +1,185 @@
+"""
+Sizing of the MQTT in-flight window from the acknowledgement latency
+
+The window grows by one message per window of fast acknowledgements and
+is halved when acknowledgements get slow or publications fail (additive
+increase, multiplicative decrease), so bursts go out at once on a good
+link and a flaky link isn't flooded with retransmissions.
+
+`WindowedPublisher` keeps the QoS > 0 publications in flight within the
+window itself, the MQTT protocol window stays fixed at the maximum for
+the whole session. Failed publications are retried with exponential
+backoff.
+"""
+import logging
+
+from collections import deque
+
+from twisted.internet import task
+from twisted.internet.defer import Deferred, succeed
+
+from garage_watch.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+MQTT_ACK_SECONDS = REGISTRY.histogram(
+    'garage_watch_mqtt_ack_seconds', 'Time from publishing to the acknowledgement of QoS > 0 messages')
+MQTT_RETRIES = REGISTRY.counter('garage_watch_mqtt_retries_total', 'MQTT publications retried')
+MQTT_FAILURES = REGISTRY.counter('garage_watch_mqtt_failures_total', 'MQTT publications failed after retries')
+
+
+class AdaptiveWindow(object):
+
+    def __init__(self, initial=3, minimum=1, maximum=16, target_latency=0.5):
+        assert minimum <= initial <= maximum
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.window = float(initial)
+
+    @property
+    def size(self):
+        return int(self.window)
+
+    def on_ack(self, latency):
+        if latency > self.target_latency:
+            self._decrease()
+        else:
+            self.window = min(self.window + 1.0 / self.window, self.maximum)
+
+    def on_failure(self):
+        self._decrease()
+
+    def _decrease(self):
+        self.window = max(self.window / 2, self.minimum)
+
+
+class PublishStats(object):
+    """
+    Acknowledgement latency, retries and failures of QoS > 0 publications
+    """
+
+    def __init__(self):
+        self.acks = 0
+        self.retries = 0
+        self.failures = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def record_ack(self, latency):
+        self.acks += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    def summary(self):
+        return dict(
+            acks=self.acks,
+            retries=self.retries,
+            failures=self.failures,
+            latency_mean=round(self.latency_total / self.acks, 4) if self.acks else 0.0,
+            latency_max=round(self.latency_max, 4),
+        )
+
+
+class WindowedPublisher(object):
+    """
+    Sends QoS > 0 publications with `send_fn(topic, message, retain, qos)`,
+    returning a Deferred fired on acknowledgement, with at most
+    `window.size` of them in flight. While disconnected, and for the ones
+    waiting when the connection is lost, `requeue_fn(topic, message,
+    retain, compact)` is called instead
+    """
+
+    # times a publication is retried before failing
+    MAX_RETRIES = 2
+    # seconds before the first retry, doubled on every attempt
+    RETRY_DELAY = 1
+    MAX_RETRY_DELAY = 30
+
+    def __init__(self, send_fn, requeue_fn, clock, window=None):
+        self.send_fn = send_fn
+        self.requeue_fn = requeue_fn
+        self.clock = clock
+        self.window = window or AdaptiveWindow()
+        self.stats = PublishStats()
+        self.connected = False
+        self.in_flight = 0
+        # (Deferred, topic, message, retain, compact, qos, attempt) beyond the window
+        self.waiting = deque()
+        # publications in flight belong to the session they were sent in
+        self.session = 0
+
+    def connect(self):
+        """
+        A new session started, nothing is in flight in it yet
+        """
+        self.session += 1
+        self.in_flight = 0
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+        while self.waiting:
+            d, topic, message, retain, compact, _, _ = self.waiting.popleft()
+            self.requeue_fn(topic, message, retain, compact)
+            d.callback(None)
+
+    def publish(self, topic, message, retain, compact, qos, attempt=0):
+        """
+        Send a publication, or keep it waiting if the window is full.
+        Returns a Deferred fired once acknowledged, requeued or failed
+        """
+        if not self.connected:
+            self.requeue_fn(topic, message, retain, compact)
+            return succeed(None)
+        if self.in_flight >= self.window.size:
+            d = Deferred()
+            self.waiting.append((d, topic, message, retain, compact, qos, attempt))
+            return d
+        return self._send(topic, message, retain, compact, qos, attempt)
+
+    def _send(self, topic, message, retain, compact, qos, attempt):
+        sent = self.clock.seconds()
+        self.in_flight += 1
+        d = self.send_fn(topic, message, retain, qos)
+        d.addBoth(self._settled, self.session)
+        d.addCallbacks(
+            self._acknowledged, self._failed,
+            callbackArgs=(sent,), errbackArgs=(topic, message, retain, compact, qos, attempt))
+        return d
+
+    def _settled(self, result, session):
+        if session == self.session:
+            self.in_flight -= 1
+        return result
+
+    def _send_waiting(self):
+        while self.waiting and self.connected and self.in_flight < self.window.size:
+            d, topic, message, retain, compact, qos, attempt = self.waiting.popleft()
+            self._send(topic, message, retain, compact, qos, attempt).chainDeferred(d)
+
+    def _acknowledged(self, result, sent):
+        latency = self.clock.seconds() - sent
+        self.stats.record_ack(latency)
+        MQTT_ACK_SECONDS.observe(latency)
+        self.window.on_ack(latency)
+        self._send_waiting()
+        return result
+
+    def _failed(self, failure, topic, message, retain, compact, qos, attempt):
+        self.window.on_failure()
+        if not self.connected:
+            # sent again once reconnected
+            self.requeue_fn(topic, message, retain, compact)
+            return None
+        self._send_waiting()
+        if attempt >= self.MAX_RETRIES:
+            self.stats.failures += 1
+            MQTT_FAILURES.inc()
+            return failure
+        self.stats.retries += 1
+        MQTT_RETRIES.inc()
+        delay = min(self.RETRY_DELAY * 2 ** attempt, self.MAX_RETRY_DELAY)
+        logger.info("Retrying MQTT publication to %s in %s s: %s", topic, delay, failure.getErrorMessage())
+        return task.deferLater(
+            self.clock, delay, self.publish, topic, message, retain, compact, qos, attempt + 1)
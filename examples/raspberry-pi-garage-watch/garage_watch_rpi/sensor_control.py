@@ -1,111 +1,386 @@
 import logging
+import time
 
-from smbus2 import SMBus
-from twisted.internet.task import LoopingCall
+from functools import partial
 
-bus = SMBus(1)
+from twisted.internet import defer, reactor
+
+from garage_watch import tracing
+from garage_watch.sensor_frames import (
+    ACK_REGISTER, EVENT_BUTTON, EVENT_DOOR_OPEN, EVENT_DOOR_CLOSED, SensorFrame, get_decoder)
+
+from .i2c_bus import ManagedSMBus, bus_manager
+from .polling import FixedPollingPolicy, PollingStats, SENSOR_POLLS_ERROR, SENSOR_READ_SECONDS
+
+# the I2C bus of the sensor board, opened on first use
+bus = None
 
 logger = logging.getLogger(__name__)
 
-def _periodic_check_door(instance):
+
+def _default_bus():
+    global bus
+    if bus is None:
+        # transactions go through the manager shared with the displays
+        bus = bus_manager.managed_smbus()
+    return bus
+
+
+def _read_bus_data(instance, bus):
+    """
+    Acknowledge the events processed and read the sensor board on `bus`,
+    blocking. Returns the data read, None on errors
+    """
+    instance.acknowledge_events(bus)
+    started = time.monotonic()
     try:
-        try:
-            bus_data = bus.read_i2c_block_data(instance.sensor_i2c_address, 0, 10)
-        except OSError:
-            return
+        bus_data = bus.read_i2c_block_data(
+            instance.sensor_i2c_address, 0, instance.decoder.LENGTH)
+    except OSError:
+        SENSOR_POLLS_ERROR.inc()
+        return None
+    except Exception:
+        logger.exception("Error reading the sensor board")
+        SENSOR_POLLS_ERROR.inc()
+        return None
+    SENSOR_READ_SECONDS.observe(time.monotonic() - started)
+    return bus_data
+
 
+def _process_bus_data(instance, bus_data):
+    """
+    Send the events for the data read from the sensor board. Returns True
+    if anything changed since the previous read
+    """
+    changed = False
+    if instance.recorder is not None:
+        instance.recorder.record(instance.sensor_i2c_address, bus_data, instance.clock.seconds())
+    try:
+        decode_started = time.monotonic()
+        frame = instance.decoder.decode_into(bus_data, instance.frame)
+        if frame.ack_sequence is not None:
+            # acknowledged before the next read
+            instance.ack_sequence = frame.ack_sequence
+        if frame.events_lost:
+            logger.warning("Sensor board dropped %s events", frame.events_lost)
 
         previous_door_state = instance.door_sensor
-        # check door sensor (value 0 means closed)
-        instance.door_sensor = SensorControl.DOOR_CLOSED if (bus_data[8] == 0x00) else SensorControl.DOOR_OPEN
-        
+        if frame.door_open is not None:
+            # check door sensor level
+            instance.door_sensor = SensorControl.DOOR_OPEN if frame.door_open else SensorControl.DOOR_CLOSED
+        else:
+            # protocol without door level, the latest door event tells the state
+            for code in frame.events:
+                if code == EVENT_DOOR_OPEN:
+                    instance.door_sensor = SensorControl.DOOR_OPEN
+                elif code == EVENT_DOOR_CLOSED:
+                    instance.door_sensor = SensorControl.DOOR_CLOSED
+
         # any change in the door sensor must be reported via event
         if previous_door_state != instance.door_sensor:
-            instance._send_event('door_open' if instance.door_sensor is SensorControl.DOOR_OPEN else 'door_closed')
+            changed = True
+            # door openings are traced down to the start of the recording
+            trace = tracing.Trace('door_open', decode_started) if instance.door_sensor else None
+            with tracing.activate(trace):
+                tracing.mark('decoded')
+                instance._send_event('door_open' if instance.door_sensor is SensorControl.DOOR_OPEN else 'door_closed')
+                instance._dispatch('door', instance.door_sensor, previous_door_state)
 
-        for data_byte in bus_data[0:5]:
+        for code in frame.events:
             # check sensor events
-            if data_byte == 0x03:
+            if code == EVENT_BUTTON:
+                changed = True
                 instance._send_event('override_button_pressed')
+                instance._dispatch('button', True, None)
+
+        # distance subscribers get it in every mode, their threshold
+        # filters the jitter
+        distance_changed = instance.parking_distance != frame.parking_distance
+        if distance_changed:
+            instance.parking_distance[0] = frame.parking_distance[0]
+            instance.parking_distance[1] = frame.parking_distance[1]
+            instance._dispatch_distance(instance.parking_distance)
 
         # check parking mode
-        parking_status = bus_data[5]
+        parking_status = frame.parking_status
         is_valid_parking_status = 0x00 <= parking_status <= 0x09
-        
+
         if is_valid_parking_status and (
                 parking_status != 0x00 or
                 instance.parking_status != 0x00):
-            instance.parking_mode = (parking_status == 0x00)
-            instance.parking_distance[0] = bus_data[6]
-            instance.parking_distance[1] = bus_data[7]
+            instance.parking_mode = (parking_status != 0x00)
+            # only polled faster for the distance while parking
+            if distance_changed:
+                changed = True
 
             if parking_status != instance.parking_status:
+                changed = True
                 instance._send_event('parking_status_changed', parking_status, instance.parking_status)
+                instance._dispatch('parking_status', parking_status, instance.parking_status)
                 instance.parking_status = parking_status
 
             # call the parking callbacks
             for fn, args, kwargs in instance.parking_event_callbacks:
-                fn(instance, *args, *kwargs)
-        
+                try:
+                    fn(instance, *args, **kwargs)
+                except Exception:
+                    logger.exception("Error in parking data callback")
+
     except:
-        logger.exception("Error in _periodic_check_door")
-        
-        
+        logger.exception("Error in _process_bus_data")
+
+    return changed
+
+
+class _Subscription(object):
+    __slots__ = ('fn', 'threshold', 'args', 'kwargs', 'last_value')
+
+    def __init__(self, fn, threshold, args, kwargs):
+        self.fn = fn
+        self.threshold = threshold
+        self.args = args
+        self.kwargs = kwargs
+        # value last dispatched to this subscription
+        self.last_value = None
+
+
 class SensorControl(object):
+    """
+    Polls the sensor board on the I2C bus and sends events on changes.
+
+    The time between polls is decided by the polling policy, `bus` and
+    `clock` can be replaced by `FakeSMBus` and `task.Clock` for testing.
+
+    `protocol_version` selects the layout of the sensor board frames, see
+    `garage_watch.sensor_frames`.
+
+    Reads through the bus manager run on its worker thread, a read hung
+    for `WATCHDOG_TIMEOUT` seconds is given up and the bus is reset.
+
+    Every frame read is given to `recorder`, a `FrameRecorder`, if set
+    """
 
     INTERVAL_REGULAR = 2
     INTERVAL_FAST = 0.5
 
     EVENTS = ['door_closed', 'door_open', 'override_button_pressed', 'parking_status_changed']
 
+    FIELDS = ['door', 'button', 'parking_status', 'parking_distance']
+
     event_handlers = None
     parking_event_callbacks = None
 
     DOOR_OPEN = True
     DOOR_CLOSED = False
 
-    def __init__(self, i2c_address):
+    WATCHDOG_TIMEOUT = 2
+
+    def __init__(self, i2c_address, bus=None, clock=None, policy=None,
+                 protocol_version=2, recorder=None):
         self.sensor_i2c_address = i2c_address
-        self.lc = None
+        self.recorder = recorder
+        self.decoder = get_decoder(protocol_version)
+        self.frame = SensorFrame()
+        self.bus = bus if bus is not None else _default_bus()
+        self.bus_resets = 0
+        self.clock = clock or reactor
+        self.policy = policy or FixedPollingPolicy(self.INTERVAL_REGULAR)
+        self.poll_interval = self.policy.next_interval(False)
+        self.stats = PollingStats()
+        self.scheduled_poll = None
+        self.running = False
         self.event_handlers = {k:[] for k in self.EVENTS}
         self.parking_event_callbacks = []
+        self.subscriptions = {k:[] for k in self.FIELDS}
+        self.dispatch_table = {}
         self.parking_status = 0
         self.parking_distance = [0, 0]
         self.parking_mode = False
         self.door_sensor = False
-        
+        # event FIFO sequence number to acknowledge, and the last one written
+        self.ack_sequence = None
+        self.acked_sequence = None
+
     def start(self, interval=None, now=True):
-        
+        """
+        Start polling, right away if `now`. An `interval` changes the
+        interval of the default fixed policy, it can't be combined with
+        another policy
+        """
+        if interval:
+            if not isinstance(self.policy, FixedPollingPolicy):
+                raise ValueError("Polling interval given to a SensorControl with {}".format(
+                    type(self.policy).__name__))
+            self.policy.interval = interval
         self.stop()
-        self.lc = LoopingCall(_periodic_check_door, self)
-        self.lc.start(interval or self.INTERVAL_REGULAR, now)
+        self.running = True
+        self.poll_interval = self.policy.next_interval(False)
+        self._schedule_poll(0 if now else self.poll_interval)
 
     def stop(self):
-        if self.lc and self.lc.running:
-            self.lc.stop()
-        
+        self.running = False
+        if self.scheduled_poll and self.scheduled_poll.active():
+            self.scheduled_poll.cancel()
+        self.scheduled_poll = None
+
+    def poll(self):
+        """
+        Read the sensor board once, returns a Deferred firing with True if
+        anything changed. Through the bus manager the read runs on its
+        worker and is given up after `WATCHDOG_TIMEOUT` seconds, other
+        buses are read right away
+        """
+        if isinstance(self.bus, ManagedSMBus):
+            d = self.bus.run_deferred(self.sensor_i2c_address, partial(_read_bus_data, self))
+            d.addTimeout(self.WATCHDOG_TIMEOUT, self.clock)
+            d.addErrback(self._read_failed)
+        else:
+            d = defer.succeed(_read_bus_data(self, self.bus))
+        d.addCallback(self._polled)
+        return d
+
+    def _polled(self, bus_data):
+        if bus_data is None:
+            self.stats.record(self.clock.seconds(), False)
+            self.poll_interval = self._next_interval(False)
+            return False
+        return self.process_bus_data(bus_data)
+
+    def _read_failed(self, failure):
+        SENSOR_POLLS_ERROR.inc()
+        if failure.check(defer.TimeoutError):
+            logger.error(
+                "I2C transaction to %#x hung for %.1f seconds, resetting bus",
+                self.sensor_i2c_address, self.WATCHDOG_TIMEOUT)
+            self.reset_bus()
+        else:
+            logger.error("Error reading the sensor board: %s", failure.getErrorMessage())
+        return None
+
+    def process_bus_data(self, bus_data):
+        """
+        Process the data read by `poll` and update `poll_interval`
+        """
+        changed = _process_bus_data(self, bus_data)
+        self.stats.record(self.clock.seconds(), changed)
+        self.poll_interval = self._next_interval(changed)
+        return changed
+
+    def acknowledge_events(self, bus=None):
+        """
+        Acknowledge the events processed so far to boards with an event
+        FIFO on `bus`, called right before a read on the same thread
+        """
+        sequence = self.ack_sequence
+        if sequence is None or sequence == self.acked_sequence:
+            return
+        try:
+            (bus if bus is not None else self.bus).write_byte_data(
+                self.sensor_i2c_address, ACK_REGISTER, sequence)
+        except Exception as exc:
+            # the board sends the events again, they are skipped by sequence
+            logger.debug("Error acknowledging sensor events: %s", exc)
+        else:
+            self.acked_sequence = sequence
+
+    def reset_bus(self):
+        """
+        Close and reopen the bus handle
+        """
+        self.bus_resets += 1
+        if hasattr(self.bus, 'reset'):
+            self.bus.reset()
+
+    def _next_interval(self, changed):
+        interval = self.policy.next_interval(changed)
+        # make faster reads while parking
+        if self.parking_mode:
+            interval = min(interval, self.INTERVAL_FAST)
+        return interval
+
+    def _schedule_poll(self, interval):
+        self.scheduled_poll = self.clock.callLater(interval, self._scheduled_poll)
+
+    def _scheduled_poll(self):
+        self.scheduled_poll = None
+        self.poll().addCallback(self._reschedule)
+
+    def _reschedule(self, changed):
+        # polling may have been stopped or restarted meanwhile
+        if self.running and self.scheduled_poll is None:
+            self._schedule_poll(self.poll_interval)
 
     def is_door_open(self):
-        return self.door_sensor 
+        return self.door_sensor
 
     def add_parking_data_update_callback(self, fn, *args, **kwargs):
         self.parking_event_callbacks.append((fn, args, kwargs))
-    
+
     def add_event_handler(self, event, fn, *args, **kwargs):
         self.event_handlers[event].append((fn, args, kwargs))
-    
+
+    def subscribe(self, field, fn, *args, threshold=0, **kwargs):
+        """
+        Call `fn(field, value, previous, *args, **kwargs)` when a field of
+        the sensor board changes. For `parking_distance` the call only
+        happens when either distance moved more than `threshold` since the
+        value last given to `fn`. Button presses have no previous value
+        """
+        self.subscriptions[field].append(_Subscription(fn, threshold, args, kwargs))
+        self._build_dispatch_table()
+
+    def unsubscribe(self, field, fn):
+        self.subscriptions[field] = [s for s in self.subscriptions[field] if s.fn != fn]
+        self._build_dispatch_table()
+
+    def _build_dispatch_table(self):
+        # only fields with subscribers are looked at when polling
+        self.dispatch_table = {
+            field: tuple(subscriptions)
+            for field, subscriptions in self.subscriptions.items() if subscriptions
+        }
+
+    def _dispatch(self, field, value, previous):
+        for subscription in self.dispatch_table.get(field, ()):
+            subscription.last_value = value
+            try:
+                subscription.fn(field, value, previous, *subscription.args, **subscription.kwargs)
+            except Exception:
+                logger.exception("Error in %s subscriber", field)
+
+    def _dispatch_distance(self, distance):
+        for subscription in self.dispatch_table.get('parking_distance', ()):
+            last = subscription.last_value
+            if last is not None and (
+                    abs(distance[0] - last[0]) <= subscription.threshold and
+                    abs(distance[1] - last[1]) <= subscription.threshold):
+                continue
+            subscription.last_value = (distance[0], distance[1])
+            try:
+                subscription.fn(
+                    'parking_distance', subscription.last_value, last,
+                    *subscription.args, **subscription.kwargs)
+            except Exception:
+                logger.exception("Error in parking_distance subscriber")
+
     def _send_event(self, event, *args, **kwargs):
+        tracing.mark('send_event')
         # detect special case of entering in parking mode
-        # make faster reads
+        # polls are faster while in parking mode
         if event == 'parking_status_changed':
             if args[1] == 0x00 and args[0] != 0x00:
                 self.parking_mode = True
-                self.start(self.INTERVAL_FAST, now=False)
                 logger.info("Entering parking mode")
             elif args[0] == 0x00 and args[1] != 0x00:
                 self.parking_mode = False
-                self.start(self.INTERVAL_REGULAR, now=False)
                 logger.info("Exiting parking mode")
 
-        for handler in self.event_handlers.get(event, []):
-            handler[0](data=(args, kwargs), *handler[1], **handler[2])
+        handlers = self.event_handlers.get(event)
+        if not handlers:
+            return
+        data = (args, kwargs)
+        for handler in handlers:
+            try:
+                handler[0](data=data, *handler[1], **handler[2])
+            except Exception:
+                logger.exception("Error in %s handler", event)
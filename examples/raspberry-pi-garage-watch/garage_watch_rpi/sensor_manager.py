@@ -0,0 +1,134 @@
+"""
+Polling of several sensor boards sharing the same I2C bus
+
+Instead of one polling loop per board, the manager owns the bus and a
+single schedule of reads. Every board keeps its own polling policy, and
+reads are spread in time so they don't hit the bus in bursts: a single
+board is read per tick, at least `min_spacing` seconds after the previous
+read started. Reads return Deferreds, the reactor never waits for the bus.
+"""
+import heapq
+import itertools
+import logging
+
+from twisted.internet import reactor
+
+from .sensor_control import SensorControl, _default_bus
+
+logger = logging.getLogger(__name__)
+
+
+class SensorManager(object):
+    """
+    Polls the sensor boards added with `add_device`. Handlers added with
+    `add_event_handler` get the events of every board, with the id of the
+    board in the `device_id` keyword argument
+    """
+
+    def __init__(self, bus=None, clock=None, min_spacing=0.02):
+        self.bus = bus if bus is not None else _default_bus()
+        self.clock = clock or reactor
+        # minimum seconds between two reads on the bus
+        self.min_spacing = min_spacing
+        self.devices = {}
+        self.event_handlers = {k:[] for k in SensorControl.EVENTS}
+        self.schedule = []
+        self.counter = itertools.count()
+        self.timer = None
+        self.running = False
+        # when the latest read was started
+        self.last_transaction = None
+
+    def add_device(self, device_id, i2c_address, policy=None, protocol_version=2, recorder=None):
+        """
+        Add a sensor board, returns its `SensorControl` which can be used
+        to add handlers or subscriptions of that board only
+        """
+        if device_id in self.devices:
+            raise ValueError("Duplicated sensor device id {}".format(device_id))
+        sc = SensorControl(
+            i2c_address, bus=self.bus, clock=self.clock, policy=policy,
+            protocol_version=protocol_version, recorder=recorder)
+        sc.device_id = device_id
+        for event in SensorControl.EVENTS:
+            sc.add_event_handler(event, self._forward_event, event, device_id)
+        self.devices[device_id] = sc
+
+        if self.running:
+            self._schedule(device_id, self._free_slot(self.clock.seconds()))
+        return sc
+
+    def add_event_handler(self, event, fn, *args, **kwargs):
+        self.event_handlers[event].append((fn, args, kwargs))
+
+    def start(self):
+        """
+        Start polling, the first reads are spread evenly over the
+        shortest polling interval
+        """
+        self.stop()
+        self.running = True
+        now = self.clock.seconds()
+        if not self.devices:
+            return
+        interval = min(sc.poll_interval for sc in self.devices.values())
+        step = max(interval / len(self.devices), self.min_spacing)
+        for i, device_id in enumerate(self.devices):
+            self._schedule(device_id, now + i * step)
+
+    def stop(self):
+        self.running = False
+        self.schedule = []
+        if self.timer and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+
+    def stats(self):
+        return {device_id: sc.stats.summary() for device_id, sc in self.devices.items()}
+
+    def _schedule(self, device_id, due):
+        heapq.heappush(self.schedule, (due, next(self.counter), device_id))
+        self._arm_timer()
+
+    def _arm_timer(self):
+        if self.timer and self.timer.active():
+            self.timer.cancel()
+        if not self.schedule:
+            self.timer = None
+            return
+        due = self.schedule[0][0]
+        if self.last_transaction is not None:
+            due = max(due, self.last_transaction + self.min_spacing)
+        delay = max(due - self.clock.seconds(), 0)
+        self.timer = self.clock.callLater(delay, self._tick)
+
+    def _free_slot(self, due):
+        """
+        Move `due` forward until it is `min_spacing` away from any
+        scheduled read
+        """
+        for other_due, _, _ in sorted(self.schedule):
+            if abs(other_due - due) < self.min_spacing:
+                due = other_due + self.min_spacing
+        return due
+
+    def _tick(self):
+        self.timer = None
+        if not self.running or not self.schedule:
+            return
+        # one read per tick, the next overdue board waits for min_spacing
+        _, _, device_id = heapq.heappop(self.schedule)
+        self.last_transaction = self.clock.seconds()
+        self.devices[device_id].poll().addCallback(self._polled, device_id)
+        self._arm_timer()
+
+    def _polled(self, changed, device_id):
+        # stopped meanwhile, or already scheduled again by a restart
+        if not self.running or any(entry[2] == device_id for entry in self.schedule):
+            return
+        sc = self.devices[device_id]
+        self._schedule(device_id, self._free_slot(self.clock.seconds() + sc.poll_interval))
+
+    def _forward_event(self, event, device_id, data=None):
+        for fn, args, kwargs in self.event_handlers.get(event, []):
+            fn(data=data, device_id=device_id, *args, **kwargs)
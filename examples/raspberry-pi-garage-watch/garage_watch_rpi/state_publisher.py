@@ -0,0 +1,174 @@
+"""
+Publication of states to MQTT without redundant messages
+
+The last published value of each topic is kept. Unchanged values are not
+published again. The first change is published right away and opens a
+`coalesce_window` seconds window, further changes within the window are
+coalesced and only the latest value is published when it ends. Values are
+published again every `heartbeat_interval` seconds so the broker side can
+tell the device is alive, these publications don't open a window.
+"""
+import logging
+
+from twisted.internet import reactor
+
+logger = logging.getLogger(__name__)
+
+
+class _TopicState(object):
+    __slots__ = ('value', 'retain', 'published_value', 'published_time', 'window_start', 'flush_call')
+
+    def __init__(self):
+        # latest value requested and the one the broker has
+        self.value = None
+        self.retain = False
+        self.published_value = None
+        self.published_time = None
+        # time of the last change published
+        self.window_start = None
+        self.flush_call = None
+
+
+class StatePublisher(object):
+    """
+    Publishes states through `publish_fn(topic, message, retain=...)`,
+    which is expected to hold the messages while disconnected
+    """
+
+    def __init__(self, publish_fn, coalesce_window=1.0, heartbeat_interval=300, clock=None):
+        self.publish_fn = publish_fn
+        self.coalesce_window = coalesce_window
+        self.heartbeat_interval = heartbeat_interval
+        self.clock = clock or reactor
+        self.topics = {}
+        self.heartbeat_call = None
+        self.published = 0
+        self.suppressed = 0
+        self.coalesced = 0
+
+    def publish_state(self, topic, value, retain=False):
+        """
+        Set the state of `topic`, publishing it if needed
+        """
+        state = self.topics.get(topic)
+        if state is None:
+            state = self.topics[topic] = _TopicState()
+        state.retain = retain
+
+        if state.flush_call is not None:
+            # a publication is waiting for the end of the window
+            if state.value != value:
+                self.coalesced += 1
+            state.value = value
+            return
+        state.value = value
+
+        if value == state.published_value:
+            self.suppressed += 1
+            return
+
+        now = self.clock.seconds()
+        if state.window_start is not None and now - state.window_start < self.coalesce_window:
+            state.flush_call = self.clock.callLater(
+                state.window_start + self.coalesce_window - now, self._flush, topic)
+            return
+        self._publish(topic, state, change=True)
+
+    def resend(self, before=None):
+        """
+        Publish every state again, e.g. when the broker lost them. With
+        `before` only the states last published before that time
+        """
+        for topic, state in self.topics.items():
+            if before is not None and state.published_time is not None and state.published_time >= before:
+                continue
+            if state.flush_call is not None and state.flush_call.active():
+                state.flush_call.cancel()
+            state.flush_call = None
+            self._publish(topic, state)
+
+    def stats(self):
+        return dict(
+            published=self.published,
+            suppressed=self.suppressed,
+            coalesced=self.coalesced,
+        )
+
+    def _flush(self, topic):
+        state = self.topics[topic]
+        state.flush_call = None
+        if state.value == state.published_value:
+            # changed back within the window
+            self.suppressed += 1
+            return
+        self._publish(topic, state, change=True)
+
+    def _publish(self, topic, state, change=False):
+        try:
+            self.publish_fn(topic, state.value, retain=state.retain)
+        except Exception:
+            logger.exception("Error publishing state of %s", topic)
+            return
+        self.published += 1
+        state.published_value = state.value
+        state.published_time = self.clock.seconds()
+        if change:
+            state.window_start = state.published_time
+        self._schedule_heartbeat()
+
+    def _schedule_heartbeat(self):
+        """
+        Wake up only when the oldest publication is due again
+        """
+        if not self.heartbeat_interval:
+            return
+        times = [s.published_time for s in self.topics.values() if s.published_time is not None]
+        if not times:
+            return
+        delay = max(min(times) + self.heartbeat_interval - self.clock.seconds(), 0)
+        if self.heartbeat_call is not None and self.heartbeat_call.active():
+            if self.heartbeat_call.getTime() <= self.clock.seconds() + delay:
+                return
+            self.heartbeat_call.cancel()
+        self.heartbeat_call = self.clock.callLater(delay, self._heartbeat)
+
+    def _heartbeat(self):
+        self.heartbeat_call = None
+        # some slack so rounding never leaves the timer's topic unpublished
+        due = self.clock.seconds() - self.heartbeat_interval + 0.01
+        for topic, state in self.topics.items():
+            if state.flush_call is None and state.published_time is not None and state.published_time <= due:
+                self._publish(topic, state)
+        self._schedule_heartbeat()
+
+
+class Deadband(object):
+    """
+    Downsampling of a numeric value: `accept` is True when the value moved
+    `deadband` or more since the last accepted value, or `max_interval`
+    seconds passed, but never more often than every `min_interval` seconds
+    """
+
+    def __init__(self, deadband, min_interval=0.5, max_interval=30, clock=None):
+        self.deadband = deadband
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.clock = clock or reactor
+        self.last_value = None
+        self.last_time = None
+
+    def accept(self, value):
+        now = self.clock.seconds()
+        if self.last_value is not None:
+            elapsed = now - self.last_time
+            if elapsed < self.min_interval:
+                return False
+            if abs(value - self.last_value) < self.deadband and elapsed < self.max_interval:
+                return False
+        self.last_value = value
+        self.last_time = now
+        return True
+
+    def reset(self):
+        self.last_value = None
+        self.last_time = None
@@ -0,0 +1,101 @@
+"""
+Queue of frames waiting to be uploaded to the server
+
+Uploads happen one at a time in the reactor thread pool, the frame with
+the highest priority (lowest value) goes first so the pictures taken when
+the door opens are not stuck behind periodic snapshots.
+"""
+import heapq
+import itertools
+import logging
+
+from twisted.internet import threads
+
+from garage_watch.metrics import REGISTRY
+
+# logger for the script
+logger = logging.getLogger(__name__)
+
+UPLOAD_BACKLOG = REGISTRY.gauge('garage_watch_upload_backlog', 'Frames waiting to be uploaded')
+UPLOAD_DROPPED = REGISTRY.counter('garage_watch_upload_dropped_total', 'Frames dropped from the full upload queue')
+
+
+class UploadQueue(object):
+
+    PRIORITY_BURST = 0
+    PRIORITY_SNAPSHOT = 10
+
+    def __init__(self, upload_fn, max_pending=30, run_in_thread=None):
+        self.upload_fn = upload_fn
+        # runs the upload returning a Deferred, the reactor thread pool by default
+        self.run_in_thread = run_in_thread or threads.deferToThread
+        self.max_pending = max_pending
+        self.pending = []
+        self.counter = itertools.count()
+        self.uploading = False
+        self.uploaded = 0
+        self.dropped = 0
+        self.backlog_listeners = []
+
+    def __len__(self):
+        """
+        Number of frames waiting, including the one being uploaded
+        """
+        return len(self.pending) + (1 if self.uploading else 0)
+
+    def put(self, frame, priority=PRIORITY_SNAPSHOT):
+        """
+        Enqueue a frame for upload, the frame is retained until uploaded
+        """
+        frame.retain()
+        heapq.heappush(self.pending, (priority, next(self.counter), frame))
+
+        if len(self.pending) > self.max_pending:
+            # drop the newest frame with the lowest priority
+            item = max(self.pending)
+            self.pending.remove(item)
+            heapq.heapify(self.pending)
+            item[2].release()
+            self.dropped += 1
+            UPLOAD_DROPPED.inc()
+            logger.warning("Upload queue full, frame dropped")
+
+        self._upload_next()
+        self._notify_backlog()
+
+    def add_backlog_listener(self, fn):
+        """
+        Call `fn(backlog)` when the number of frames waiting changes
+        """
+        self.backlog_listeners.append(fn)
+
+    def _notify_backlog(self):
+        backlog = len(self)
+        UPLOAD_BACKLOG.set(backlog)
+        for fn in self.backlog_listeners:
+            fn(backlog)
+
+    def consumer(self, priority):
+        """
+        Return a frame bus consumer enqueuing frames with the given priority
+        """
+        def _consumer(frame):
+            self.put(frame, priority)
+        return _consumer
+
+    def _upload_next(self):
+        if self.uploading or not self.pending:
+            return
+        _, _, frame = heapq.heappop(self.pending)
+        self.uploading = True
+        d = self.run_in_thread(self.upload_fn, frame)
+        d.addErrback(
+            lambda failure: logger.error("Error uploading frame: %s", failure.getErrorMessage()))
+        d.addBoth(self._upload_done, frame)
+
+    def _upload_done(self, result, frame):
+        frame.release()
+        self.uploaded += 1
+        self.uploading = False
+        self._upload_next()
+        self._notify_backlog()
@@ -21,15 +21,30 @@ import argparse
 
 from logging.handlers import TimedRotatingFileHandler
 
-from twisted.internet.task import LoopingCall
 from twisted.internet import reactor
+from twisted.web.resource import Resource
+from twisted.web.server import Site
 
+from garage_watch import tracing
 from garage_watch_rpi.camera_controller import GarageCameraController
-from garage_watch_rpi.sensor_control import SensorControl
+from garage_watch_rpi.sensor_manager import SensorManager
+from garage_watch_rpi.i2c_bus import bus_manager
+from garage_watch_rpi.loop_monitor import loop_monitor
+from garage_watch_rpi.log_pipeline import AsyncBatchHandler, JSONFormatter
+from garage_watch_rpi.polling import AdaptivePollingPolicy
+from garage_watch_rpi.frame_recorder import FrameRecorder
+from garage_watch_rpi.door_input import GPIODoorInput, I2CDoorInput
+from garage_watch_rpi.parking_distance import ParkingDistanceTracker
 from garage_watch_rpi.parking_controller_led import LEDParkingController
 from garage_watch_rpi.clock_controller import ClockController
+from garage_watch_rpi.live_stream import LiveStream, LiveStreamResource
+from garage_watch_rpi.metrics_resource import MetricsResource
+from garage_watch_rpi.frame_bus import FrameBus
+from garage_watch_rpi.upload_queue import UploadQueue
 
-from garage_watch_rpi.mqtt_controller import MQTTService
+from garage_watch_rpi.mqtt_controller import MQTTService, COMMAND_TOPIC_PREFIX
+from garage_watch_rpi.commands import CommandRouter
+from garage_watch_rpi.state_publisher import Deadband
 
 # logger for the script
 logger = logging.getLogger(__name__)
@@ -70,36 +85,88 @@ def main():
         default='',
         help="the path to serialized jwk for jwt authentication")
 
+    parser.add_argument(
+        "--http-port",
+        type=int,
+        default=0,
+        help="the port of the http server with the live stream and metrics, 0 to disable")
+
+    parser.add_argument(
+        "--live-stream-fps",
+        type=float,
+        default=2,
+        help="the maximum frames per second sent to live stream clients")
+
+    parser.add_argument(
+        "--burst-count",
+        type=int,
+        default=5,
+        help="the number of frames uploaded right away when the door opens, 0 to disable")
+
+    parser.add_argument(
+        "--poll-min-interval",
+        type=float,
+        default=0.25,
+        help="the seconds between sensor polls right after a change")
+
+    parser.add_argument(
+        "--poll-max-interval",
+        type=float,
+        default=2,
+        help="the maximum seconds between sensor polls while idle")
+
+    parser.add_argument(
+        "--sensor-protocol",
+        type=int,
+        default=2,
+        help="the version of the frames sent by the sensor board")
+
+    parser.add_argument(
+        "--sensor-record-dir",
+        type=str,
+        default='',
+        help="the directory to record the raw sensor board frames, empty to disable")
+
+    parser.add_argument(
+        "--door-gpio-pin",
+        type=int,
+        default=0,
+        help="the GPIO pin of the door sensor, 0 to read it from the sensor board")
+
+    parser.add_argument(
+        "--mqtt-heartbeat",
+        type=float,
+        default=300,
+        help="the seconds between publications of unchanged states to MQTT, 0 to disable")
 
     args = parser.parse_args()
 
-    logconfig_kwargs = {}
-    
     if args.log_dir != 'console':
         # configure logging 
-        # rotating file handler, 5 MB per file
-        trfh = TimedRotatingFileHandler(
+        # file rotated every midnight, as JSON lines
+        log_target = TimedRotatingFileHandler(
             os.path.join(args.log_dir, 'garage-camera.log'),
             when='midnight',
             backupCount=14,
         )
-        logconfig_kwargs['handlers'] = [trfh]
-
-    # set up logging to print to console
-    logging.basicConfig(
-        format='[%(levelname)s][%(asctime)s][%(name)s] %(message)s',
-        level=logging.INFO,
-        **logconfig_kwargs
-    )
+        log_formatter = JSONFormatter()
+    else:
+        # set up logging to print to console
+        log_target = logging.StreamHandler()
+        log_formatter = logging.Formatter('[%(levelname)s][%(asctime)s][%(name)s] %(message)s')
+
+    # records are written by a thread, never blocking the reactor
+    log_target.setFormatter(log_formatter)
+    log_handler = AsyncBatchHandler(log_target)
+    logging.basicConfig(level=logging.INFO, handlers=[log_handler])
+    reactor.addSystemEventTrigger('after', 'shutdown', log_handler.close)
     # disable logging of transitions module
     logging.getLogger('transitions').setLevel(logging.ERROR)
     # disable logging of scp module
     logging.getLogger('twisted').setLevel(logging.INFO)
 
-    mqtt_service = MQTTService(reactor)
+    mqtt_service = MQTTService(reactor, heartbeat_interval=args.mqtt_heartbeat)
     mqtt_service.startService()
-    # default value for door on connected
-    mqtt_service.whenConnected().addCallback(lambda *args: mqtt_service.report_door_closed())
 
     PUSHBULLET_SECRET = os.environ.get('PUSHBULLET_SECRET', None)
     if not PUSHBULLET_SECRET:
@@ -121,49 +188,97 @@ def main():
     cam_control.upload_auth_jwk_path = args.upload_auth_jwk_path
     cam_control.pushbullet_secret = PUSHBULLET_SECRET
 
+    # serve the live view of the camera
+    if args.http_port:
+        live_stream = LiveStream(cam_control.camera, fps=args.live_stream_fps)
+        http_root = Resource()
+        http_root.putChild(b'stream.mjpg', LiveStreamResource(live_stream))
+        http_root.putChild(b'metrics', MetricsResource())
+        reactor.listenTCP(args.http_port, Site(http_root))
+
+    # frames are uploaded one at a time, door open bursts go first
+    upload_queue = UploadQueue(cam_control.upload_picture)
+    upload_queue.add_backlog_listener(mqtt_service.report_upload_backlog)
+
+    cam_control.add_state_listener(mqtt_service.report_camera_state)
+
+    # snapshots are published once and consumed in parallel
+    snapshot_bus = FrameBus()
+    snapshot_bus.subscribe('upload', upload_queue.consumer(UploadQueue.PRIORITY_SNAPSHOT))
+    snapshot_bus.subscribe('disk', cam_control.save_picture, threaded=True)
+
+    def publish_snapshot_thumbnail(frame):
+        thumbnail = frame.thumbnail()
+        if thumbnail is None:
+            return
+        # copied as the message outlives the frame in the mqtt protocol
+        mqtt_service.report_snapshot_thumbnail(bytes(thumbnail))
+
+    snapshot_bus.subscribe('mqtt_thumbnail', publish_snapshot_thumbnail)
+
+    # frames captured in memory as soon as the door opens
+    burst_bus = FrameBus()
+    burst_bus.subscribe('upload', upload_queue.consumer(UploadQueue.PRIORITY_BURST))
+    cam_control.burst_bus = burst_bus
+    cam_control.burst_count = args.burst_count
+
     # configure periodically taking a picture
     def periodic_take_picture():
-        picture_stream = cam_control.take_picture()
-        cam_control.upload_picture(picture_stream)
-        cam_control.save_picture(picture_stream)
+        frame = cam_control.take_picture(thumbnail_size=(320, 180))
+        if frame is not None:
+            mqtt_service.report_last_snapshot(frame.timestamp.astimezone())
+            snapshot_bus.publish(frame)
 
-    def periodic_report_door_status():
-        # report status of door open based on door sensor
-        if not mqtt_service.connected or not sc:
-            return
-        if sc.is_door_open():
+    # remote control over MQTT
+    command_router = CommandRouter(COMMAND_TOPIC_PREFIX, mqtt_service.publish)
+    command_router.register('cancel', cam_control.cancel_requested)
+    command_router.register('snapshot', periodic_take_picture)
+    mqtt_service.command_router = command_router
+
+    def report_door_status():
+        # report status of door open based on door sensor, it is sent
+        # once connected and then on changes
+        if door_input.is_door_open():
             mqtt_service.report_door_open()
         else:
             mqtt_service.report_door_closed()
 
-    lc = LoopingCall(periodic_take_picture)
-    lc.start(60)
-    
-    lc = LoopingCall(periodic_report_door_status)
+    lc = loop_monitor.looping_call(periodic_take_picture)
     lc.start(60)
+
+    def periodic_report_stats():
+        logger.info("Snapshot buffer pool stats %s", cam_control.buffer_pool.stats())
+        logger.info("Sensor polling stats %s", sensor_manager.stats())
+        logger.info("Door input latency stats %s", door_input.latency.summary())
+        logger.info("I2C bus stats %s", bus_manager.stats())
+        logger.info("Reactor loop lag %s", loop_monitor.summary())
+        logger.info("Logging stats %s", log_handler.stats())
+        logger.info("MQTT state publishing stats %s", mqtt_service.state_publisher.stats())
+        logger.info("MQTT offline queue stats %s", mqtt_service.queue.stats())
+        logger.info("MQTT publishing stats %s", mqtt_service.publish_stats_summary())
+        logger.info("MQTT command stats %s", command_router.stats.summary())
+
+    lc = loop_monitor.looping_call(periodic_report_stats)
+    lc.start(3600, False)
     
     # define the matrix for parking
     parking_control = LEDParkingController(rotation=180, i2c_address=0x70)
-    def parking_control_status_changed(data, *args, **kwargs):
-        new_state, old_state = data[0]
-        ev = parking_control.events_dict.get(new_state)
-        if not ev:
-            return
-        # debug
-        # print(ev)
-        # send the event
-        fn = getattr(parking_control, ev)
-        fn()
+    def parking_state_changed(state, previous):
+        # the stable state of the tracker, not the raw sensor board status
+        getattr(parking_control, 'do_' + state)()
+        mqtt_service.report_parking_status(state)
 
-    def parking_control_update_callback(sc, *args, **kwargs):
+    def parking_distance_changed(field, distance, previous, *args, **kwargs):
         # DEBUG:
-        # print(sc.parking_distance)
-        # parking_control.write_amounts(sc.parking_distance[0], sc.parking_distance[1])
+        # print(distance)
+        # parking_control.write_amounts(distance[0], distance[1])
         pass
 
     def door_open_handler(*args, **kwargs):
+        tracing.mark('handler')
         cam_control.door_open()
-        mqtt_service.report_door_open()
+        with tracing.span('mqtt_report'):
+            mqtt_service.report_door_open()
 
     def door_close_handler(*args, **kwargs):
         cam_control.door_closed()
@@ -172,19 +287,55 @@ def main():
     def override_button_handler(*args, **kwargs):
         cam_control.cancel_requested()
     
-    sc = SensorControl(0x27)
-    sc.add_event_handler('parking_status_changed', parking_control_status_changed, sc=sc)
-    sc.add_parking_data_update_callback(parking_control_update_callback)
+    recorder = FrameRecorder(args.sensor_record_dir) if args.sensor_record_dir else None
+    if recorder is not None:
+        reactor.addSystemEventTrigger('after', 'shutdown', recorder.close)
+    # the boards are read on the I2C bus worker, on a single schedule
+    sensor_manager = SensorManager()
+    sc = sensor_manager.add_device(
+        'sensor_board', 0x27, protocol_version=args.sensor_protocol, recorder=recorder,
+        policy=AdaptivePollingPolicy(
+            min_interval=args.poll_min_interval,
+            max_interval=args.poll_max_interval))
+    # the frames read are processed in the reactor
+    sc.process_bus_data = loop_monitor.wrap(sc.process_bus_data, 'sensor_process')
+    sc.subscribe('parking_distance', parking_distance_changed, threshold=1)
+
+    # smoothed parking distances for consumers not needing the raw bytes
+    parking_tracker = ParkingDistanceTracker()
+    sc.add_parking_data_update_callback(parking_tracker.update)
+    parking_tracker.subscribe_state(parking_state_changed)
+
+    # telemetry of the parking, the distance downsampled with a deadband
+    distance_deadband = Deadband(2, min_interval=0.5)
+    def parking_telemetry(smoothed, velocity, state):
+        distance = float(smoothed.min())
+        if distance_deadband.accept(distance):
+            mqtt_service.report_parking_distance(distance)
+
+    parking_tracker.subscribe(parking_telemetry)
 
-    sc.add_event_handler('door_closed', door_close_handler)
-    sc.add_event_handler('door_open', door_open_handler)
     sc.add_event_handler('override_button_pressed', override_button_handler)
 
+    # the door sensor goes to a GPIO pin or to the sensor board
+    if args.door_gpio_pin:
+        door_input = GPIODoorInput(args.door_gpio_pin)
+    else:
+        door_input = I2CDoorInput(sc)
+    door_input.add_event_handler('door_closed', door_close_handler)
+    door_input.add_event_handler('door_open', door_open_handler)
+
     # clock with PIR sensor in pin 22 and led in 0x71
     cc = ClockController(22, 0x71)
     
-    sc.start()
+    door_input.start()
+    report_door_status()
+    mqtt_service.report_camera_state(cam_control.state)
+    mqtt_service.report_upload_backlog(len(upload_queue))
+    sensor_manager.start()
     
+    loop_monitor.start()
+
     # and kick off the reactor
     reactor.run()
 
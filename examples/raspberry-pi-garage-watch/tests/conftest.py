@@ -0,0 +1,7 @@
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# the example package and the garage_watch package of the repository
+sys.path[:0] = [os.path.dirname(HERE), os.path.abspath(os.path.join(HERE, '..', '..', '..'))]
@@ -0,0 +1,41 @@
+import json
+import unittest
+
+from twisted.internet import task
+
+from garage_watch_rpi.commands import (
+    CommandRouter, STATUS_DUPLICATE, STATUS_OK)
+
+PREFIX = 'garage_watch/test/command'
+
+
+class CommandRouterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.replies = []
+        self.runs = 0
+        self.router = CommandRouter(
+            PREFIX, publish_fn=lambda topic, message: self.replies.append(json.loads(message)),
+            burst=10, clock=task.Clock())
+        self.router.register('snapshot', self.snapshot)
+
+    def snapshot(self):
+        self.runs += 1
+
+    def send(self, payload):
+        return self.router.handle(PREFIX + '/snapshot', json.dumps(payload))
+
+    def test_repeated_id_not_run_again(self):
+        self.assertEqual(self.send({'id': 'a'}), STATUS_OK)
+        self.assertEqual(self.send({'id': 'a'}), STATUS_DUPLICATE)
+        self.assertEqual(self.send({'id': 7}), STATUS_OK)
+        self.assertEqual(self.send({'id': 7}), STATUS_DUPLICATE)
+        self.assertEqual(self.runs, 2)
+
+    def test_invalid_ids_handled_without_id(self):
+        for request_id in ([1, 2], {'a': 1}, 1.5, True):
+            with self.assertLogs('garage_watch_rpi.commands', 'WARNING'):
+                self.assertEqual(self.send({'id': request_id}), STATUS_OK)
+        self.assertEqual(self.runs, 4)
+        self.assertEqual(self.router.handled, {})
+        self.assertTrue(all(reply['id'] is None for reply in self.replies))
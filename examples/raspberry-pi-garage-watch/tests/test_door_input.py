@@ -0,0 +1,83 @@
+import unittest
+
+from twisted.internet import task
+
+from garage_watch_rpi.door_input import EdgeLatencyStats, FakeDoorInput
+
+
+class FakeDoorInputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.door = FakeDoorInput(bounce_time=0.05, clock=self.clock)
+        self.events = []
+        for event in FakeDoorInput.EVENTS:
+            self.door.add_event_handler(event, self.events.append, event)
+
+    def test_initially_open_door_sends_event(self):
+        door = FakeDoorInput(door_open=True, clock=self.clock)
+        door.add_event_handler('door_open', self.events.append, 'door_open')
+        door.start()
+        self.assertEqual(self.events, ['door_open'])
+        self.assertTrue(door.is_door_open())
+
+    def test_events_sent_from_the_reactor(self):
+        self.door.start()
+        self.door.set_door_open(True)
+        self.assertEqual(self.events, [])
+        self.clock.advance(0)
+        self.assertEqual(self.events, ['door_open'])
+
+    def test_bounces_ignored(self):
+        self.door.start()
+        self.door.set_door_open(True)
+        self.clock.advance(0.01)
+        self.door.set_door_open(False)
+        self.clock.advance(0.01)
+        self.door.set_door_open(True)
+        self.clock.advance(0.1)
+        self.door.set_door_open(False)
+        self.clock.advance(0)
+        self.assertEqual(self.events, ['door_open', 'door_closed'])
+        self.assertEqual(self.door.bounced, 2)
+
+    def test_repeated_level_not_sent_again(self):
+        self.door.start()
+        self.door.set_door_open(True)
+        self.clock.advance(1)
+        self.door.set_door_open(True)
+        self.clock.advance(1)
+        self.assertEqual(self.events, ['door_open'])
+
+    def test_latency_from_edge_to_event(self):
+        self.door.start()
+        self.door.set_door_open(True)
+        self.clock.advance(0.2)
+        summary = self.door.latency.summary()
+        self.assertEqual(summary['edges'], 1)
+        self.assertAlmostEqual(summary['latency_max'], 0.2)
+
+
+class EdgeLatencyStatsTest(unittest.TestCase):
+
+    def test_percentiles(self):
+        stats = EdgeLatencyStats()
+        for latency in range(1, 101):
+            stats.record(latency / 1000)
+        summary = stats.summary()
+        self.assertEqual(summary['edges'], 100)
+        self.assertAlmostEqual(summary['latency_p50'], 0.051, places=3)
+        self.assertAlmostEqual(summary['latency_p90'], 0.09, places=3)
+        self.assertAlmostEqual(summary['latency_max'], 0.1)
+
+    def test_percentiles_over_history(self):
+        stats = EdgeLatencyStats(history=10)
+        for _ in range(100):
+            stats.record(1.0)
+        for _ in range(10):
+            stats.record(0.01)
+        self.assertEqual(stats.summary()['latency_p90'], 0.01)
+        self.assertEqual(stats.summary()['latency_max'], 1.0)
+
+    def test_empty(self):
+        self.assertEqual(EdgeLatencyStats().summary()['latency_p50'], 0.0)
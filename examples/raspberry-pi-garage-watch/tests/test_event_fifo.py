@@ -0,0 +1,87 @@
+from twisted.internet import task
+from twisted.trial import unittest
+
+from garage_watch.sensor_frames import EVENT_BUTTON
+from garage_watch_rpi.fake_bus import SimulatedSensorBoard
+from garage_watch_rpi.sensor_control import SensorControl
+
+ADDRESS = 0x27
+
+
+class EventFIFOTest(unittest.SynchronousTestCase):
+    """
+    Version 3 protocol against the simulated board, every event must be
+    handled exactly once
+    """
+
+    def setUp(self):
+        self.build()
+
+    def build(self, **kwargs):
+        self.board = SimulatedSensorBoard(ADDRESS, **kwargs)
+        self.sc = SensorControl(ADDRESS, bus=self.board, clock=task.Clock(), protocol_version=3)
+        self.presses = 0
+        self.sc.add_event_handler('override_button_pressed', self.pressed)
+
+    def pressed(self, *args, **kwargs):
+        self.presses += 1
+
+    def push(self, count):
+        for _ in range(count):
+            self.board.push_event(EVENT_BUTTON)
+
+    def poll(self):
+        return self.successResultOf(self.sc.poll())
+
+    def test_events_beyond_the_frame_read_next_poll(self):
+        self.push(6)
+        self.assertTrue(self.poll())
+        self.assertEqual(self.presses, 4)
+        self.assertTrue(self.poll())
+        self.assertEqual(self.presses, 6)
+        self.assertFalse(self.poll())
+        self.assertEqual(self.presses, 6)
+        self.assertEqual(self.board.fifo, [])
+
+    def test_sequence_wraps(self):
+        self.build(first_sequence=0xFE)
+        for _ in range(3):
+            self.push(3)
+            self.poll()
+        self.poll()
+        self.assertEqual(self.presses, 9)
+        self.assertEqual(self.board.fifo, [])
+        self.assertEqual(self.sc.decoder.next_sequence, (0xFE + 9) & 0xFF)
+
+    def test_lost_ack_does_not_repeat_events(self):
+        self.push(2)
+        self.poll()
+        self.assertEqual(self.presses, 2)
+
+        write_byte_data = self.board.write_byte_data
+
+        def lost_ack(address, register, value):
+            self.board.write_byte_data = write_byte_data
+            raise OSError("Remote I/O error")
+
+        self.board.write_byte_data = lost_ack
+        self.push(1)
+        # the events stay in the board FIFO and are read again
+        self.poll()
+        self.assertEqual(len(self.board.fifo), 3)
+        self.assertEqual(self.presses, 3)
+        self.poll()
+        self.assertEqual(self.presses, 3)
+        self.assertEqual(self.board.fifo, [])
+
+    def test_dropped_events_reported(self):
+        self.build(capacity=2)
+        self.poll()
+        self.push(5)
+        with self.assertLogs('garage_watch_rpi.sensor_control', 'WARNING') as logs:
+            self.poll()
+        self.assertEqual(self.sc.frame.events_lost, 3)
+        self.assertIn("dropped 3 events", logs.output[0])
+        self.assertEqual(self.presses, 2)
+        self.poll()
+        self.assertEqual(self.sc.frame.events_lost, 0)
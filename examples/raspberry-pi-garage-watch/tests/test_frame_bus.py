@@ -0,0 +1,47 @@
+import unittest
+
+from twisted.internet import defer
+
+from garage_watch_rpi.frame_bus import Frame, FrameBus
+
+
+class FrameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.released = []
+        self.frame = Frame(bytearray(b'0123456789xx'), length=10, on_release=self.released.append)
+
+    def test_views_released_with_frame(self):
+        whole = self.frame.view()
+        part = self.frame.view(2, 5)
+        self.frame.thumbnail_range = (6, 8)
+        thumbnail = self.frame.thumbnail()
+        self.assertEqual(bytes(whole), b'0123456789')
+        self.assertEqual(bytes(part), b'234')
+        self.assertEqual(bytes(thumbnail), b'67')
+        self.frame.release()
+        self.assertEqual(len(self.released), 1)
+        for view in (whole, part, thumbnail):
+            with self.assertRaises(ValueError):
+                bytes(view)
+        with self.assertRaises(ValueError):
+            self.frame.view()
+
+    def test_views_read_only(self):
+        with self.assertRaises(TypeError):
+            self.frame.view()[0] = 0
+
+
+class FrameBusTest(unittest.TestCase):
+
+    def test_frame_released_once_consumers_are_done(self):
+        released = []
+        frame = Frame(bytearray(4), on_release=released.append)
+        pending = defer.Deferred()
+        bus = FrameBus()
+        bus.subscribe('sync', lambda f: None)
+        bus.subscribe('async', lambda f: pending)
+        bus.publish(frame)
+        self.assertEqual(released, [])
+        pending.callback(None)
+        self.assertEqual(len(released), 1)
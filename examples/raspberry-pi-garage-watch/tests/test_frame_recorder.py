@@ -0,0 +1,85 @@
+import shutil
+import threading
+import tempfile
+import unittest
+
+from garage_watch_rpi.fake_bus import ReplaySMBus
+from garage_watch_rpi.frame_recorder import (
+    HEADER, RECORD, FrameRecorder, load_recordings, recording_files)
+
+ADDRESS = 0x27
+
+
+class FrameRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def record(self, timestamps, **kwargs):
+        # two records per file
+        recorder = FrameRecorder(self.directory, max_bytes=HEADER.size + 2 * RECORD.size, **kwargs)
+        for timestamp in timestamps:
+            recorder.record(ADDRESS, [int(timestamp) % 256] * 10, timestamp)
+        recorder.close()
+        return recorder
+
+    def test_files_of_the_same_second_sort_in_order(self):
+        recorder = self.record([1000.0, 1000.1, 1000.2, 1000.3, 1000.4])
+        files = recording_files(self.directory)
+        self.assertEqual(len(files), 3)
+        self.assertEqual(files[-1], recorder.path)
+        recordings = load_recordings(self.directory)
+        timestamps = [t for records in recordings for t in records['timestamp']]
+        self.assertEqual(timestamps, [1000.0, 1000.1, 1000.2, 1000.3, 1000.4])
+
+    def test_rotation_removes_the_oldest_files(self):
+        recorder = self.record([1000.0, 1000.1, 1001.0, 1001.1, 1002.0, 1002.1, 1003.0], backup_count=1)
+        files = recording_files(self.directory)
+        self.assertEqual(len(files), 2)
+        self.assertEqual(files[-1], recorder.path)
+        recordings = load_recordings(self.directory)
+        self.assertEqual(recordings[0]['timestamp'].tolist(), [1002.0, 1002.1])
+
+    def test_no_backups_keeps_only_the_current_file(self):
+        recorder = self.record([1000.0, 1000.1, 1001.0, 1001.1, 1002.0], backup_count=0)
+        self.assertEqual(recording_files(self.directory), [recorder.path])
+
+    def test_time_range_sliced_without_copy(self):
+        self.record([1000.0, 1001.0, 1002.0, 1003.0, 1004.0])
+        recordings = load_recordings(self.directory, start=1001.0, end=1004.0)
+        timestamps = [t for records in recordings for t in records['timestamp']]
+        self.assertEqual(timestamps, [1001.0, 1002.0, 1003.0])
+        for records in recordings:
+            self.assertFalse(records.flags.owndata)
+
+    def test_replay(self):
+        self.record([1000.0, 1001.0, 1002.0])
+        bus = ReplaySMBus(load_recordings(self.directory))
+        self.assertEqual(bus.read_i2c_block_data(ADDRESS, 0, 10), [232] * 10)
+        bus.write_byte_data(ADDRESS, 0x10, 1)
+        self.assertEqual(bus.read_i2c_block_data(ADDRESS, 0, 10), [233] * 10)
+        self.assertEqual(bus.writes, [(ADDRESS, 0x10, 1)])
+
+    def test_files_named_in_utc(self):
+        recorder = self.record([0.5])
+        self.assertTrue(recorder.path.endswith('frames-19700101-000000-000.bin'))
+
+    def test_writer_closes_file_after_slow_close(self):
+        recorder = FrameRecorder(self.directory)
+        recorder.CLOSE_TIMEOUT = 0.01
+        release = threading.Event()
+        write = recorder._write
+
+        def _slow_write(batch):
+            release.wait(5)
+            write(batch)
+
+        recorder._write = _slow_write
+        recorder.record(ADDRESS, [1] * 10, 1000.0)
+        with self.assertLogs('garage_watch_rpi.frame_recorder', 'WARNING'):
+            recorder.close()
+        release.set()
+        recorder.writer.join(5)
+        self.assertIsNone(recorder.file)
+        self.assertEqual(len(load_recordings(self.directory)[0]), 1)
@@ -0,0 +1,111 @@
+import threading
+import unittest
+
+from garage_watch_rpi.i2c_bus import PRIORITY_DISPLAY, PRIORITY_SENSOR, I2CBusManager
+
+TIMEOUT = 5
+
+
+class FakeHandle(object):
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeBusManager(I2CBusManager):
+
+    def __init__(self):
+        super().__init__(busnum=99)
+        self.handles = []
+
+    def _open_smbus(self):
+        handle = FakeHandle()
+        self.handles.append(handle)
+        return handle
+
+
+class I2CBusManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = FakeBusManager()
+        self.order = []
+
+    def block(self):
+        """
+        Keep the worker busy until the returned event is set
+        """
+        started = threading.Event()
+        release = threading.Event()
+
+        def _blocking():
+            started.set()
+            release.wait(TIMEOUT)
+
+        future = self.manager.submit(0x10, _blocking, priority=PRIORITY_SENSOR)
+        self.assertTrue(started.wait(TIMEOUT))
+        self.addCleanup(release.set)
+        return release, future
+
+    def run_later(self, device, name, **kwargs):
+        return self.manager.submit(device, self.order.append, name, **kwargs)
+
+    def test_sensor_reads_go_before_display_writes(self):
+        release, _ = self.block()
+        self.run_later(0x70, 'display1', priority=PRIORITY_DISPLAY)
+        self.run_later(0x27, 'sensor1', priority=PRIORITY_SENSOR)
+        self.run_later(0x71, 'display2', priority=PRIORITY_DISPLAY)
+        last = self.run_later(0x27, 'sensor2', priority=PRIORITY_SENSOR)
+        release.set()
+        last.result(TIMEOUT)
+        self.run_later(0x70, 'after', priority=PRIORITY_DISPLAY).result(TIMEOUT)
+        self.assertEqual(self.order, ['sensor1', 'sensor2', 'display1', 'display2', 'after'])
+
+    def test_waiting_writes_coalesced_by_key(self):
+        release, _ = self.block()
+        first = self.manager.write_display(0x70, self.order.append, 'frame1')
+        second = self.manager.write_display(0x70, self.order.append, 'frame2')
+        other = self.manager.write_display(0x71, self.order.append, 'other')
+        self.assertIs(first, second)
+        release.set()
+        first.result(TIMEOUT)
+        other.result(TIMEOUT)
+        self.assertEqual(self.order, ['frame2', 'other'])
+        self.assertEqual(self.manager.stats()['0x70']['coalesced'], 1)
+
+    def test_stats_split_queue_wait_and_execution(self):
+        release, _ = self.block()
+        waiting = self.run_later(0x27, 'read')
+        threading.Event().wait(0.05)
+        release.set()
+        waiting.result(TIMEOUT)
+        stats = self.manager.stats()
+        self.assertGreaterEqual(stats['0x27']['wait_max'], 0.05)
+        self.assertLess(stats['0x27']['execution_max'], 0.05)
+        self.assertGreaterEqual(stats['0x10']['execution_max'], 0.05)
+
+    def test_reset_closes_stuck_handle_once_worker_exits(self):
+        stuck = threading.Event()
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def _stuck():
+            self.manager.smbus()
+            stuck.set()
+            release.wait(TIMEOUT)
+
+        self.manager.submit(0x27, _stuck)
+        self.assertTrue(stuck.wait(TIMEOUT))
+        old_worker = self.manager.thread
+        self.manager.reset()
+        # the new worker gets its own handle
+        handle = self.manager.submit(0x27, self.manager.smbus).result(TIMEOUT)
+        old_handle = self.manager.handles[0]
+        self.assertIsNot(handle, old_handle)
+        self.assertFalse(old_handle.closed)
+        release.set()
+        old_worker.join(TIMEOUT)
+        self.assertTrue(old_handle.closed)
+        self.assertFalse(handle.closed)
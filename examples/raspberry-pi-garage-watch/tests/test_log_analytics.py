@@ -0,0 +1,176 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from unittest import mock
+
+import numpy as np
+
+from garage_watch_rpi import log_analytics
+from garage_watch_rpi.log_analytics import DAY, EVENT_CODES, EventStore, parse_line
+
+
+def json_line(ts, event):
+    return json.dumps({'ts': ts, 'level': 'INFO', 'logger': 'garage_watch', 'msg': event, 'event': event})
+
+
+class ParseLineTest(unittest.TestCase):
+
+    def test_json_event(self):
+        self.assertEqual(parse_line(json_line(100.5, 'door_open')), (100.5, EVENT_CODES['door_open']))
+
+    def test_json_without_event(self):
+        self.assertIsNone(parse_line(json.dumps({'ts': 1, 'msg': 'Snapshot saved to disk'})))
+        self.assertIsNone(parse_line(json_line(1, 'unknown_event')))
+        self.assertIsNone(parse_line('{not json'))
+
+    def test_legacy_line(self):
+        line = '[INFO][2020-12-01 10:20:30,250][garage_watch.camera_controller] Recording started'
+        expected = time.mktime(time.strptime('2020-12-01 10:20:30', '%Y-%m-%d %H:%M:%S')) + 0.25
+        self.assertEqual(parse_line(line), (expected, EVENT_CODES['record_start']))
+        self.assertIsNone(parse_line('[INFO][2020-12-01 10:20:30,250][x] Snapshot uploaded'))
+
+
+class IngestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.log_dir)
+        self.addCleanup(shutil.rmtree, self.store_dir)
+        self.path = os.path.join(self.log_dir, 'garage-camera.log')
+
+    def append(self, text, path=None):
+        with open(path or self.path, 'a') as f:
+            f.write(text)
+
+    def ingest(self):
+        store = EventStore(self.store_dir).load()
+        added = store.ingest(self.log_dir)
+        store.save()
+        return store, added
+
+    def test_only_new_lines_parsed(self):
+        self.append(json_line(10, 'door_open') + '\n' + json_line(20, 'door_closed') + '\n')
+        store, added = self.ingest()
+        self.assertEqual(added, 2)
+        # the incomplete line waits for the next ingestion
+        line = json_line(40, 'door_closed')
+        self.append(json_line(30, 'door_open') + '\n' + line[:20])
+        store, added = self.ingest()
+        self.assertEqual(added, 1)
+        self.append(line[20:] + '\n')
+        store, added = self.ingest()
+        self.assertEqual(added, 1)
+        self.assertEqual(store.timestamps.tolist(), [10, 20, 30, 40])
+
+    def test_rotated_file_not_read_again(self):
+        self.append(json_line(10, 'door_open') + '\n')
+        self.ingest()
+        os.rename(self.path, self.path + '.2020-12-01')
+        self.append(json_line(20, 'door_closed') + '\n')
+        store, added = self.ingest()
+        self.assertEqual(added, 1)
+        self.assertEqual(store.codes.tolist(), [EVENT_CODES['door_open'], EVENT_CODES['door_closed']])
+
+    def test_new_file_reusing_inode_read_from_start(self):
+        self.append(json_line(10, 'door_open') + '\n')
+        store, _ = self.ingest()
+        # same inode and a longer content, only the first line tells them apart
+        with open(self.path, 'w') as f:
+            f.write(json_line(20, 'record_start') + '\n' + json_line(30, 'record_end') + '\n')
+        store, added = self.ingest()
+        self.assertEqual(added, 2)
+        self.assertEqual(store.timestamps.tolist(), [10, 20, 30])
+
+    def test_failed_save_keeps_previous_store(self):
+        self.append(json_line(10, 'door_open') + '\n')
+        self.ingest()
+        self.append(json_line(20, 'door_closed') + '\n')
+        store = EventStore(self.store_dir).load()
+        store.ingest(self.log_dir)
+        with mock.patch.object(log_analytics.os, 'replace', side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                store.save()
+        # the events and the offsets of the previous save, nothing counted twice
+        store, added = self.ingest()
+        self.assertEqual(added, 1)
+        self.assertEqual(store.timestamps.tolist(), [10, 20])
+        self.assertEqual(os.listdir(self.store_dir), ['events.npz'])
+
+
+class CountByPeriodTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'Europe/Paris'
+        time.tzset()
+        self.addCleanup(self.restore_tz)
+
+    def restore_tz(self):
+        if self.tz is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = self.tz
+        time.tzset()
+
+    def local(self, text):
+        return time.mktime(time.strptime(text, '%Y-%m-%d %H:%M'))
+
+    def test_days_across_daylight_saving_change(self):
+        # summer time ends on 2020-10-25, a day of 25 hours
+        store = EventStore(None)
+        store.timestamps = np.array([
+            self.local('2020-10-24 23:30'),
+            self.local('2020-10-25 00:30'),
+            self.local('2020-10-25 23:30'),
+            self.local('2020-10-26 00:30'),
+        ])
+        store.codes = np.full(4, EVENT_CODES['door_open'], dtype=np.uint8)
+        days, counts = store.open_counts_per_day()
+        self.assertEqual(counts.tolist(), [1, 2, 1])
+        self.assertEqual(days.tolist(), [
+            self.local('2020-10-24 00:00'), self.local('2020-10-25 00:00'), self.local('2020-10-26 00:00')])
+        self.assertEqual(days[2] - days[1], DAY + 3600)
+
+    def test_fixed_offset(self):
+        store = EventStore(None)
+        store.timestamps = np.array([DAY - 1800, DAY + 1800], dtype=float)
+        store.codes = np.full(2, EVENT_CODES['door_open'], dtype=np.uint8)
+        days, counts = store.open_counts_per_day(utc_offset=3600)
+        self.assertEqual(counts.tolist(), [2])
+        self.assertEqual(days.tolist(), [DAY - 3600])
+
+
+class OpenDurationsTest(unittest.TestCase):
+
+    def store(self, events):
+        store = EventStore(None)
+        store.timestamps = np.array([ts for ts, _ in events], dtype=float)
+        store.codes = np.array([EVENT_CODES[event] for _, event in events], dtype=np.uint8)
+        return store
+
+    def test_pairs_opening_with_next_closing(self):
+        store = self.store([
+            (0, 'door_open'), (30, 'door_closed'),
+            (100, 'door_open'), (400, 'door_closed'),
+        ])
+        self.assertEqual(store.open_durations().tolist(), [30, 300])
+
+    def test_opening_without_closing_skipped(self):
+        store = self.store([
+            (0, 'door_open'),
+            (100, 'door_open'), (160, 'door_closed'),
+            (200, 'door_closed'),
+            (300, 'door_open'),
+        ])
+        self.assertEqual(store.open_durations().tolist(), [60])
+
+    def test_distribution(self):
+        store = self.store([(0, 'door_open'), (45, 'door_closed')])
+        distribution = store.open_duration_distribution()
+        self.assertEqual(distribution['counts'][:3], [0, 1, 0])
+        self.assertEqual(distribution['p50'], 45)
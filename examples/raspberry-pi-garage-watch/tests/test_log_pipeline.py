@@ -0,0 +1,90 @@
+import io
+import json
+import logging
+import sys
+import unittest
+
+from garage_watch_rpi.log_pipeline import AsyncBatchHandler, JSONFormatter
+
+
+def make_record(level, msg, *args, **extra):
+    record = logging.LogRecord('garage', level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+class JSONFormatterTest(unittest.TestCase):
+
+    def test_fields_and_extra(self):
+        record = make_record(logging.INFO, "Door %s", 'open', event='door', duration=1.5)
+        entry = json.loads(JSONFormatter().format(record))
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['logger'], 'garage')
+        self.assertEqual(entry['msg'], "Door open")
+        self.assertEqual(entry['event'], 'door')
+        self.assertEqual(entry['duration'], 1.5)
+        self.assertEqual(entry['ts'], round(record.created, 3))
+        self.assertNotIn('args', entry)
+        self.assertNotIn('exc', entry)
+
+    def test_exception_and_unserializable_values(self):
+        try:
+            raise ValueError("bad frame")
+        except ValueError:
+            record = logging.LogRecord('garage', logging.ERROR, __file__, 1, "Failed", None,
+                                       sys.exc_info())
+        record.frame = object()
+        entry = json.loads(JSONFormatter().format(record))
+        self.assertIn("ValueError: bad frame", entry['exc'])
+        self.assertTrue(entry['frame'].startswith('<object'))
+
+
+class AsyncBatchHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.target = logging.StreamHandler(self.stream)
+        self.target.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        # below the notification threshold and with a long interval the
+        # writer only runs when closed
+        self.handler = AsyncBatchHandler(self.target, max_records=20, flush_interval=60)
+
+    def tearDown(self):
+        self.handler.close()
+
+    def lines(self):
+        self.handler.close()
+        return self.stream.getvalue().splitlines()
+
+    def test_debug_dropped_first_then_info(self):
+        for i in range(10):
+            self.handler.emit(make_record(logging.INFO, "info %d", i))
+        # from half the maximum only DEBUG is dropped
+        self.handler.emit(make_record(logging.DEBUG, "debug"))
+        for i in range(10, 20):
+            self.handler.emit(make_record(logging.INFO, "info %d", i))
+        # at the maximum INFO is dropped too, warnings always kept
+        self.handler.emit(make_record(logging.INFO, "info 20"))
+        self.handler.emit(make_record(logging.WARNING, "warning"))
+        self.handler.emit(make_record(logging.ERROR, "error"))
+
+        self.assertEqual(self.handler.stats()['dropped'], {'DEBUG': 1, 'INFO': 1})
+        self.assertEqual(self.lines(), ['INFO info %d' % i for i in range(20)] + [
+            'WARNING warning', 'ERROR error'])
+        self.assertEqual(self.handler.stats()['written'], 22)
+
+    def test_debug_kept_below_half(self):
+        self.handler.emit(make_record(logging.DEBUG, "debug"))
+        self.assertEqual(self.lines(), ['DEBUG debug'])
+
+    def test_target_filters_applied(self):
+        self.target.addFilter(lambda record: 'secret' not in record.getMessage())
+        self.handler.emit(make_record(logging.INFO, "secret"))
+        self.handler.emit(make_record(logging.INFO, "public"))
+        self.assertEqual(self.lines(), ['INFO public'])
+
+    def test_arguments_rendered_when_queued(self):
+        state = ['open']
+        self.handler.emit(make_record(logging.INFO, "door %s", state))
+        state[0] = 'closed'
+        self.assertEqual(self.lines(), ["INFO door ['open']"])
@@ -0,0 +1,52 @@
+import unittest
+
+from garage_watch.metrics import MetricsRegistry
+
+
+class RenderTest(unittest.TestCase):
+
+    def test_render(self):
+        registry = MetricsRegistry()
+        polls = registry.counter('polls_total', 'Polls by board', ['board'])
+        polls.labels('door "left"').inc()
+        polls.labels('c:\\bus\nline').inc(2)
+        registry.gauge('queue_depth', 'Messages waiting').set(1.5)
+        latency = registry.histogram('latency_seconds', 'Poll latency', buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            latency.observe(value)
+
+        self.assertEqual(registry.render().split('\n'), [
+            '# HELP latency_seconds Poll latency',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{le="0.1"} 2',
+            'latency_seconds_bucket{le="1"} 3',
+            'latency_seconds_bucket{le="+Inf"} 4',
+            'latency_seconds_sum 3.65',
+            'latency_seconds_count 4',
+            '# HELP polls_total Polls by board',
+            '# TYPE polls_total counter',
+            'polls_total{board="c:\\\\bus\\nline"} 2',
+            'polls_total{board="door \\"left\\""} 1',
+            '# HELP queue_depth Messages waiting',
+            '# TYPE queue_depth gauge',
+            'queue_depth 1.5',
+            '',
+        ])
+
+    def test_labelled_histogram(self):
+        registry = MetricsRegistry()
+        latency = registry.histogram('ack_seconds', 'Ack latency', ['qos'], buckets=(1,))
+        latency.labels(1).observe(2)
+
+        self.assertEqual(registry.render().split('\n')[2:-1], [
+            'ack_seconds_bucket{qos="1",le="1"} 0',
+            'ack_seconds_bucket{qos="1",le="+Inf"} 1',
+            'ack_seconds_sum{qos="1"} 2',
+            'ack_seconds_count{qos="1"} 1',
+        ])
+
+    def test_type_conflict(self):
+        registry = MetricsRegistry()
+        registry.counter('polls_total', 'Polls')
+        with self.assertRaises(ValueError):
+            registry.gauge('polls_total', 'Polls')
@@ -0,0 +1,92 @@
+import unittest
+
+import numpy as np
+
+from twisted.internet import task
+
+from garage_watch_rpi.parking_distance import HysteresisClassifier, ParkingDistanceTracker
+
+# status codes of the sensor board
+STATUS_HOLD = 0
+STATUS_START = 1
+STATUS_APPROACH = 2
+STATUS_PARKING = 3
+STATUS_EXIT_COMPLETE = 8
+
+
+class FakeSensorControl(object):
+
+    def __init__(self):
+        self.parking_status = STATUS_HOLD
+        self.parking_distance = [0, 0]
+
+
+class HysteresisClassifierTest(unittest.TestCase):
+
+    def test_state_kept_within_hysteresis(self):
+        classifier = HysteresisClassifier([(10, 'near'), (20, 'mid')], 'far', hysteresis=2)
+        self.assertEqual(classifier.classify(15), 'mid')
+        self.assertEqual(classifier.classify(21), 'mid')
+        self.assertEqual(classifier.classify(22), 'far')
+        self.assertEqual(classifier.classify(19), 'far')
+        self.assertEqual(classifier.classify(17), 'mid')
+
+    def test_unknown_bound_not_crossed(self):
+        classifier = HysteresisClassifier([(np.nan, 'near'), (20, 'mid')], 'far', hysteresis=2)
+        classifier.level = 1
+        self.assertEqual(classifier.classify(1), 'mid')
+        self.assertEqual(classifier.classify(30), 'far')
+
+
+class ParkingDistanceTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.sc = FakeSensorControl()
+        self.tracker = ParkingDistanceTracker(method='median', clock=self.clock, hysteresis=5)
+        self.states = []
+        self.tracker.subscribe_state(lambda state, previous: self.states.append(state))
+
+    def sample(self, status, distance):
+        self.clock.advance(0.25)
+        self.sc.parking_status = status
+        self.sc.parking_distance = [distance, distance + 20]
+        self.tracker.update(self.sc)
+        return self.tracker.state
+
+    def test_threshold_learned_from_board(self):
+        self.assertEqual(self.sample(STATUS_START, 200), 'parking_start')
+        self.sample(STATUS_APPROACH, 148)
+        self.assertAlmostEqual(self.tracker.thresholds()[3], 148)
+        self.assertTrue(np.isnan(self.tracker.thresholds()[:3]).all())
+        # taken once the smoothed distance clearly crossed it
+        for distance in (140, 130, 120):
+            self.sample(STATUS_APPROACH, distance)
+        self.assertEqual(self.states, ['parking_start', 'parking_approach'])
+
+    def test_jitter_around_threshold_does_not_flicker(self):
+        for distance in (200, 180, 160):
+            self.sample(STATUS_START, distance)
+        # the board flips with the jitter of the raw distance
+        for i in range(20):
+            if i % 2:
+                self.sample(STATUS_START, 151)
+            else:
+                self.sample(STATUS_APPROACH, 149)
+        self.assertEqual(self.states, ['parking_start'])
+
+        for distance in (140, 120, 100, 90, 85, 80, 80, 80):
+            self.sample(STATUS_APPROACH if distance > 90 else STATUS_PARKING, distance)
+        self.assertEqual(self.states, ['parking_start', 'parking_approach', 'parking_parking'])
+
+    def test_unknown_threshold_follows_board(self):
+        self.sample(STATUS_START, 200)
+        # a jump over thresholds not seen yet
+        self.assertEqual(self.sample(STATUS_PARKING, 80), 'parking_parking')
+
+    def test_exit_and_hold_follow_board(self):
+        self.sample(STATUS_START, 200)
+        self.assertEqual(self.sample(STATUS_EXIT_COMPLETE, 200), 'exit_complete')
+        self.assertEqual(self.sample(STATUS_HOLD, 0), 'hold')
+        self.assertEqual(self.states, ['parking_start', 'exit_complete', 'hold'])
+        self.assertEqual(len(self.tracker.series), 0)
@@ -0,0 +1,108 @@
+import unittest
+
+from twisted.internet import task
+
+from garage_watch_rpi.fake_bus import FakeSMBus, make_frame
+from garage_watch_rpi.polling import AdaptivePollingPolicy, FixedPollingPolicy
+from garage_watch_rpi.sensor_control import SensorControl
+
+ADDRESS = 0x27
+
+
+class AdaptivePollingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.bus = FakeSMBus()
+        self.bus.set_frame(ADDRESS, make_frame())
+        self.policy = AdaptivePollingPolicy(min_interval=0.25, max_interval=2, backoff=2, fast_polls=2)
+        self.sc = SensorControl(ADDRESS, bus=self.bus, clock=self.clock, policy=self.policy)
+
+    def next_poll_in(self):
+        calls = self.clock.getDelayedCalls()
+        self.assertEqual(len(calls), 1)
+        return calls[0].getTime() - self.clock.seconds()
+
+    def start(self, sc=None, *args):
+        """
+        Start polling and run the first poll, scheduled right away
+        """
+        (sc or self.sc).start(*args)
+        self.assertEqual(self.next_poll_in(), 0)
+        self.clock.advance(0)
+
+    def advance(self):
+        """
+        Run the next poll, returns the interval until the following one
+        """
+        self.clock.advance(self.next_poll_in())
+        return self.next_poll_in()
+
+    def test_idle_board_polled_at_max_interval(self):
+        self.start()
+        self.assertEqual(self.bus.reads, 1)
+        self.assertEqual(self.next_poll_in(), 2)
+        self.assertEqual(self.advance(), 2)
+        self.assertEqual(self.bus.reads, 2)
+
+    def test_change_polls_fast_then_backs_off(self):
+        self.start()
+        self.bus.set_frame(ADDRESS, make_frame(door_open=True))
+        intervals = [self.advance() for _ in range(6)]
+        self.assertEqual(intervals, [0.25, 0.25, 0.25, 0.5, 1, 2])
+        self.assertEqual(self.sc.stats.changes, 1)
+
+        # a new change recovers the fast rate
+        self.bus.set_frame(ADDRESS, make_frame(door_open=False))
+        self.assertEqual(self.advance(), 0.25)
+
+    def test_failed_reads_back_off_and_recover(self):
+        self.start()
+        self.bus.set_frame(ADDRESS, make_frame(door_open=True))
+        self.advance()
+        self.bus.fail = True
+        intervals = [self.advance() for _ in range(5)]
+        self.assertEqual(intervals, [0.25, 0.25, 0.5, 1, 2])
+        self.assertTrue(self.sc.is_door_open())
+
+        self.bus.fail = False
+        self.bus.set_frame(ADDRESS, make_frame(door_open=False))
+        self.assertEqual(self.advance(), 0.25)
+        self.assertFalse(self.sc.is_door_open())
+
+    def test_parking_mode_caps_interval(self):
+        self.start()
+        self.bus.set_frame(ADDRESS, make_frame(parking_status=0x02, parking_distance=(50, 60)))
+        intervals = [self.advance() for _ in range(6)]
+        self.assertEqual(intervals, [0.25, 0.25, 0.25, 0.5, 0.5, 0.5])
+
+        self.bus.set_frame(ADDRESS, make_frame(parking_status=0x00))
+        intervals = [self.advance() for _ in range(6)]
+        self.assertEqual(intervals, [0.25, 0.25, 0.25, 0.5, 1, 2])
+
+    def test_events_dispatched(self):
+        events = []
+        self.sc.add_event_handler('door_open', lambda data: events.append('open'))
+        self.sc.add_event_handler('override_button_pressed', lambda data: events.append('button'))
+        self.start()
+        self.bus.set_frame(ADDRESS, make_frame(door_open=True, events=[0x03]))
+        self.advance()
+        self.advance()
+        self.assertEqual(events, ['open', 'button'])
+
+    def test_stop_cancels_poll(self):
+        self.start()
+        self.sc.stop()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_interval_with_policy_rejected(self):
+        with self.assertRaises(ValueError):
+            self.sc.start(1)
+
+    def test_interval_sets_fixed_policy(self):
+        sc = SensorControl(ADDRESS, bus=self.bus, clock=self.clock)
+        self.start(sc, 1)
+        self.assertIsInstance(sc.policy, FixedPollingPolicy)
+        self.assertEqual(self.next_poll_in(), 1)
+        self.bus.set_frame(ADDRESS, make_frame(door_open=True))
+        self.assertEqual(self.advance(), 1)
@@ -0,0 +1,42 @@
+import unittest
+
+from garage_watch_rpi.publish_queue import PublishQueue
+
+
+class PublishQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = PublishQueue(max_messages=4)
+
+    def drained(self):
+        return [(topic, message) for topic, message, _, _ in self.queue.drain()]
+
+    def test_events_flushed_in_order(self):
+        for i in range(3):
+            self.queue.put('garage/event', str(i))
+        self.assertEqual(self.drained(), [('garage/event', '0'), ('garage/event', '1'), ('garage/event', '2')])
+        self.assertEqual(len(self.queue), 0)
+
+    def test_states_compacted_to_latest_where_last_published(self):
+        self.queue.put('garage/door', 'ON', compact=True)
+        self.queue.put('garage/event', 'a')
+        self.queue.put('garage/door', 'OFF', compact=True)
+        self.queue.put('garage/camera', 'record', compact=True)
+        self.queue.put('garage/door', 'ON', compact=True)
+        self.assertEqual(self.drained(), [
+            ('garage/event', 'a'),
+            ('garage/camera', 'record'),
+            ('garage/door', 'ON'),
+        ])
+        self.assertEqual(self.queue.stats()['compacted'], 2)
+
+    def test_retain_kept(self):
+        self.queue.put('garage/snapshot', b'jpeg', retain=True, compact=True)
+        self.assertEqual(list(self.queue.drain()), [('garage/snapshot', b'jpeg', True, True)])
+
+    def test_oldest_dropped_when_full(self):
+        with self.assertLogs('garage_watch_rpi.publish_queue', 'WARNING'):
+            for i in range(6):
+                self.queue.put('garage/event', str(i))
+        self.assertEqual([message for _, message in self.drained()], ['2', '3', '4', '5'])
+        self.assertEqual(self.queue.stats()['dropped'], 2)
@@ -0,0 +1,126 @@
+import unittest
+
+from twisted.internet import defer, task
+
+from garage_watch_rpi.publish_window import AdaptiveWindow, WindowedPublisher
+
+
+class AdaptiveWindowTest(unittest.TestCase):
+
+    def test_grows_by_one_per_window_of_fast_acks(self):
+        window = AdaptiveWindow(initial=2, maximum=16, target_latency=0.5)
+        for _ in range(2):
+            window.on_ack(0.1)
+        self.assertEqual(window.size, 2)
+        window.on_ack(0.1)
+        self.assertEqual(window.size, 3)
+
+    def test_halves_on_slow_acks_and_failures(self):
+        window = AdaptiveWindow(initial=8, minimum=1, maximum=16, target_latency=0.5)
+        window.on_ack(1.0)
+        self.assertEqual(window.size, 4)
+        window.on_failure()
+        self.assertEqual(window.size, 2)
+        for _ in range(5):
+            window.on_failure()
+        self.assertEqual(window.size, 1)
+
+    def test_capped_at_maximum(self):
+        window = AdaptiveWindow(initial=3, maximum=4)
+        for _ in range(100):
+            window.on_ack(0.01)
+        self.assertEqual(window.size, 4)
+
+
+class WindowedPublisherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.sent = []
+        self.requeued = []
+        self.publisher = WindowedPublisher(
+            self.send, lambda *args: self.requeued.append(args), self.clock,
+            window=AdaptiveWindow(initial=2, maximum=4))
+        self.publisher.connect()
+        self.max_in_flight = 0
+
+    def send(self, topic, message, retain, qos):
+        d = defer.Deferred()
+        self.sent.append((message, d))
+        self.max_in_flight = max(self.max_in_flight, self.publisher.in_flight)
+        return d
+
+    def publish(self, message):
+        d = self.publisher.publish('garage/state', message, False, False, 1)
+        d.addErrback(lambda failure: None)
+        return d
+
+    def ack(self, index, latency=0.1):
+        self.clock.advance(latency)
+        self.sent[index][1].callback(None)
+
+    def nack(self, index):
+        self.sent[index][1].errback(RuntimeError("timeout"))
+
+    def test_in_flight_never_above_window(self):
+        for i in range(10):
+            self.publish(str(i))
+        self.assertEqual(len(self.sent), 2)
+        acked = 0
+        while acked < len(self.sent):
+            self.ack(acked)
+            acked += 1
+            self.assertLessEqual(self.publisher.in_flight, self.publisher.window.size)
+        self.assertEqual([message for message, _ in self.sent], [str(i) for i in range(10)])
+        self.assertLessEqual(self.max_in_flight, 4)
+        self.assertEqual(self.publisher.in_flight, 0)
+
+    def test_window_halved_on_failure(self):
+        self.publisher.window.window = 4.0
+        for i in range(4):
+            self.publish(str(i))
+        self.nack(0)
+        self.assertEqual(self.publisher.window.size, 2)
+        self.assertEqual(self.publisher.in_flight, 3)
+
+    def test_retries_back_off_and_stop_at_the_limit(self):
+        result = self.publish('state')
+        failures = []
+        result.addErrback(failures.append)
+        self.nack(0)
+        self.assertEqual(len(self.sent), 1)
+        self.clock.advance(0.9)
+        self.assertEqual(len(self.sent), 1)
+        self.clock.advance(0.1)
+        self.assertEqual(len(self.sent), 2)
+        self.nack(1)
+        self.clock.advance(1.9)
+        self.assertEqual(len(self.sent), 2)
+        self.clock.advance(0.1)
+        self.assertEqual(len(self.sent), 3)
+        self.nack(2)
+        self.clock.advance(60)
+        self.assertEqual(len(self.sent), 3)
+        self.assertEqual(self.publisher.stats.retries, 2)
+        self.assertEqual(self.publisher.stats.failures, 1)
+        self.assertEqual(self.publisher.in_flight, 0)
+
+    def test_retry_while_disconnected_requeued(self):
+        self.publish('state')
+        self.nack(0)
+        self.publisher.disconnect()
+        self.clock.advance(1)
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(self.requeued, [('garage/state', 'state', False, False)])
+
+    def test_waiting_requeued_on_disconnection(self):
+        for i in range(3):
+            self.publish(str(i))
+        self.publisher.disconnect()
+        self.assertEqual(self.requeued, [('garage/state', '2', False, False)])
+        # the ones in flight fail with the connection and are requeued too
+        self.nack(0)
+        self.nack(1)
+        self.publisher.connect()
+        self.assertEqual(self.publisher.in_flight, 0)
+        self.assertEqual(len(self.requeued), 3)
@@ -0,0 +1,47 @@
+from twisted.internet import task
+from twisted.trial import unittest
+
+from garage_watch_rpi.fake_bus import FakeSMBus, make_frame
+from garage_watch_rpi.sensor_control import SensorControl
+
+ADDRESS = 0x27
+
+
+class SubscriptionTest(unittest.SynchronousTestCase):
+
+    def setUp(self):
+        self.bus = FakeSMBus()
+        self.bus.set_frame(ADDRESS, make_frame())
+        self.sc = SensorControl(ADDRESS, bus=self.bus, clock=task.Clock())
+        self.calls = []
+
+    def read(self, **kwargs):
+        self.bus.set_frame(ADDRESS, make_frame(**kwargs))
+        return self.successResultOf(self.sc.poll())
+
+    def test_distance_threshold(self):
+        self.sc.subscribe('parking_distance', lambda *args: self.calls.append(args[1:3]), threshold=2)
+        self.read(parking_status=0x01, parking_distance=(100, 120))
+        self.read(parking_status=0x01, parking_distance=(101, 119))
+        self.read(parking_status=0x01, parking_distance=(97, 119))
+        self.assertEqual(self.calls, [((100, 120), None), ((97, 119), (100, 120))])
+
+    def test_distance_dispatched_outside_parking(self):
+        self.sc.subscribe('parking_distance', lambda *args: self.calls.append(args[1]))
+        self.assertFalse(self.read(parking_distance=(40, 50)))
+        self.assertEqual(self.calls, [(40, 50)])
+
+    def test_failing_subscriber_does_not_stop_processing(self):
+        def failing(*args):
+            raise RuntimeError("subscriber bug")
+
+        self.sc.subscribe('parking_distance', failing)
+        self.sc.subscribe('door', failing)
+        self.sc.subscribe('parking_status', lambda field, status, previous: self.calls.append(status))
+        self.sc.add_event_handler('override_button_pressed', lambda data: self.calls.append('button'))
+        with self.assertLogs('garage_watch_rpi.sensor_control', 'ERROR'):
+            self.assertTrue(self.read(
+                door_open=True, events=[0x03], parking_status=0x02, parking_distance=(80, 90)))
+        self.assertEqual(self.calls, ['button', 0x02])
+        self.assertEqual(self.sc.parking_status, 0x02)
+        self.assertTrue(self.sc.is_door_open())
@@ -0,0 +1,60 @@
+import unittest
+
+from twisted.internet import task
+
+from garage_watch_rpi.fake_bus import FakeSMBus, make_frame
+from garage_watch_rpi.polling import FixedPollingPolicy
+from garage_watch_rpi.sensor_manager import SensorManager
+
+
+class TimedSMBus(FakeSMBus):
+    """
+    Keeps the time and address of every read
+    """
+
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+        self.log = []
+
+    def read_i2c_block_data(self, address, register, length):
+        self.log.append((self.clock.seconds(), address))
+        return super().read_i2c_block_data(address, register, length)
+
+
+class SensorManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.bus = TimedSMBus(self.clock)
+        self.manager = SensorManager(bus=self.bus, clock=self.clock, min_spacing=0.1)
+        for address in (0x27, 0x28, 0x29):
+            self.bus.set_frame(address, make_frame())
+            self.manager.add_device(address, address, policy=FixedPollingPolicy(1))
+
+    def test_overdue_boards_read_one_per_tick(self):
+        self.manager.start()
+        # all the boards overdue at once
+        self.clock.advance(5)
+        self.clock.pump([0.05] * 10)
+        times = [t for t, _ in self.bus.log]
+        self.assertEqual(sorted(times), times)
+        for previous, current in zip(times, times[1:]):
+            self.assertGreaterEqual(current - previous, 0.1 - 1e-9)
+        self.assertEqual({address for _, address in self.bus.log}, {0x27, 0x28, 0x29})
+
+    def test_boards_keep_their_interval(self):
+        self.manager.start()
+        self.clock.pump([0.05] * 200)
+        reads = [t for t, address in self.bus.log if address == 0x28]
+        self.assertEqual(len(reads), 10)
+        for previous, current in zip(reads, reads[1:]):
+            self.assertAlmostEqual(current - previous, 1, delta=0.2)
+
+    def test_stop_stops_reads(self):
+        self.manager.start()
+        self.clock.advance(0)
+        self.manager.stop()
+        reads = self.bus.reads
+        self.clock.pump([0.5] * 10)
+        self.assertEqual(self.bus.reads, reads)
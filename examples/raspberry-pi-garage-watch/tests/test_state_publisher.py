@@ -0,0 +1,61 @@
+import unittest
+
+from twisted.internet import task
+
+from garage_watch_rpi.state_publisher import StatePublisher
+
+TOPIC = 'garage/door'
+
+
+class StatePublisherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.messages = []
+        self.publisher = StatePublisher(
+            self.publish, coalesce_window=1.0, heartbeat_interval=300, clock=self.clock)
+
+    def publish(self, topic, message, retain=False):
+        self.messages.append((self.clock.seconds(), message))
+
+    def test_first_change_published_right_away(self):
+        self.publisher.publish_state(TOPIC, 'open')
+        self.assertEqual(self.messages, [(0, 'open')])
+
+    def test_follow_ups_coalesced_until_window_ends(self):
+        self.publisher.publish_state(TOPIC, 'open')
+        self.clock.advance(0.2)
+        self.publisher.publish_state(TOPIC, 'closed')
+        self.clock.advance(0.2)
+        self.publisher.publish_state(TOPIC, 'open')
+        self.clock.advance(0.2)
+        self.publisher.publish_state(TOPIC, 'closed')
+        self.assertEqual(self.messages, [(0, 'open')])
+        self.clock.advance(0.4)
+        self.assertEqual(self.messages, [(0, 'open'), (1.0, 'closed')])
+        self.assertEqual(self.publisher.coalesced, 2)
+
+    def test_change_back_within_window_not_published(self):
+        self.publisher.publish_state(TOPIC, 'open')
+        self.publisher.publish_state(TOPIC, 'closed')
+        self.publisher.publish_state(TOPIC, 'open')
+        self.clock.advance(1)
+        self.assertEqual(self.messages, [(0, 'open')])
+
+    def test_heartbeat_does_not_delay_next_change(self):
+        self.publisher.publish_state(TOPIC, 'open')
+        self.clock.advance(300)
+        self.assertEqual(self.messages, [(0, 'open'), (300, 'open')])
+        self.clock.advance(0.1)
+        self.publisher.publish_state(TOPIC, 'closed')
+        self.assertEqual(self.messages[-1], (300.1, 'closed'))
+
+    def test_resend_states_published_before(self):
+        self.publisher.publish_state(TOPIC, 'open')
+        self.publisher.publish_state('garage/camera', 'on_hold')
+        self.clock.advance(10)
+        self.publisher.publish_state('garage/camera', 'record')
+        self.clock.advance(10)
+        self.publisher.resend(before=5)
+        self.assertEqual(self.messages[-1], (20, 'open'))
+        self.assertEqual(len(self.messages), 4)
@@ -0,0 +1,81 @@
+import unittest
+
+from twisted.internet import defer
+
+from garage_watch_rpi.frame_bus import Frame
+from garage_watch_rpi.upload_queue import UploadQueue
+
+
+class FakeUploader(object):
+    """
+    Uploads finish when the test fires them
+    """
+
+    def __init__(self):
+        self.uploads = []
+
+    def run(self, fn, frame):
+        d = defer.Deferred()
+        self.uploads.append((frame, d))
+        return d
+
+    def finish(self, result=None):
+        frame, d = self.uploads[-1]
+        d.callback(result)
+        return frame
+
+
+class UploadQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.uploader = FakeUploader()
+        self.released = []
+        self.backlog = []
+        self.queue = UploadQueue(lambda frame: None, max_pending=3, run_in_thread=self.uploader.run)
+        self.queue.add_backlog_listener(self.backlog.append)
+
+    def frame(self, name):
+        frame = Frame(bytearray(1), on_release=lambda data: self.released.append(name))
+        frame.name = name
+        return frame
+
+    def put(self, name, priority):
+        frame = self.frame(name)
+        self.queue.put(frame, priority)
+        # the publisher reference
+        frame.release()
+        return frame
+
+    def test_highest_priority_first(self):
+        self.put('first', UploadQueue.PRIORITY_SNAPSHOT)
+        self.put('snapshot', UploadQueue.PRIORITY_SNAPSHOT)
+        self.put('burst', UploadQueue.PRIORITY_BURST)
+        order = [self.uploader.finish().name]
+        while len(self.queue):
+            order.append(self.uploader.finish().name)
+        self.assertEqual(order, ['first', 'burst', 'snapshot'])
+        self.assertEqual(self.released, order)
+        self.assertEqual(self.backlog[-1], 0)
+
+    def test_full_queue_drops_newest_lowest_priority(self):
+        # one uploading, three waiting
+        self.put('uploading', UploadQueue.PRIORITY_SNAPSHOT)
+        self.put('snapshot1', UploadQueue.PRIORITY_SNAPSHOT)
+        self.put('snapshot2', UploadQueue.PRIORITY_SNAPSHOT)
+        self.put('burst1', UploadQueue.PRIORITY_BURST)
+        self.put('burst2', UploadQueue.PRIORITY_BURST)
+        self.assertEqual(self.released, ['snapshot2'])
+        self.assertEqual(self.queue.dropped, 1)
+        self.assertEqual(len(self.queue), 4)
+        order = []
+        while len(self.queue):
+            order.append(self.uploader.finish().name)
+        self.assertEqual(order, ['uploading', 'burst1', 'burst2', 'snapshot1'])
+
+    def test_failed_upload_releases_frame(self):
+        self.put('frame', UploadQueue.PRIORITY_SNAPSHOT)
+        frame, d = self.uploader.uploads[0]
+        with self.assertLogs('garage_watch_rpi.upload_queue', 'ERROR'):
+            d.errback(RuntimeError("server down"))
+        self.assertEqual(self.released, ['frame'])
+        self.assertEqual(len(self.queue), 0)
@@ -6,9 +6,16 @@ import logging
 
 from transitions import Machine
 
+from . import tracing
+from .metrics import REGISTRY
 
 logger = logging.getLogger(__name__)
 
+TRANSITIONS = REGISTRY.counter(
+    'garage_watch_camera_transitions_total', 'Transitions of the camera state machine by new state', ['state'])
+CAMERA_STATE = REGISTRY.gauge(
+    'garage_watch_camera_state', 'Current state of the camera state machine', ['state'])
+
 
 class CameraController(object):
     """
@@ -40,6 +47,12 @@ class CameraController(object):
 
     states = ('on_hold', 'prepare', 'record')
 
+    # functions called with the new state after every transition
+    state_listeners = None
+
+    # `tracing.Trace` of the door opening being handled
+    trace = None
+
     def __init__(self):
 
         # Define the transitions.Machine state machine.
@@ -48,7 +61,8 @@ class CameraController(object):
             model=self,
             states=CameraController.states,
             initial='on_hold',
-            ignore_invalid_triggers=True)
+            ignore_invalid_triggers=True,
+            after_state_change='_after_state_change')
 
         # transition on door opening while on_hold
         self.machine.add_transition(trigger='door_open', source='on_hold', dest='prepare')
@@ -69,6 +83,9 @@ class CameraController(object):
         self.machine.add_transition(trigger='cancel_requested', source='record', dest='on_hold',
                                     before=['_log_record_cancelled'])
 
+        # the gauge shows the initial state before any transition
+        self._update_state_gauge()
+
         # not documented in transitions API but it is possible to add
         # a prepare callback when an event is triggered on a state accepting it
         # it will
@@ -76,29 +93,68 @@ class CameraController(object):
             if hasattr(self, 'on_event_' + event):
                 self.machine.events[event].add_callback('prepare', 'on_event_' + event)
 
+    def add_state_listener(self, fn, *args, **kwargs):
+        """
+        Call `fn(state, *args, **kwargs)` after every transition, also
+        for transitions to the same state
+        """
+        if self.state_listeners is None:
+            self.state_listeners = []
+        self.state_listeners.append((fn, args, kwargs))
+
+    def _after_state_change(self):
+        TRANSITIONS.labels(self.state).inc()
+        self._update_state_gauge()
+        self._notify_state_listeners()
+
+    def _update_state_gauge(self):
+        for state in self.states:
+            CAMERA_STATE.labels(state).set(1 if state == self.state else 0)
+
+    def _trace_mark(self, name):
+        if self.trace is not None:
+            self.trace.mark(name)
+
+    def _trace_finish(self, outcome):
+        if self.trace is not None:
+            self.trace.finish(outcome)
+            self.trace = None
+
+    def _notify_state_listeners(self):
+        for fn, args, kwargs in self.state_listeners or ():
+            try:
+                fn(self.state, *args, **kwargs)
+            except Exception:
+                logger.exception("Error in state listener")
+
     def on_event_door_open(self):
         """
         Callback when door_open event happens in a valid state
         """
         logger.info("Door openened", extra=dict(event='door_open'))
+        self.trace = tracing.current()
+        self._trace_mark('door_open')
 
     def on_event_door_closed(self):
         """
         Callback when door_closed event happens in a valid state
         """
         logger.info("Door closed", extra=dict(event='door_closed'))
+        self._trace_finish('door_closed')
 
     def on_event_cancel_requested(self):
         """
         Callback when cancel_requested event happens in a valid state
         """
         logger.info("Cancel requested", extra=dict(event='cancel_requested'))
+        self._trace_finish('cancelled')
 
     def on_event_prepare_finished(self):
         """
         Callback when prepare_finished event happens in a valid state
         """
         logger.info("Preparations finished", extra=dict(event='prepare_finished'))
+        self._trace_mark('prepare_finished')
 
     def on_enter_prepare(self):
         """
@@ -109,6 +165,7 @@ class CameraController(object):
         checks
         """
         logger.info("Preparing to record", extra=dict(event='record_prepare_start'))
+        self._trace_mark('prepare')
         self.prepare_recording()
 
     def on_enter_record(self):
@@ -118,7 +175,12 @@ class CameraController(object):
         video
         """
         logger.info("Recording started", extra=dict(event='record_start'))
-        self.start_recording()
+        if self.trace is None:
+            self.start_recording()
+            return
+        with self.trace.span('start_recording'):
+            self.start_recording()
+        self._trace_finish('recording')
 
     def on_exit_record(self):
         """
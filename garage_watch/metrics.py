@@ -0,0 +1,243 @@
+"""
+Process metrics: counters, gauges and histograms with fixed buckets
+
+Metrics are created once, usually at import time, in the module level
+`REGISTRY`. Observations only update preallocated numbers under a lock,
+they don't allocate. Labelled metrics create their child the first time
+a label value is seen, keep a reference to the child in hot paths.
+
+`REGISTRY.render()` returns the Prometheus text exposition format.
+"""
+import bisect
+import threading
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs) + '}'
+
+
+class _Metric(object):
+
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+        if not self.labelnames:
+            self.children[()] = self._new_child()
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            assert len(values) == len(self.labelnames)
+            with self.lock:
+                child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def _default(self):
+        assert not self.labelnames, "Metric {} has labels".format(self.name)
+        return self.children[()]
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} {}'.format(self.name, self.TYPE),
+        ]
+        for values, child in sorted(self.children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+
+class _CounterChild(object):
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def render(self, name, labelnames, values):
+        return ['{}{} {}'.format(name, _format_labels(labelnames, values), _format_value(self.value))]
+
+
+class Counter(_Metric):
+    """
+    Value only going up, e.g. number of polls
+    """
+
+    TYPE = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class _GaugeChild(object):
+    __slots__ = ('value', 'function', 'lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+        self.lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, fn):
+        """
+        Take the value from `fn()` when rendered
+        """
+        self.function = fn
+
+    def render(self, name, labelnames, values):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                value = float('nan')
+        return ['{}{} {}'.format(name, _format_labels(labelnames, values), _format_value(value) if value == value else 'NaN')]
+
+
+class Gauge(_Metric):
+    """
+    Value going up and down, e.g. queue depth
+    """
+
+    TYPE = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def set_function(self, fn):
+        self._default().set_function(fn)
+
+
+class _HistogramChild(object):
+    __slots__ = ('bounds', 'counts', 'total', 'lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # the last count is for the values over every bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.total += value
+
+    def render(self, name, labelnames, values):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            cumulative += count
+            lines.append('{}_bucket{} {}'.format(
+                name, _format_labels(labelnames, values, ('le', _format_value(bound))), cumulative))
+        labels = _format_labels(labelnames, values)
+        lines.append('{}_sum{} {}'.format(name, labels, _format_value(self.total)))
+        lines.append('{}_count{} {}'.format(name, labels, cumulative))
+        return lines
+
+
+class Histogram(_Metric):
+    """
+    Distribution of values, e.g. durations, counted in fixed buckets
+    given by their upper bounds
+    """
+
+    TYPE = 'histogram'
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError("Metric {} already registered as {}".format(name, metric.TYPE))
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        """
+        Text exposition format of every metric
+        """
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        lines = []
+        for _, metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# registry of the process
+REGISTRY = MetricsRegistry()
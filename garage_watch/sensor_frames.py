@@ -0,0 +1,175 @@
+"""
+Decoding of the data frames read from the garage sensor board over I2C
+
+The layout of the frame depends on the firmware of the board:
+
+version 1 (8 bytes):
+    [0:5] event codes, [5] parking status, [6:8] parking distances
+version 2 (10 bytes):
+    as version 1 plus [8] door sensor level (0 closed) and [9] reserved
+version 3 (12 bytes):
+    [0] sequence number of the first event, [1] number of events,
+    [2:6] event codes, [6] parking status, [7:9] parking distances,
+    [9] door sensor level, [10] events dropped by the board, [11] reserved
+
+In versions 1 and 2 the board clears the events once read, events
+happening between two reads may be lost. In version 3 the board keeps the
+events in a FIFO until the host acknowledges them by writing the next
+expected sequence number to `ACK_REGISTER`. Events seen in a previous read
+are skipped, so the host can poll slowly without losing or repeating them.
+
+Frames are decoded into a reusable `SensorFrame` by indexing the data, a
+poll doesn't create any object besides the data returned by the bus.
+"""
+import timeit
+
+# event codes in the event bytes of the frame
+EVENT_NONE = 0x00
+EVENT_DOOR_OPEN = 0x01
+EVENT_DOOR_CLOSED = 0x02
+EVENT_BUTTON = 0x03
+
+# register where version 3 boards get the acknowledged sequence number
+ACK_REGISTER = 0x10
+
+
+class SensorFrame(object):
+    """
+    Decoded frame of the sensor board. `door_open` is None when the
+    protocol version doesn't report the level of the door sensor.
+    `ack_sequence` is the sequence number to acknowledge to the board,
+    None when there is nothing to acknowledge
+    """
+    __slots__ = ('events', 'parking_status', 'parking_distance', 'door_open',
+                 'ack_sequence', 'events_lost')
+
+    def __init__(self):
+        self.events = bytearray(5)
+        self.parking_status = 0
+        self.parking_distance = [0, 0]
+        self.door_open = None
+        self.ack_sequence = None
+        self.events_lost = 0
+
+
+class SensorFrameDecoderV1(object):
+
+    VERSION = 1
+    LENGTH = 8
+
+    def decode_into(self, data, frame):
+        """
+        Decode `data` (list, bytes or memoryview of at least LENGTH
+        bytes) into the given `SensorFrame` and return it
+        """
+        if len(data) < self.LENGTH:
+            raise ValueError("Sensor frame too short: {} bytes".format(len(data)))
+        events = frame.events
+        events[0] = data[0]
+        events[1] = data[1]
+        events[2] = data[2]
+        events[3] = data[3]
+        events[4] = data[4]
+        frame.parking_status = data[5]
+        frame.parking_distance[0] = data[6]
+        frame.parking_distance[1] = data[7]
+        return frame
+
+
+class SensorFrameDecoderV2(SensorFrameDecoderV1):
+
+    VERSION = 2
+    LENGTH = 10
+
+    def decode_into(self, data, frame):
+        super().decode_into(data, frame)
+        frame.door_open = data[8] != 0x00
+        return frame
+
+
+class SensorFrameDecoderV3(object):
+    """
+    Decoder of the event FIFO protocol. It keeps the next expected
+    sequence number, so one decoder must be used per board
+    """
+
+    VERSION = 3
+    LENGTH = 12
+    MAX_EVENTS = 4
+
+    def __init__(self):
+        self.next_sequence = None
+        self.dropped = None
+
+    def decode_into(self, data, frame):
+        """
+        Decode `data` into `frame`, `frame.events` only gets the events
+        not seen in previous frames
+        """
+        if len(data) < self.LENGTH:
+            raise ValueError("Sensor frame too short: {} bytes".format(len(data)))
+        first = data[0]
+        count = min(data[1], self.MAX_EVENTS)
+        events = frame.events
+        events[:] = b'\x00\x00\x00\x00\x00'
+        n = 0
+        next_sequence = self.next_sequence
+        for i in range(count):
+            sequence = (first + i) & 0xFF
+            # sequence numbers wrap, newer ones are less than half the range ahead
+            if next_sequence is None or ((sequence - next_sequence) & 0xFF) < 0x80:
+                events[n] = data[2 + i]
+                n += 1
+        if count:
+            self.next_sequence = (first + count) & 0xFF
+            frame.ack_sequence = self.next_sequence
+        else:
+            frame.ack_sequence = None
+
+        dropped = data[10]
+        frame.events_lost = (dropped - self.dropped) & 0xFF if self.dropped is not None else 0
+        self.dropped = dropped
+
+        frame.parking_status = data[6]
+        frame.parking_distance[0] = data[7]
+        frame.parking_distance[1] = data[8]
+        frame.door_open = data[9] != 0x00
+        return frame
+
+
+DECODERS = {decoder.VERSION: decoder for decoder in (
+    SensorFrameDecoderV1, SensorFrameDecoderV2, SensorFrameDecoderV3)}
+
+
+def get_decoder(version):
+    """
+    Return a decoder for the given protocol version
+    """
+    try:
+        return DECODERS[version]()
+    except KeyError:
+        raise ValueError("Unknown sensor protocol version {}".format(version))
+
+
+def benchmark(number=100000):
+    """
+    Measure the cost of decoding a frame of each version, for the list
+    returned by smbus2 and for a bytes buffer. Returns nanoseconds per decode
+    """
+    results = {}
+    for version in sorted(DECODERS):
+        decoder = get_decoder(version)
+        frame = SensorFrame()
+        if version < 3:
+            data = [0x00, 0x03, 0x00, 0x00, 0x00, 0x02, 0x20, 0x21, 0x01, 0x00][:decoder.LENGTH]
+        else:
+            data = [0x07, 0x01, 0x03, 0x00, 0x00, 0x00, 0x02, 0x20, 0x21, 0x01, 0x00, 0x00]
+        for kind, payload in (('list', data), ('bytes', bytes(data))):
+            seconds = timeit.timeit(lambda: decoder.decode_into(payload, frame), number=number)
+            results[(version, kind)] = seconds / number * 1e9
+    return results
+
+
+if __name__ == '__main__':
+    for (version, kind), ns in sorted(benchmark().items()):
+        print("v{} {:5} {:8.1f} ns/frame".format(version, kind, ns))
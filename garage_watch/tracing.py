@@ -0,0 +1,125 @@
+"""
+Lightweight tracing of the path of an event through the process
+
+A `Trace` starts where an event enters the process (a sensor frame
+decoded, a GPIO edge) and collects marks and spans with their offset from
+that moment, until `finish` logs them in a single line and records the
+offsets in the `garage_watch_trace_seconds` histogram.
+
+The trace being handled is made current with `activate` around the
+synchronous calls of the reactor thread, so the code down the call chain
+reaches it with `current()` without passing it along. Code running later
+(timers) has to keep a reference to the trace.
+"""
+import binascii
+import logging
+import os
+import time
+
+from contextlib import contextmanager
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+TRACE_SECONDS = REGISTRY.histogram(
+    'garage_watch_trace_seconds', 'Offset of the trace marks from the start of the trace',
+    ['trace', 'mark'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30))
+
+# trace being handled in the reactor thread
+_current = None
+
+
+class Trace(object):
+
+    def __init__(self, name, started=None):
+        self.trace_id = binascii.hexlify(os.urandom(4)).decode('ascii')
+        self.name = name
+        # time.monotonic() of the event starting the trace
+        self.started = started if started is not None else time.monotonic()
+        # (name, offset, duration or None for marks)
+        self.spans = []
+        self.finished = False
+
+    def mark(self, name):
+        """
+        Record that the event reached `name`
+        """
+        offset = time.monotonic() - self.started
+        self.spans.append((name, offset, None))
+        TRACE_SECONDS.labels(self.name, name).observe(offset)
+
+    @contextmanager
+    def span(self, name):
+        """
+        Record the start and duration of the code in the `with` block
+        """
+        start = time.monotonic()
+        try:
+            yield self
+        finally:
+            end = time.monotonic()
+            self.spans.append((name, start - self.started, end - start))
+            TRACE_SECONDS.labels(self.name, name).observe(end - self.started)
+
+    def finish(self, outcome):
+        """
+        Log the trace, only once
+        """
+        if self.finished:
+            return
+        self.finished = True
+        total = time.monotonic() - self.started
+        TRACE_SECONDS.labels(self.name, outcome).observe(total)
+        logger.info(
+            "Trace %s %s %s in %.3f s: %s", self.name, self.trace_id, outcome, total,
+            ', '.join(
+                '{} +{:.3f}'.format(name, offset) + ('' if duration is None else ' ({:.3f})'.format(duration))
+                for name, offset, duration in self.spans),
+            extra=dict(
+                event='trace', trace=self.name, trace_id=self.trace_id, outcome=outcome,
+                duration=round(total, 4),
+                spans=[dict(name=name, offset=round(offset, 4), duration=duration and round(duration, 4))
+                       for name, offset, duration in self.spans]))
+
+
+def current():
+    """
+    The trace active in the reactor thread, None if none
+    """
+    return _current
+
+
+@contextmanager
+def activate(trace):
+    """
+    Make `trace` (which may be None) current in the `with` block
+    """
+    global _current
+    previous, _current = _current, trace
+    try:
+        yield trace
+    finally:
+        _current = previous
+
+
+def mark(name):
+    """
+    Mark the current trace, if any
+    """
+    if _current is not None:
+        _current.mark(name)
+
+
+@contextmanager
+def span(name):
+    """
+    Span of the current trace, if any, around the `with` block
+    """
+    trace = _current
+    if trace is None:
+        yield None
+        return
+    with trace.span(name):
+        yield trace